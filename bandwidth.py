@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """A byte rate with a burst allowance, shared by threads and the event loop
+
+    take(n) reserves n bytes at once, letting the balance go negative, and
+    returns how long the caller has to wait before the bytes are covered.
+    Reserving up front keeps concurrent callers from all seeing a full
+    bucket and bursting together.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, size):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= size
+            return max(0.0, -self._tokens / self.rate)
+
+    def level(self):
+        """Bytes available right now; negative while callers wait"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def idle(self):
+        """Whether the bucket is full again, so dropping it changes nothing"""
+        return self.level() >= self.burst
+
+
+class BandwidthShaper:
+    """Token buckets for one direction of traffic: the whole bot, and each user by tier
+
+    A transfer waits for the slower of the global bucket and its user's
+    bucket. A rate of 0 leaves that level unlimited. Buckets of users who
+    have gone quiet are dropped, since a new one starts full anyway.
+    """
+
+    def __init__(self, rate=0, user_rate=0, premium_rate=0, burst_seconds=1.0):
+        self.rate = rate
+        self.user_rate = user_rate
+        self.premium_rate = premium_rate
+        self.burst_seconds = burst_seconds
+        self.waited = 0.0
+        self.throttled = 0
+        self._global = TokenBucket(rate, rate * burst_seconds) if rate else None
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _user_bucket(self, user_id, premium):
+        rate = self.premium_rate if premium else self.user_rate
+        if user_id is None or not rate:
+            return None
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None or bucket.rate != rate:
+                if len(self._users) > 1000:
+                    self._prune()
+                bucket = self._users[user_id] = TokenBucket(rate, rate * self.burst_seconds)
+            return bucket
+
+    def _prune(self):
+        for user_id, bucket in list(self._users.items()):
+            if bucket.idle():
+                del self._users[user_id]
+
+    def delay(self, user_id, premium, size):
+        """Reserve size bytes and return the seconds to wait before using them"""
+        delay = 0.0
+        for bucket in (self._global, self._user_bucket(user_id, premium)):
+            if bucket is not None:
+                delay = max(delay, bucket.take(size))
+        if delay:
+            with self._lock:
+                self.waited += delay
+                self.throttled += 1
+        return delay
+
+    def throttle(self, user_id, premium, size):
+        """Block the calling thread until size bytes are within the rate"""
+        delay = self.delay(user_id, premium, size)
+        if delay:
+            time.sleep(delay)
+
+    async def athrottle(self, user_id, premium, size):
+        """Wait until size bytes are within the rate"""
+        delay = self.delay(user_id, premium, size)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def ytdlp_hook(self, user_id, premium):
+        """yt-dlp progress hook that holds its download thread to the rate"""
+        done = {}
+
+        def hook(d):
+            if d['status'] != 'downloading':
+                return
+            # downloaded_bytes counts per file, and a video downloads two streams
+            name = d.get('filename')
+            total = d.get('downloaded_bytes') or 0
+            size = total - done.get(name, 0)
+            done[name] = total
+            if size > 0:
+                self.throttle(user_id, premium, size)
+
+        return hook
+
+    def stats(self):
+        with self._lock:
+            self._prune()
+            return {
+                'global_tokens': self._global.level() if self._global else None,
+                'user_buckets': len(self._users),
+                'user_tokens': {user_id: bucket.level() for user_id, bucket in self._users.items()},
+                'waited': self.waited,
+                'throttled': self.throttled,
+            }
@@ -0,0 +1,76 @@
+"""Audio requests: CPU time of passing the AAC stream through vs. encoding MP3
+
+Generates an AAC track like the one YouTube serves (m4a, 128 kbps) with the
+FFmpeg on PATH, then times the remux the bot does when the stream passes
+through against the MP3 conversion at every offered bitrate.
+
+    python benchmarks/bench_audio.py --minutes 10 --runs 3
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from media_info import AUDIO_BITRATES  # noqa: E402
+from pipeline import remux_audio, run_ffmpeg, transcode_audio  # noqa: E402
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(step, runs):
+    """Best wall time and CPU seconds of FFmpeg children over runs"""
+    best_wall = best_cpu = None
+    for _ in range(runs):
+        cpu = children_cpu()
+        started = time.perf_counter()
+        step()
+        wall = time.perf_counter() - started
+        cpu = children_cpu() - cpu
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    return best_wall, best_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--minutes', type=float, default=10, help='length of the test track')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        sys.exit("FFmpeg is not on PATH")
+
+    workdir = tempfile.mkdtemp(prefix='bench_audio_')
+    try:
+        source = os.path.join(workdir, 'source.m4a')
+        run_ffmpeg(ffmpeg, [
+            '-f', 'lavfi', '-i', f"sine=frequency=440:duration={args.minutes * 60}",
+            '-f', 'lavfi', '-i', f"anoisesrc=duration={args.minutes * 60}:amplitude=0.1",
+            '-filter_complex', 'amix=inputs=2', '-codec:a', 'aac', '-b:a', '128k', source,
+        ])
+        print(f"{args.minutes:g} min AAC track, {os.path.getsize(source) / (1024 * 1024):.1f}MB, best of {args.runs}\n")
+
+        target = os.path.join(workdir, 'remuxed.m4a')
+        wall, cpu = measure(lambda: remux_audio(ffmpeg, source, target), args.runs)
+        print(f"remux to M4A      {wall:6.2f}s wall  {cpu:6.2f}s CPU")
+        remux_cpu = cpu
+
+        for bitrate in AUDIO_BITRATES:
+            target = os.path.join(workdir, f'{bitrate}.mp3')
+            wall, cpu = measure(lambda: transcode_audio(ffmpeg, source, target, bitrate), args.runs)
+            ratio = f"{cpu / remux_cpu:5.0f}x" if remux_cpu else "    -"
+            print(f"MP3 {bitrate:>3} kbps      {wall:6.2f}s wall  {cpu:6.2f}s CPU  {ratio}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Direct-link download throughput: pooled async client vs. the old requests path
+
+Runs fully offline against a local stub HTTP server. Each new connection
+to the stub pays a configurable delay to stand in for the TCP+TLS
+handshake a real server would cost.
+
+    python benchmarks/bench_http.py --files 200 --size-kb 512 --handshake-ms 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_client import HttpClient  # noqa: E402
+
+
+def start_stub_server(size, handshake_delay):
+    """Serve size bytes on every path, keeping connections alive"""
+    payload = os.urandom(size)
+    stats = {'connections': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            with lock:
+                stats['connections'] += 1
+            time.sleep(handshake_delay)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+
+def bench_requests(base_url, files, workers):
+    """The previous path: a fresh requests.get per file on a small thread pool"""
+    def fetch(i):
+        response = requests.get(f"{base_url}/file/{i}", stream=True, timeout=60)
+        response.raise_for_status()
+        return sum(len(chunk) for chunk in response.iter_content(chunk_size=8192))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(fetch, range(files)))
+
+
+async def bench_async(base_url, files, concurrency, per_host):
+    """The new path: one pooled HttpClient, many concurrent streams"""
+    client = HttpClient(max_connections=concurrency, max_per_host=per_host)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def fetch(i):
+        async with slots:
+            async with client.stream(f"{base_url}/file/{i}") as response:
+                total = 0
+                async for chunk in response.aiter_bytes(65536):
+                    total += len(chunk)
+                return total
+
+    try:
+        return sum(await asyncio.gather(*(fetch(i) for i in range(files))))
+    finally:
+        await client.close()
+
+
+def report(name, total_bytes, elapsed, files, connections):
+    print(
+        f"{name:<28} {files / elapsed:8.1f} files/s  "
+        f"{total_bytes / elapsed / (1024 * 1024):8.1f} MB/s  "
+        f"{elapsed:6.2f}s  {connections:5d} connections"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size-kb', type=int, default=512)
+    parser.add_argument('--handshake-ms', type=float, default=50)
+    parser.add_argument('--workers', type=int, default=3, help='thread pool size of the old path')
+    parser.add_argument('--concurrency', type=int, default=100, help='concurrent downloads on the new path')
+    parser.add_argument('--per-host', type=int, default=6, help='connections per host on the new path')
+    args = parser.parse_args()
+
+    server, base_url, stats = start_stub_server(args.size_kb * 1024, args.handshake_ms / 1000)
+    print(f"{args.files} files x {args.size_kb}KB, {args.handshake_ms:.0f}ms per new connection\n")
+
+    try:
+        stats['connections'] = 0
+        started = time.perf_counter()
+        total = bench_requests(base_url, args.files, args.workers)
+        report(f"requests ({args.workers} threads)", total, time.perf_counter() - started, args.files, stats['connections'])
+
+        stats['connections'] = 0
+        started = time.perf_counter()
+        total = asyncio.run(bench_async(base_url, args.files, args.concurrency, args.per_host))
+        report(f"HttpClient ({args.per_host}/host)", total, time.perf_counter() - started, args.files, stats['connections'])
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Link classification: links.classify vs. the old regex and urlparse helpers
+
+Builds a corpus of links in the shapes people paste: YouTube watch, short,
+shorts, embed, live, mobile and music links with share and tracking
+parameters, playlists, channels, and direct downloads from CDNs, file hosts
+and lookalike domains. Times classification of every link (cold, each URL
+seen once) and of repeated links (warm, as with the same link sent by many
+users), and counts the links each approach reads differently.
+
+    python benchmarks/bench_links.py --links 100000
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from links import classify  # noqa: E402
+
+ID_CHARS = string.ascii_letters + string.digits + '-_'
+
+# The helpers bot.py used before links.py, for comparison
+OLD_YOUTUBE_PATTERN = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+
+
+def old_is_youtube_url(url):
+    return re.search(OLD_YOUTUBE_PATTERN, url) is not None
+
+
+def old_video_id(url):
+    parsed = urlparse(url if '://' in url else f'https://{url}')
+    if parsed.netloc.lower().endswith('youtu.be'):
+        video_id = parsed.path.strip('/').split('/')[0]
+    else:
+        video_id = parse_qs(parsed.query).get('v', [''])[0]
+        parts = parsed.path.strip('/').split('/')
+        if not video_id and len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+            video_id = parts[1]
+    return video_id or None
+
+
+def old_classify(url):
+    """What handle_link and the cache key made of a link: (kind, id)"""
+    if not old_is_youtube_url(url):
+        return 'direct', url
+    video_id = old_video_id(url)
+    if not video_id and 'list' in parse_qs(urlparse(url if '://' in url else f'https://{url}').query):
+        return 'playlist', None
+    return 'youtube', video_id
+
+
+def token(length):
+    return ''.join(random.choice(ID_CHARS) for _ in range(length))
+
+
+def make_corpus(count):
+    """count links in a realistic mix of shapes, popular videos shared many ways"""
+    videos = [token(11) for _ in range(max(count // 20, 1))]
+
+    def video():
+        vid = random.choice(videos)
+        share = random.choice(['', f'si={token(16)}', 'feature=share', f't={random.randrange(600)}s', 'pp=ygUFbXVzaWM%3D'])
+        return random.choice([
+            f'https://www.youtube.com/watch?v={vid}',
+            f'https://www.youtube.com/watch?v={vid}&{share}',
+            f'https://youtube.com/watch?{share}&v={vid}',
+            f'https://m.youtube.com/watch?v={vid}&{share}',
+            f'https://music.youtube.com/watch?v={vid}&list=RDAMVM{vid}',
+            f'https://youtu.be/{vid}?{share}',
+            f'https://youtu.be/{vid}',
+            f'https://www.youtube.com/shorts/{vid}?{share}',
+            f'https://youtube.com/shorts/{vid}',
+            f'https://www.youtube.com/embed/{vid}?autoplay=1',
+            f'https://www.youtube-nocookie.com/embed/{vid}',
+            f'https://www.youtube.com/live/{vid}?{share}',
+            f'https://WWW.YouTube.com/watch?v={vid}',
+            f'https://www.youtube.com/watch?v={vid}&list=PL{token(32)}&index={random.randrange(1, 50)}',
+        ])
+
+    def playlist():
+        return random.choice([
+            f'https://www.youtube.com/playlist?list=PL{token(32)}',
+            f'https://youtube.com/playlist?list=PL{token(32)}&si={token(16)}',
+            f'https://music.youtube.com/playlist?list=OLAK5uy_{token(33)}',
+        ])
+
+    def channel():
+        return random.choice([
+            f'https://www.youtube.com/@{token(10)}',
+            f'https://www.youtube.com/channel/UC{token(22)}',
+            f'https://www.youtube.com/c/{token(12)}/videos',
+        ])
+
+    def direct():
+        name = f'{token(8)}.{random.choice(["zip", "mp4", "pdf", "apk", "mkv", "iso"])}'
+        tracking = random.choice(['', f'utm_source=telegram&utm_medium=share&utm_campaign={token(6)}', f'fbclid={token(40)}'])
+        return random.choice([
+            f'https://cdn.example.com/files/{token(6)}/{name}',
+            f'https://files.example.org/{name}?{tracking}',
+            f'https://s3.amazonaws.com/bucket/{name}?X-Amz-Signature={token(64)}&X-Amz-Expires=3600&{tracking}',
+            f'https://download.example.net:8443/{name}#section',
+            f'http://mirror.example.edu/pub/{token(5)}/{name}',
+            f'https://Example.COM/{name}?{tracking}',
+            f'https://notyoutube.com/{name}',
+            f'https://example.com/redirect?u=https://youtube.com/watch?v={token(11)}',
+        ])
+
+    shapes = [video] * 60 + [playlist] * 5 + [channel] * 5 + [direct] * 30
+    return [random.choice(shapes)() for _ in range(count)]
+
+
+def time_calls(fn, urls):
+    started = time.perf_counter()
+    for url in urls:
+        fn(url)
+    return (time.perf_counter() - started) / len(urls) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--links', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=2000, help='distinct links in the warm run')
+    args = parser.parse_args()
+
+    random.seed(1)
+    corpus = make_corpus(args.links)
+    popular = corpus[:args.distinct]
+    repeated = [random.choice(popular) for _ in range(args.links)]
+    print(f"{args.links} links, warm run over {args.distinct} distinct ones\n")
+
+    print(f"old helpers, per link         {time_calls(old_classify, corpus):6.2f}µs")
+    classify.cache_clear()
+    print(f"classify, cold                {time_calls(classify, corpus):6.2f}µs")
+    classify.cache_clear()
+    print(f"old helpers, repeated links   {time_calls(old_classify, repeated):6.2f}µs")
+    print(f"classify, repeated links      {time_calls(classify, repeated):6.2f}µs\n")
+
+    classify.cache_clear()
+    differ = {}
+    sent, old_keys, new_keys = set(), set(), set()
+    for url in corpus:
+        old_kind, old_id = old_classify(url)
+        link = classify(url)
+        kind = link.kind if link else None
+        if old_kind != kind:
+            differ.setdefault(f"{old_kind} -> {kind}", url)
+        if kind == 'youtube' and link.id:
+            sent.add(url)
+            old_keys.add(old_id or url)
+            new_keys.add(link.id)
+    print("read differently (old kind -> new kind), with an example:")
+    for change, url in sorted(differ.items()):
+        print(f"  {change:20} {url}")
+    print(
+        f"\nvideo links: {len(sent)} distinct as sent, {len(old_keys)} distinct cache keys before, "
+        f"{len(new_keys)} now"
+    )
+
+
+if __name__ == '__main__':
+    main()
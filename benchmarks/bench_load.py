@@ -0,0 +1,461 @@
+"""End-to-end load test: a mix of audio, video, file and batch requests through the real handlers
+
+Runs fully offline. A fake Bot API and a local media server run in their own
+processes; yt-dlp extraction is stubbed to return metadata whose streams point
+at the media server, and unless --real-ffmpeg is given a stub FFmpeg copies
+its input after a configurable delay. Each request is a separate user driving
+the same updates Telegram would send: the link, then for YouTube the format
+and quality buttons. A request ends when its file reaches the fake Bot API;
+a batch request (--batch-size YouTube links in one message, as audio) ends
+when the batch reports every item sent. With --local-api the fake Bot API
+stands in for a local server and reads uploads from the paths it is given.
+
+    python benchmarks/bench_load.py --requests 60 --concurrency 12 --mix audio=1,video=1,file=2
+    python benchmarks/bench_load.py --requests 12 --mix batch --batch-size 6
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+UPLOADS = {'sendAudio': 'audio', 'sendVideo': 'video', 'sendDocument': 'document'}
+# Final texts of a request that didn't end in an upload
+FAILURE_PREFIXES = ('❌', '⏱️', '🚦', '💾', '🌐')
+
+STUB_FFMPEG = '''#!{python}
+import os, shutil, sys, time
+args = sys.argv[1:]
+source, target = args[args.index('-i') + 1], args[-1]
+shutil.copyfile(source, target)
+# Stream copies (merges, audio remux) cost next to nothing next to an encode
+if 'copy' not in args:
+    time.sleep(os.path.getsize(source) / (1024 * 1024) * {ms_per_mb} / 1000)
+'''
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(handler, port):
+    """Run an HTTP server in this (child) process, publishing its port"""
+    with Server(('127.0.0.1', 0), handler) as server:
+        port.value = server.server_address[1]
+        server.serve_forever()
+
+
+def start_process(target, *args):
+    port = multiprocessing.Value('i', 0)
+    process = multiprocessing.Process(target=target, args=(*args, port), daemon=True)
+    process.start()
+    while not port.value:
+        time.sleep(0.01)
+    return process, port.value
+
+
+def uploaded_size(value, body):
+    """Bytes an upload carried: the file behind a local-mode file:// path, else the request body"""
+    if isinstance(value, str) and value.startswith('file://'):
+        return os.path.getsize(unquote(urlparse(value).path))
+    return len(body)
+
+
+def run_bot_api(latency, events, port):
+    """Fake Bot API: acknowledges every method and reports what each chat was sent"""
+    message_ids = iter(range(1, 10 ** 9))
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            method = self.path.rsplit('/', 1)[-1]
+            content_type = self.headers.get('Content-Type', '')
+            if content_type.startswith('application/json'):
+                params = json.loads(body or b'{}')
+            elif content_type.startswith('multipart/form-data'):
+                # Uploads: only the plain fields matter here
+                params = {
+                    name.decode(): value.decode(errors='replace')
+                    for name, value in re.findall(rb'name="(\w+)"\r\n\r\n([^\r]*)\r\n', body)
+                }
+            else:
+                params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+            time.sleep(latency)
+            chat = {'id': int(params.get('chat_id', 0)), 'type': 'private'}
+            with lock:
+                message_id = next(message_ids)
+            result = True
+            if method == 'getMe':
+                result = BOT_USER
+            elif method == 'sendMediaGroup':
+                media = json.loads(params['media'])
+                result = []
+                for item in media:
+                    with lock:
+                        message_id = next(message_ids)
+                    sent = {'file_id': f'file{message_id}', 'file_unique_id': f'u{message_id}'}
+                    if item['type'] != 'document':
+                        sent['duration'] = 60
+                    if item['type'] == 'video':
+                        sent.update(width=640, height=360)
+                    result.append({'message_id': message_id, 'date': int(time.time()), 'chat': chat, item['type']: sent})
+                size = sum(uploaded_size(item['media'], b'') for item in media) or len(body)
+                events.put((chat['id'], method, message_id, str(len(media)), False, size, time.time()))
+            elif method in ('sendMessage', 'editMessageText') or method in UPLOADS:
+                if method == 'editMessageText':
+                    message_id = int(params['message_id'])
+                result = {'message_id': message_id, 'date': int(time.time()), 'chat': chat}
+                if method in UPLOADS:
+                    media = {'file_id': f'file{message_id}', 'file_unique_id': f'u{message_id}'}
+                    if method != 'sendDocument':
+                        media['duration'] = 60
+                    if method == 'sendVideo':
+                        media.update(width=640, height=360)
+                    result[UPLOADS[method]] = media
+                else:
+                    result['text'] = params.get('text', '')
+                size = uploaded_size(params.get(UPLOADS.get(method)), body)
+                events.put((chat['id'], method, message_id, params.get('text', ''),
+                            'reply_markup' in params, size, time.time()))
+
+            payload = json.dumps({'ok': True, 'result': result}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    serve(Handler, port)
+
+
+def run_media_server(port):
+    """Serve /<bytes>/<name> as that many bytes, with validators and range support"""
+    block = os.urandom(1024 * 1024)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _headers(self):
+            size = int(self.path.split('/')[1])
+            start, end = 0, size - 1
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', f'"{self.path}"')
+            self.end_headers()
+            return start, end
+
+        def do_HEAD(self):
+            self._headers()
+
+        def do_GET(self):
+            start, end = self._headers()
+            position = start
+            while position <= end:
+                offset = position % len(block)
+                chunk = block[offset:offset + min(len(block) - offset, end - position + 1)]
+                self.wfile.write(chunk)
+                position += len(chunk)
+
+        def log_message(self, *args):
+            pass
+
+    serve(Handler, port)
+
+
+def fake_info(video_id, media_url, args):
+    """Metadata the stubbed extractor returns, with streams on the media server"""
+    mb = 1024 * 1024
+    audio = int(args.audio_mb * mb)
+    video = int(args.video_mb * mb)
+    formats = [{
+        'format_id': '140', 'ext': 'm4a', 'acodec': 'mp4a.40.2', 'vcodec': 'none',
+        'abr': 128, 'tbr': 128, 'filesize': audio, 'protocol': 'https',
+        'url': f'{media_url}/{audio}/{video_id}.m4a',
+    }]
+    for format_id, height, scale in (('134', 360, 1), ('136', 720, 3)):
+        formats.append({
+            'format_id': format_id, 'ext': 'mp4', 'acodec': 'none', 'vcodec': 'avc1.4d401e',
+            'height': height, 'width': height * 16 // 9, 'tbr': 500 * scale, 'filesize': video * scale,
+            'protocol': 'https', 'url': f'{media_url}/{video * scale}/{video_id}.{height}.mp4',
+        })
+    return {
+        'id': video_id, 'title': f'Benchmark {video_id}', 'duration': 60, 'uploader': 'Bench',
+        'formats': formats, 'extractor': 'youtube', 'extractor_key': 'Youtube',
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+    }
+
+
+def stub_extractor(media_url, args):
+    """Answer yt-dlp extraction of benchmark videos without touching YouTube"""
+    import yt_dlp
+
+    extract_info = yt_dlp.YoutubeDL.extract_info
+
+    def fake_extract_info(self, url, *a, **kw):
+        match = re.search(r'[?&]v=(bench\d+)', url)
+        if not match:
+            return extract_info(self, url, *a, **kw)
+        time.sleep(args.extract_ms / 1000)
+        return fake_info(match.group(1), media_url, args)
+
+    yt_dlp.YoutubeDL.extract_info = fake_extract_info
+
+
+class Chats:
+    """Routes fake Bot API events to the request waiting on that chat"""
+
+    def __init__(self, events, loop):
+        self.queues = {}
+        self.upload_bytes = 0
+        self._loop = loop
+        self._events = events
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        while True:
+            event = self._events.get()
+            self._loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event):
+        if event[1] in UPLOADS or event[1] == 'sendMediaGroup':
+            self.upload_bytes += event[5]
+        self.queues.setdefault(event[0], asyncio.Queue()).put_nowait(event)
+
+    async def next(self, chat_id, want):
+        """Wait for the chat's next event matching want(event); None on a failure message"""
+        events = self.queues.setdefault(chat_id, asyncio.Queue())
+        while True:
+            event = await events.get()
+            _, method, _, text, has_markup, _, _ = event
+            if want(event):
+                return event
+            if method in ('sendMessage', 'editMessageText') and not has_markup and text.startswith(FAILURE_PREFIXES):
+                return None
+
+
+def user_update(update_id, user_id, **payload):
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'User'}
+    chat = {'id': user_id, 'type': 'private'}
+    if 'text' in payload:
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': payload['text'],
+        }}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user, 'chat_instance': str(user_id), 'data': payload['data'],
+        'message': {'message_id': payload['message_id'], 'date': int(time.time()), 'chat': chat, 'text': 'menu'},
+    }}
+
+
+async def run_request(app, chats, number, kind, media_url, args):
+    """Drive one request through the handlers; returns its latency, or None if it failed"""
+    from telegram import Update
+
+    user_id = 100000 + number
+    update_ids = iter(range(number * 10, number * 10 + 10))
+
+    async def send(**payload):
+        await app.update_queue.put(Update.de_json(user_update(next(update_ids), user_id, **payload), app.bot))
+
+    def menu(event):
+        return event[1] == 'editMessageText' and event[4]
+
+    started = time.perf_counter()
+    if kind == 'file':
+        size = int(args.file_mb * 1024 * 1024)
+        await send(text=f'{media_url}/{size}/file{number}.bin')
+    else:
+        links = [f'https://www.youtube.com/watch?v=bench{number:06d}']
+        if kind == 'batch':
+            links = [f'https://www.youtube.com/watch?v=bench{number:04d}{item:02d}' for item in range(args.batch_size)]
+        await send(text='\n'.join(links))
+        choice = await chats.next(user_id, menu)
+        if choice is None:
+            return None
+        await send(data='format_video' if kind == 'video' else 'format_audio', message_id=choice[2])
+        choice = await chats.next(user_id, menu)
+        if choice is None:
+            return None
+        await send(data='video_360' if kind == 'video' else 'audio_128', message_id=choice[2])
+
+    if kind == 'batch':
+        done = await chats.next(user_id, lambda event: event[3].startswith('✅ Batch Complete'))
+        return time.perf_counter() - started if done and '❌ Failed: 0' in done[3] else None
+    done = await chats.next(user_id, lambda event: event[1] in UPLOADS)
+    return time.perf_counter() - started if done else None
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def tree_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+async def run(args, workdir, media_url, api_url, events):
+    stub_extractor(media_url, args)
+    import bot
+
+    mix = [kind for kind, weight in args.mix for _ in range(weight)]
+    kinds = [mix[i % len(mix)] for i in range(args.requests)]
+
+    app = bot.build_application(base_url=api_url)
+    chats = Chats(events, asyncio.get_running_loop())
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies = {kind: [] for kind, _ in args.mix}
+    failures = {kind: 0 for kind, _ in args.mix}
+    peak_disk = 0
+
+    async def sample_disk():
+        nonlocal peak_disk
+        while True:
+            peak_disk = max(peak_disk, await asyncio.to_thread(tree_size, workdir))
+            await asyncio.sleep(0.25)
+
+    async def request(number, kind):
+        async with slots:
+            try:
+                latency = await asyncio.wait_for(run_request(app, chats, number, kind, media_url, args), args.timeout)
+            except asyncio.TimeoutError:
+                latency = None
+        if latency is None:
+            failures[kind] += 1
+        else:
+            latencies[kind].append(latency)
+
+    async with app:
+        await bot.on_startup(app)
+        await app.start()
+        sampler = asyncio.create_task(sample_disk())
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(request(number, kind) for number, kind in enumerate(kinds)))
+            elapsed = time.perf_counter() - started
+        finally:
+            sampler.cancel()
+            await app.stop()
+            await bot.on_shutdown(app)
+
+    everything = [latency for values in latencies.values() for latency in values]
+    print(
+        f"{args.requests} requests ({', '.join(f'{kind}={weight}' for kind, weight in args.mix)}), "
+        f"concurrency {args.concurrency}, {args.api_latency_ms:.0f}ms Bot API latency, "
+        f"{'real' if args.real_ffmpeg else 'stub'} FFmpeg"
+        f"{', local Bot API' if args.local_api else ''}\n"
+    )
+    print(f"{'':8}{'done':>6}{'failed':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for kind, values in list(latencies.items()) + [('all', everything)]:
+        failed = sum(failures.values()) if kind == 'all' else failures[kind]
+        print(
+            f"{kind:8}{len(values):>6}{failed:>8}"
+            + ''.join(f"{percentile(values, p):>8.2f}s" for p in (0.5, 0.95, 0.99))
+        )
+    print(f"\nthroughput  {len(everything) / elapsed * 60:.1f} jobs/min ({elapsed:.1f}s)")
+    print(f"uploaded    {chats.upload_bytes / (1024 * 1024):.1f}MB")
+    print(f"peak RSS    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB")
+    print(f"peak disk   {peak_disk / (1024 * 1024):.1f}MB")
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('audio', 'video', 'file', 'batch'):
+            raise argparse.ArgumentTypeError(f"Unknown request kind: {kind}")
+        mix.append((kind, int(weight or 1)))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=12, help='requests in flight at once')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('audio=1,video=1,file=2'),
+                        help='request kinds and their weights')
+    parser.add_argument('--api-latency-ms', type=float, default=50, help='delay of every fake Bot API call')
+    parser.add_argument('--extract-ms', type=float, default=800, help='delay of the stubbed yt-dlp extraction')
+    parser.add_argument('--transcode-ms-per-mb', type=float, default=40, help='delay of the stub FFmpeg')
+    parser.add_argument('--audio-mb', type=float, default=2)
+    parser.add_argument('--video-mb', type=float, default=8, help='size of the 360p video stream')
+    parser.add_argument('--file-mb', type=float, default=4)
+    parser.add_argument('--batch-size', type=int, default=4, help='links in each batch message')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds before a request counts as failed')
+    parser.add_argument('--real-ffmpeg', action='store_true', help='use the FFmpeg on PATH instead of the stub')
+    parser.add_argument('--local-api', action='store_true', help='run the bot against a local Bot API server')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    events = multiprocessing.Queue()
+    api, api_port = start_process(run_bot_api, args.api_latency_ms / 1000, events)
+    media, media_port = start_process(run_media_server)
+    try:
+        if not args.real_ffmpeg:
+            bin_dir = os.path.join(workdir, 'bin')
+            os.makedirs(bin_dir)
+            ffmpeg = os.path.join(bin_dir, 'ffmpeg')
+            with open(ffmpeg, 'w') as f:
+                f.write(STUB_FFMPEG.format(python=sys.executable, ms_per_mb=args.transcode_ms_per_mb))
+            os.chmod(ffmpeg, os.stat(ffmpeg).st_mode | stat.S_IEXEC)
+            os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+        # The bot keeps its downloads, journal and caches relative to the working directory
+        os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+        # One log line per job would drown the report
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        if args.local_api:
+            os.environ['BOT_API_MODE'] = 'local'
+            os.environ['BOT_API_URL'] = f'http://127.0.0.1:{api_port}'
+        os.chdir(workdir)
+        asyncio.run(run(
+            args, workdir, f'http://127.0.0.1:{media_port}', f'http://127.0.0.1:{api_port}/bot', events
+        ))
+    finally:
+        api.terminate()
+        media.terminate()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
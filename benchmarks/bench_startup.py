@@ -0,0 +1,171 @@
+"""Startup time: import breakdown and time from launch to the first answered update
+
+Runs fully offline. Imports bot.py under `python -X importtime` and lists the
+modules that cost the most, then launches `python bot.py` in polling mode
+against a stub Bot API (as a local Bot API server) and times how long until
+it polls getUpdates and until it answers the /start handed to it. The
+"eager" runs import yt_dlp before bot.py, as bot.py used to at the top.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT = os.path.join(ROOT, 'bot.py')
+TOKEN = '123456:BENCHMARK'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+USER = {'id': 42, 'is_bot': False, 'first_name': 'User'}
+START = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'from': USER,
+        'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+    },
+}
+
+
+def start_stub_api():
+    """Bot API stub that hands out one /start and records when things happened"""
+    events = {}
+    seen = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            method = self.path.rsplit('/', 1)[-1]
+            if method == 'getMe':
+                result = BOT_USER
+            elif method == 'getUpdates':
+                if 'first_poll' not in events:
+                    events['first_poll'] = time.perf_counter()
+                    result = [START]
+                else:
+                    time.sleep(0.2)
+                    result = []
+            elif method == 'sendMessage':
+                events.setdefault('first_reply', time.perf_counter())
+                seen.set()
+                result = {'message_id': 2, 'date': 0, 'chat': START['message']['chat'], 'text': ''}
+            else:
+                result = True
+            payload = json.dumps({'ok': True, 'result': result}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # The bot hangs up on its pending getUpdates when it stops
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, events, seen
+
+
+def bot_env(port):
+    env = dict(os.environ)
+    env.update(
+        BOT_TOKEN=TOKEN, BOT_MODE='polling', BOT_API_MODE='local',
+        BOT_API_URL=f'http://127.0.0.1:{port}', METRICS_PORT='0', LOG_LEVEL='WARNING',
+    )
+    return env
+
+
+def time_startup(eager):
+    """Seconds from launch to the first getUpdates and to the reply to /start"""
+    server, events, seen = start_stub_api()
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    if eager:
+        command = [sys.executable, '-c', f"import runpy, sys, yt_dlp; sys.path.insert(0, {ROOT!r}); runpy.run_path({BOT!r}, run_name='__main__')"]
+    else:
+        command = [sys.executable, BOT]
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=workdir, env=bot_env(server.server_address[1]),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        if not seen.wait(60):
+            raise RuntimeError(f"the bot never answered: {process.stderr.read1().decode()[-500:]}")
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return events['first_poll'] - started, events['first_reply'] - started
+
+
+def import_breakdown(top):
+    """Cumulative import time in ms of bot.py and of its heaviest direct imports"""
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {ROOT!r}); import bot"],
+            cwd=workdir, env=dict(os.environ, BOT_TOKEN=TOKEN, LOG_LEVEL='WARNING'),
+            capture_output=True, text=True, check=True,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    total, modules = 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Direct imports of bot are indented by two spaces
+        if name.startswith('   ') and not name.startswith('    '):
+            modules.append((int(cumulative) / 1000, name.strip()))
+        elif name.strip() == 'bot':
+            total = int(cumulative) / 1000
+    return total, sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='heaviest imports to list')
+    args = parser.parse_args()
+
+    total, modules = import_breakdown(args.top)
+    print(f"import bot: {total:.0f}ms, heaviest direct imports:")
+    for ms, name in modules:
+        print(f"  {ms:7.1f}ms  {name}")
+    yt_dlp_ms = subprocess.run(
+        [sys.executable, '-c', "import time; t = time.perf_counter(); import yt_dlp; print((time.perf_counter() - t) * 1000)"],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    print(f"  (yt_dlp, now loaded in the background: {float(yt_dlp_ms):.0f}ms)\n")
+
+    print(f"launch to first poll / first reply, median of {args.runs}:")
+    for label, eager in (("lazy yt_dlp", False), ("eager yt_dlp", True)):
+        runs = [time_startup(eager) for _ in range(args.runs)]
+        poll = statistics.median(run[0] for run in runs)
+        reply = statistics.median(run[1] for run in runs)
+        print(f"  {label:13} {poll * 1000:6.0f}ms / {reply * 1000:6.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
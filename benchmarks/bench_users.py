@@ -0,0 +1,79 @@
+"""User store: premium lookup latency and usage write throughput
+
+Compares the cached premium check with a lookup that goes to SQLite every
+time, and batched usage counters with one commit per finished download,
+all against a temporary database.
+
+    python benchmarks/bench_users.py --users 10000 --lookups 200000 --downloads 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from users import ADD_USAGE, UserStore, today  # noqa: E402
+
+
+def per_call(seconds, count):
+    return f"{seconds / count * 1e6:8.2f}µs/call"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--downloads', type=int, default=20000)
+    parser.add_argument('--flush-every', type=int, default=500, help='downloads between flushes')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_users_')
+    path = os.path.join(workdir, 'users.db')
+    store = UserStore(path)
+    for user_id in range(0, args.users, 10):
+        store.grant(user_id)
+    ids = [random.randrange(args.users) for _ in range(args.lookups)]
+    downloads = [(random.randrange(args.users), random.randrange(1, 50 * 1024 * 1024)) for _ in range(args.downloads)]
+
+    print(f"{args.users} users, {args.lookups} lookups, {args.downloads} downloads\n")
+
+    uncached = UserStore(path, cache_ttl=0)
+    started = time.perf_counter()
+    for user_id in ids:
+        uncached.is_premium(user_id)
+    print(f"is_premium, SQLite every call  {per_call(time.perf_counter() - started, len(ids))}")
+
+    started = time.perf_counter()
+    for user_id in ids:
+        store.is_premium(user_id)
+    print(f"is_premium, read-through cache {per_call(time.perf_counter() - started, len(ids))}\n")
+
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA synchronous=NORMAL")
+    started = time.perf_counter()
+    for user_id, size in downloads:
+        db.execute(ADD_USAGE, (user_id, 1, size, today(), 1, size))
+        db.commit()
+    print(f"usage, commit per download     {per_call(time.perf_counter() - started, len(downloads))}")
+
+    started = time.perf_counter()
+    for number, (user_id, size) in enumerate(downloads, start=1):
+        store.record_download(user_id, size)
+        if number % args.flush_every == 0:
+            store.flush()
+    store.flush()
+    print(f"usage, batched flushes         {per_call(time.perf_counter() - started, len(downloads))}")
+
+    store.close()
+    uncached.close()
+    db.close()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Webhook mode load test: how many updates per second the bot's handlers sustain
+
+Runs fully offline. A stub Bot API answers the bot's own requests (with a
+configurable delay standing in for Telegram's round trip), the bot serves
+its webhook on a local port, and concurrent clients post synthetic /start
+updates the way Telegram would. An update counts as processed once its
+reply reached the stub.
+
+    python benchmarks/bench_webhook.py --updates 2000 --connections 40 --api-latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def serve_stub_api(latency, port, replies):
+    """Fake Bot API that acknowledges every method and counts sent messages
+
+    Runs in its own process so its threads don't compete with the bot for the GIL.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            method = self.path.rsplit('/', 1)[-1]
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params = json.loads(body or b'{}')
+            else:
+                params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+            time.sleep(latency)
+            if method == 'getMe':
+                result = BOT_USER
+            elif method == 'sendMessage':
+                with replies.get_lock():
+                    replies.value += 1
+                    message_id = replies.value
+                result = {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                    'text': params.get('text', ''),
+                }
+            else:
+                result = True
+
+            payload = json.dumps({'ok': True, 'result': result}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    with Server(('127.0.0.1', port.value), Handler) as server:
+        port.value = server.server_address[1]
+        server.serve_forever()
+
+
+def start_stub_api(latency):
+    """Start the stub Bot API process and return it, its base URL and the reply counter"""
+    port = multiprocessing.Value('i', 0)
+    replies = multiprocessing.Value('i', 0)
+    process = multiprocessing.Process(target=serve_stub_api, args=(latency, port, replies), daemon=True)
+    process.start()
+    while not port.value:
+        time.sleep(0.01)
+    return process, f"http://127.0.0.1:{port.value}/bot", replies
+
+
+def start_update(update_id):
+    """A private-chat /start message from one of many users"""
+    user = {'id': 1000 + update_id % 500, 'is_bot': False, 'first_name': 'User'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user['id'], 'type': 'private'},
+            'from': user,
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+async def post_updates(port, path, secret, update_ids):
+    """Deliver updates over one keep-alive connection, like a Telegram webhook worker
+
+    Raw asyncio streams keep the load generator cheap enough that the bot,
+    not the client, is what gets measured.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for update_id in update_ids:
+            body = json.dumps(start_update(update_id)).encode()
+            writer.write(
+                f"POST {path} HTTP/1.1\r\n"
+                f"Host: 127.0.0.1\r\n"
+                f"Content-Type: application/json\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            status = (await reader.readline()).split()[1]
+            if status != b'200':
+                raise RuntimeError(f"Webhook answered {status.decode()}")
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    import bot
+    from webhook import WebhookServer
+
+    stub, base_url, replies = start_stub_api(args.api_latency_ms / 1000)
+    app = bot.build_application(base_url=base_url)
+    secret = 'bench-secret'
+    server = WebhookServer(app, '/telegram', secret, host='127.0.0.1', port=0)
+
+    async with app:
+        await app.start()
+        await server.start()
+        pending = iter(range(args.updates))
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                post_updates(server.port, '/telegram', secret, pending) for _ in range(args.connections)
+            ))
+            accepted = time.perf_counter() - started
+            while replies.value < args.updates and time.perf_counter() - started < 120:
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - started
+        finally:
+            await server.stop()
+            await app.stop()
+            stub.terminate()
+
+    print(f"{args.updates} updates over {args.connections} connections, {args.api_latency_ms:.0f}ms Bot API latency\n")
+    print(f"accepted   {args.updates / accepted:8.1f} updates/s  ({accepted:.2f}s)")
+    if replies.value >= args.updates:
+        print(f"processed  {args.updates / elapsed:8.1f} updates/s  ({elapsed:.2f}s)")
+    else:
+        print(f"processed  only {replies.value} of {args.updates} within 120s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=40, help="concurrent deliveries, like Telegram's max_connections")
+    parser.add_argument('--api-latency-ms', type=float, default=50, help='delay of every stub Bot API call')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,366 @@
 import os
-import re
 import asyncio
+import logging
 import shutil
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import signal
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from functools import lru_cache
+from pathlib import Path
+from telegram import (
+    Update, Message, InlineKeyboardButton, InlineKeyboardMarkup,
+    InputMediaAudio, InputMediaDocument, InputMediaVideo
+)
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-import yt_dlp
-import requests
-from urllib.parse import urlparse
+from telegram.error import TelegramError
+import httpx
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
+from cache import FileIdCache
+from scheduler import JobScheduler, QueueFullError
+from pipeline import (
+    MediaPipeline, download_streams, transcode_audio, remux_audio, merge_video,
+    target_video_bitrate, compress_video, split_video
+)
+from http_client import HttpClient, RangeNotSupportedError
+from journal import DownloadJournal
+from singleflight import SingleFlight
+from progress import ProgressChannel, ProgressService
+from webhook import StatusServer, WebhookServer
+from store import open_store
+from work_queue import JobFailedError, JobProgress, open_work_queue
+from workspace import DiskFullError, Workspaces
+from users import QuotaExceededError, UserStore
+from bandwidth import BandwidthShaper
+from links import classify, find_links, youtube_video_id
+from metrics import InstrumentedRequest, JobMetrics, MetricsRegistry, configure_logging
+from media_info import (
+    AUDIO_BITRATES, AUDIO_FORMAT_SPEC, ExtractionCache, YoutubeDLPool, audio_format_spec,
+    copy_info, fit_video_format, passes_through, predict_sizes, video_format_spec
+)
 
 # Load environment variables
 load_dotenv()
 
+# Logging: LOG_FORMAT=json writes one JSON object per line for log collectors
+configure_logging(os.getenv("LOG_FORMAT", "text") == "json", os.getenv("LOG_LEVEL", "INFO"))
+log = logging.getLogger('bot')
+
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN not found in environment variables!")
 
-PREMIUM_USERS = set()  # Store premium user IDs
+# Telegram user IDs allowed to run /grant, /revoke, /quota and /user
+ADMIN_USERS = {int(user_id) for user_id in os.getenv("ADMIN_USERS", "").split(",") if user_id.strip()}
+
+# Update delivery: "polling" (default) or "webhook" served by the built-in HTTP server
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Telegram echoes this in every delivery; a random one is set on each start if unset
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+PORT = int(os.getenv("PORT", "8080"))
+
+# Port serving /healthz and /metrics in polling and worker mode (0 = off);
+# webhook mode serves them on PORT
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Connections to the Bot API. httpx scans its whole pool on every request, so a
+# smaller pool handles more updates per second (see benchmarks/bench_webhook.py)
+BOT_API_CONNECTIONS = int(os.getenv("BOT_API_CONNECTIONS", "256"))
+
+# Bot API server: "cloud" is api.telegram.org, "local" a self-hosted
+# telegram-bot-api --local server at BOT_API_URL. A local server takes files
+# up to 2GB and reads them by path, so it must see the downloads directory
+BOT_API_MODE = os.getenv("BOT_API_MODE", "cloud")
+BOT_API_URL = os.getenv("BOT_API_URL", "http://localhost:8081")
+LOCAL_BOT_API = BOT_API_MODE == "local"
+
+# Download concurrency: global worker count and per-user caps
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "3"))
+USER_CONCURRENCY = int(os.getenv("USER_CONCURRENCY", "1"))
+PREMIUM_USER_CONCURRENCY = int(os.getenv("PREMIUM_USER_CONCURRENCY", "2"))
+MAX_QUEUED_PER_USER = int(os.getenv("MAX_QUEUED_PER_USER", "5"))
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 1)))
+
+# Network fetches and FFmpeg work run in separate pools
+pipeline = MediaPipeline(io_workers=MAX_WORKERS, cpu_workers=TRANSCODE_WORKERS)
+
+# Fair per-user job queue with a premium priority lane. Jobs that moved on
+# to transcoding still count, so admit enough to keep every fetch slot busy.
+scheduler = JobScheduler(
+    workers=MAX_WORKERS + TRANSCODE_WORKERS,
+    per_user_limit=USER_CONCURRENCY,
+    premium_per_user_limit=PREMIUM_USER_CONCURRENCY,
+    max_queued_per_user=MAX_QUEUED_PER_USER,
+)
+
+# Direct-link downloads share one async connection pool instead of pool threads
+MAX_FILE_DOWNLOADS = int(os.getenv("MAX_FILE_DOWNLOADS", "100"))
+http = HttpClient(
+    max_connections=MAX_FILE_DOWNLOADS,
+    max_per_host=int(os.getenv("MAX_CONNECTIONS_PER_HOST", "6")),
+)
+
+# Direct-link downloads don't occupy fetch threads, so they get their own, wider queue
+file_scheduler = JobScheduler(
+    workers=MAX_FILE_DOWNLOADS,
+    per_user_limit=USER_CONCURRENCY,
+    premium_per_user_limit=PREMIUM_USER_CONCURRENCY,
+    max_queued_per_user=MAX_QUEUED_PER_USER,
+)
+
+# Shared state (premium users, pending links) and job dispatch. The defaults keep
+# everything in this process; with SQLite backends a front process hands
+# downloads to `python bot.py worker` processes on the same host.
+store = open_store(os.getenv("STATE_STORE", "memory"))
+work_queue = open_work_queue(os.getenv("WORK_QUEUE", "local"))
+WORKER_JOBS = int(os.getenv("WORKER_JOBS", str(MAX_WORKERS + TRANSCODE_WORKERS)))
+JOB_LEASE = 60
+
+# Premium status, usage counters and daily quotas per user, in SQLite shared by
+# every process on the host. Lookups are served from memory for USER_CACHE_TTL
+# seconds and usage is written every USER_FLUSH_INTERVAL seconds
+users = UserStore(os.getenv("USER_DB", "users.db"), cache_ttl=int(os.getenv("USER_CACHE_TTL", "30")))
+USER_FLUSH_INTERVAL = 5
+
+# Daily download quotas in MB per tier (0 = none); /quota overrides them per user
+DAILY_QUOTA = int(os.getenv("DAILY_QUOTA_MB", "0")) * 1024 * 1024
+PREMIUM_DAILY_QUOTA = int(os.getenv("PREMIUM_DAILY_QUOTA_MB", "0")) * 1024 * 1024
+
+# Bandwidth shaping in MB/s (0 = unlimited), separately for fetching from sources
+# and uploading to Telegram: the whole bot, each free user and each premium user
+def bandwidth_shaper():
+    return BandwidthShaper(
+        rate=float(os.getenv("BANDWIDTH_MB", "0")) * 1024 * 1024,
+        user_rate=float(os.getenv("USER_BANDWIDTH_MB", "0")) * 1024 * 1024,
+        premium_rate=float(os.getenv("PREMIUM_BANDWIDTH_MB", "0")) * 1024 * 1024,
+    )
+download_shaper = bandwidth_shaper()
+upload_shaper = bandwidth_shaper()
+
+# How long a quality menu keeps working after the link was sent
+LINK_TTL = 24 * 3600
+
+# Upload limit of the Bot API server; MAX_FILE_MB can only lower it
+SERVER_LIMIT_MB = 2000 if LOCAL_BOT_API else 50
+MAX_FILE_SIZE = min(int(os.getenv("MAX_FILE_MB", str(SERVER_LIMIT_MB))), SERVER_LIMIT_MB) * 1024 * 1024
+LIMIT_TEXT = f"{MAX_FILE_SIZE // (1024 * 1024)}MB"
+# Seconds an upload may take; a local server answers once it has sent the file on
+UPLOAD_TIMEOUT = int(os.getenv("UPLOAD_TIMEOUT", "1800" if LOCAL_BOT_API else "120"))
+
+# Videos over the upload limit: "compress" falls back to a quality predicted
+# to fit and re-encodes whatever still overshoots, "split" falls back the same
+# way and sends the rest in parts, "reject" asks the user for a lower quality
+OVERSIZE_MODE = os.getenv("OVERSIZE_MODE", "compress")
+# Below this video bitrate a compressed video looks worse than sending parts
+MIN_VIDEO_KBPS = 300
+COMPRESS_AUDIO_KBPS = 128
+
+# Audio requests: send YouTube's AAC stream remuxed into M4A, without re-encoding,
+# when its bitrate is at most the requested one plus this fraction; else MP3
+AUDIO_PASSTHROUGH = os.getenv("AUDIO_PASSTHROUGH", "true").lower() in ("1", "true", "yes")
+PASSTHROUGH_TOLERANCE = float(os.getenv("AUDIO_PASSTHROUGH_TOLERANCE", "0.25")) if AUDIO_PASSTHROUGH else None
+
+# Regular files up to this size are relayed from memory, larger ones spill to disk
+SPOOL_MEMORY_LIMIT = int(os.getenv("SPOOL_MEMORY_MB", "8")) * 1024 * 1024
+
+# Direct-link download mode: "relay" streams over one connection, "segmented"
+# fetches byte ranges in parallel from servers that support them
+DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "relay")
+DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_KB", "64")) * 1024
+SEGMENTED_MIN_SIZE = int(os.getenv("SEGMENTED_MIN_MB", "4")) * 1024 * 1024
+
+# Playlists and messages with several links become one batch of at most
+# BATCH_MAX_ITEMS, of which BATCH_CONCURRENCY download at the same time
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "3"))
+# Telegram sends at most this many files as one media group
+MEDIA_GROUP_SIZE = 10
+
+# Telegram file_id cache so repeat requests skip the download entirely
+file_cache = FileIdCache(
+    os.getenv("CACHE_DB", "cache.db"),
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "5000")),
+    ttl=int(os.getenv("CACHE_TTL_DAYS", "30")) * 24 * 3600,
+)
 
-# Thread pool for blocking operations
-executor = ThreadPoolExecutor(max_workers=3)
+# Metadata probes run as soon as a link arrives, on their own small pool so
+# the quality menu never waits behind running downloads
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", "4"))
+probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='probe')
+
+# yt-dlp metadata shared by every user and step, valid until its stream URLs expire
+extraction_cache = ExtractionCache(
+    max_ttl=int(os.getenv("EXTRACTION_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("EXTRACTION_CACHE_SIZE", "500")),
+)
+
+# Cookies for YouTube, read once per process and never written back
+COOKIE_FILE = 'cookies.txt'
+
+@lru_cache(maxsize=1)
+def youtube_dl_class():
+    """YoutubeDL sharing one cookie jar; yt_dlp and its hundreds of extractors load on first use"""
+    import yt_dlp
+    from yt_dlp.cookies import YoutubeDLCookieJar
+    jar = YoutubeDLCookieJar(COOKIE_FILE)
+    if os.access(COOKIE_FILE, os.R_OK):
+        jar.load()
+    
+    class SharedCookieYoutubeDL(yt_dlp.YoutubeDL):
+        # Each instance used to load cookies.txt on first use and save it when
+        # closed, so one job could read the file while another rewrote it
+        cookiejar = jar
+        
+        def save_cookies(self):
+            pass
+    
+    return SharedCookieYoutubeDL
+
+def youtube_dl(params):
+    """A YoutubeDL instance reading the shared cookie jar"""
+    return youtube_dl_class()(params)
+
+# Warm YoutubeDL instances for extraction, one per thread that may extract
+ydl_pool = YoutubeDLPool(
+    lambda: youtube_dl({
+        'quiet': True,
+        'no_warnings': True,
+        'cookiefile': COOKIE_FILE,
+        'socket_timeout': 60,
+    }),
+    size=PROBE_WORKERS + MAX_WORKERS,
+)
+
+# Identical YouTube downloads running at the same time are coalesced into one
+flights = SingleFlight()
+
+# Progress-message edits from every job go through one rate-limited service
+progress = ProgressService(
+    global_rate=float(os.getenv("PROGRESS_EDITS_PER_SECOND", "25")),
+    chat_interval=float(os.getenv("PROGRESS_CHAT_INTERVAL", "1.0")),
+)
+
+# Seconds between elapsed-time updates while a file is being uploaded
+UPLOAD_STATUS_INTERVAL = 5
+
+# Journal of in-flight downloads, resumed after timeouts and restarts
+journal = DownloadJournal(os.path.join('downloads', 'journal.db'))
+
+# Every job works in its own directory under downloads/jobs. A janitor evicts
+# leftovers and jobs wait to start while the disk budget is used up
+workspaces = Workspaces(
+    'downloads',
+    quota=int(os.getenv("DISK_QUOTA_MB", "0")) * 1024 * 1024,
+    min_free=int(os.getenv("MIN_FREE_DISK_MB", "500")) * 1024 * 1024,
+    orphan_age=int(os.getenv("ORPHAN_AGE", "3600")),
+)
+JANITOR_INTERVAL = 60
+# Partial downloads abandoned after a timeout stay resumable this long
+ABANDONED_TTL = int(os.getenv("ABANDONED_TTL", str(6 * 3600)))
+
+# Prometheus metrics, served on /metrics
+metrics = MetricsRegistry()
+job_phase_seconds = metrics.histogram(
+    'bot_job_phase_seconds', 'Time spent in each phase of a download job', ('kind', 'phase')
+)
+job_seconds = metrics.histogram('bot_job_seconds', 'Total time of a download job', ('kind', 'outcome'))
+jobs_total = metrics.counter('bot_jobs_total', 'Finished download jobs', ('kind', 'outcome'))
+transferred_bytes = metrics.counter(
+    'bot_transferred_bytes_total', 'Bytes downloaded from sources and uploaded to Telegram', ('kind', 'direction')
+)
+audio_outputs = metrics.counter(
+    'bot_audio_outputs_total', 'Audio files by how they were made (remux passes the source stream through)', ('mode',)
+)
+probe_seconds = metrics.histogram('bot_probe_seconds', 'Time to probe a YouTube link for the quality menu')
+extract_seconds = metrics.histogram('bot_ytdlp_extract_seconds', 'Time yt-dlp spends extracting metadata')
+api_seconds = metrics.histogram('bot_telegram_api_seconds', 'Latency of Bot API calls', ('method',))
+api_responses = metrics.counter(
+    'bot_telegram_api_responses_total', 'Bot API responses by HTTP status (429 is flood control)', ('method', 'code')
+)
+metrics.gauge(
+    'bot_jobs_running', 'Download jobs running', ('queue',),
+    read=lambda: {('media',): scheduler.active, ('file',): file_scheduler.active}
+)
+metrics.gauge(
+    'bot_jobs_queued', 'Download jobs waiting for a slot', ('queue',),
+    read=lambda: {('media',): scheduler.queued, ('file',): file_scheduler.queued}
+)
+metrics.gauge(
+    'bot_pipeline_busy_workers', 'Pipeline workers running a step', ('stage',),
+    read=lambda: {(stage,): stats['active'] for stage, stats in pipeline.report().items()}
+)
+metrics.gauge(
+    'bot_pipeline_workers', 'Pipeline workers per stage', ('stage',),
+    read=lambda: {(stage,): stats['workers'] for stage, stats in pipeline.report().items()}
+)
+metrics.gauge(
+    'bot_pipeline_queued', 'Steps waiting for a pipeline worker', ('stage',),
+    read=lambda: {('transcode',): pipeline.report()['transcode']['queued']}
+)
+metrics.counter(
+    'bot_cache_lookups_total', 'Cache lookups by result', ('cache', 'result'),
+    read=lambda: {
+        (cache, result): stats[key]
+        for cache, stats in (('file_id', file_cache.stats()), ('metadata', extraction_cache.stats()))
+        for result, key in (('hit', 'hits'), ('miss', 'misses'))
+    }
+)
+metrics.counter(
+    'bot_progress_edits_total', 'Progress message edits by what happened to them', ('result',),
+    read=lambda: {(result,): progress.stats()[result] for result in ('sent', 'merged', 'skipped', 'flood_waits')}
+)
+metrics.gauge(
+    'bot_bandwidth_tokens_bytes', 'Bytes left in the global bandwidth bucket (negative while transfers wait)',
+    ('direction',),
+    read=lambda: {
+        (direction,): shaper.stats()['global_tokens']
+        for direction, shaper in (('download', download_shaper), ('upload', upload_shaper))
+        if shaper.rate
+    }
+)
+metrics.gauge(
+    'bot_bandwidth_user_buckets', 'Users whose bandwidth bucket is still refilling', ('direction',),
+    read=lambda: {('download',): download_shaper.stats()['user_buckets'], ('upload',): upload_shaper.stats()['user_buckets']}
+)
+metrics.counter(
+    'bot_bandwidth_wait_seconds_total', 'Time transfers were held back by bandwidth shaping', ('direction',),
+    read=lambda: {('download',): download_shaper.waited, ('upload',): upload_shaper.waited}
+)
+metrics.gauge(
+    'bot_bandwidth_limit_bytes', 'Configured bandwidth per second (0 = unlimited)', ('direction', 'level'),
+    read=lambda: {
+        (direction, level): getattr(shaper, attribute)
+        for direction, shaper in (('download', download_shaper), ('upload', upload_shaper))
+        for level, attribute in (('global', 'rate'), ('user', 'user_rate'), ('premium', 'premium_rate'))
+    }
+)
+metrics.gauge(
+    'bot_disk_bytes', 'Bytes used by downloads/ and free on its disk', ('kind',),
+    read=lambda: {('used',): workspaces.usage, ('free',): workspaces.free_space()}
+)
+
+def job_metrics(kind):
+    """Timings and byte counts for one download job"""
+    return JobMetrics(kind, job_phase_seconds, job_seconds, jobs_total, transferred_bytes)
+
+def metrics_report():
+    """Every metric in the Prometheus text format"""
+    return metrics.render()
+
+# Keep references to background tasks so they aren't garbage collected
+background_tasks = set()
 
 # Find FFmpeg location
 def find_ffmpeg():
@@ -50,19 +389,321 @@ def find_ffmpeg():
     
     return None
 
-FFMPEG_LOCATION = find_ffmpeg()
-print(f"FFmpeg location: {FFMPEG_LOCATION}")
+@lru_cache(maxsize=None)
+def ffmpeg_location():
+    """FFmpeg's directory, looked up once on first use instead of at import"""
+    location = find_ffmpeg()
+    log.info("FFmpeg location: %s", location)
+    return location
 
-# YouTube URL pattern
-YOUTUBE_PATTERN = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+def ffmpeg_binary():
+    """Path of the FFmpeg executable to run directly"""
+    location = ffmpeg_location()
+    if location:
+        return os.path.join(location, 'ffmpeg')
+    return 'ffmpeg'
+
+# Encoders the conversions rely on
+FFMPEG_ENCODERS = ('libmp3lame', 'libx264', 'aac')
+
+@lru_cache(maxsize=None)
+def ffmpeg_capabilities():
+    """FFmpeg's version line and which of FFMPEG_ENCODERS it has, probed once"""
+    try:
+        version = subprocess.run(
+            [ffmpeg_binary(), '-hide_banner', '-version'], capture_output=True, text=True, timeout=30
+        ).stdout.partition('\n')[0]
+        encoders = subprocess.run(
+            [ffmpeg_binary(), '-hide_banner', '-encoders'], capture_output=True, text=True, timeout=30
+        ).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning("FFmpeg is not usable: %s", e)
+        return {'version': None, 'encoders': {}}
+    log.info("FFmpeg: %s", version)
+    found = {name: f" {name} " in encoders for name in FFMPEG_ENCODERS}
+    missing = [name for name, present in found.items() if not present]
+    if missing:
+        log.warning("FFmpeg lacks encoders %s; conversions that need them will fail", ", ".join(missing))
+    return {'version': version, 'encoders': found}
+
+def warm_up():
+    """Load yt-dlp into the extractor pool and probe FFmpeg, off the startup path"""
+    ydl_pool.warm()
+    ffmpeg_capabilities()
 
 def is_youtube_url(url):
     """Check if URL is a YouTube link"""
-    return re.search(YOUTUBE_PATTERN, url) is not None
+    link = classify(url)
+    return link is not None and link.kind != 'direct'
+
+def youtube_cache_key(url, kind, quality):
+    """Build the file cache key for a YouTube download"""
+    video_id = youtube_video_id(url)
+    if not video_id:
+        return None
+    return f"youtube:{video_id}:{kind}:{quality}"
+
+def file_cache_key(url, headers):
+    """Build the file cache key for a regular file from its HTTP validators"""
+    validator = headers.get('ETag') or headers.get('Last-Modified')
+    if not validator:
+        return None
+    return f"file:{url}:{validator}"
+
+def fits_limit(size):
+    """Whether a predicted size is within the upload limit (unknown sizes pass)"""
+    return size is None or size <= MAX_FILE_SIZE
+
+def video_fits(size):
+    """Whether a video option can be offered: it fits, or will be made to fit"""
+    return OVERSIZE_MODE != 'reject' or fits_limit(size)
+
+def size_label(size):
+    """Button suffix with a predicted size, empty if unknown"""
+    if size and size > MAX_FILE_SIZE:
+        return f" (~{size / (1024 * 1024):.0f}MB, fitted to {LIMIT_TEXT})"
+    return f" (~{size / (1024 * 1024):.0f}MB)" if size else ""
+
+def percent_done(event):
+    """Download percentage of a progress event, or None if the total is unknown"""
+    if event.get('total'):
+        return min(event.get('bytes', 0) * 100 / event['total'], 100)
+    return None
+
+def progress_bar(percent):
+    """Ten-cell bar for a percentage"""
+    filled = min(int(percent / 10), 10) if percent else 0
+    return '▰' * filled + '▱' * (10 - filled)
+
+def format_speed(speed):
+    """Human-readable transfer speed from bytes per second"""
+    if not speed:
+        return "N/A"
+    if speed >= 1024 * 1024:
+        return f"{speed / (1024 * 1024):.1f}MB/s"
+    return f"{speed / 1024:.0f}KB/s"
+
+def format_eta(eta):
+    """ETA in seconds as mm:ss"""
+    if eta is None:
+        return "N/A"
+    minutes, seconds = divmod(int(eta), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+def get_youtube_info(url):
+    """Raw yt-dlp metadata for a YouTube URL, from the cache or a warm extractor"""
+    def extract():
+        with ydl_pool.borrow() as ydl, extract_seconds.time():
+            return ydl.extract_info(url, download=False, process=False)
+    
+    video_id = youtube_video_id(url)
+    if not video_id:
+        return extract()
+    return extraction_cache.get_or_extract(video_id, extract)
+
+def expand_playlist(url):
+    """Blocking lookup of a playlist's video URLs, at most BATCH_MAX_ITEMS"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'cookiefile': COOKIE_FILE,
+        'socket_timeout': 60,
+        # List the entries without resolving each video's formats
+        'extract_flat': 'in_playlist',
+        'playlistend': BATCH_MAX_ITEMS,
+    }
+    with youtube_dl(ydl_opts) as ydl, extract_seconds.time():
+        info = ydl.extract_info(url, download=False)
+    return [
+        f"https://www.youtube.com/watch?v={entry['id']}"
+        for entry in info.get('entries') or [] if entry and entry.get('id')
+    ]
+
+def extract_youtube_info(ydl, url, download):
+    """extract_info for a job's own YoutubeDL, reusing cached metadata"""
+    return ydl.process_ie_result(copy_info(get_youtube_info(url)), download=download)
+
+async def probe_youtube(url):
+    """Fetch YouTube metadata once and predict each option's output size"""
+    def probe():
+        info = get_youtube_info(url)
+        if info.get('_type', 'video') != 'video':
+            return None
+        with ydl_pool.borrow() as ydl:
+            processed = ydl.process_ie_result(copy_info(info), download=False)
+            return predict_sizes(ydl, processed, PASSTHROUGH_TOLERANCE)
+    
+    loop = asyncio.get_event_loop()
+    try:
+        with probe_seconds.time():
+            return await loop.run_in_executor(probe_executor, probe)
+    except Exception:
+        # The download itself will report the real error
+        log.warning("Probe failed for %s", url, exc_info=True)
+        return None
+
+def get_filename(url, headers):
+    """Pick a download filename from Content-Disposition or the URL"""
+    filename = url.split('/')[-1] or 'downloaded_file'
+    if 'Content-Disposition' in headers:
+        content_disp = headers['Content-Disposition']
+        if 'filename=' in content_disp:
+            filename = content_disp.split('filename=')[1].strip('"')
+    return filename
+
+def part_caption(title, number, count):
+    """Video caption, numbered when the video was sent in parts"""
+    suffix = f" (part {number}/{count})" if count > 1 else ""
+    return title[:200 - len(suffix)] + suffix
+
+def upload_input(file):
+    """Upload argument for an open file: its path when a local Bot API server reads it, else the file"""
+    if LOCAL_BOT_API:
+        return Path(file.name)
+    # A spooled buffer still in memory has no name, which PTB can't handle
+    return file if file.name is not None else file.read()
+
+def safe_filename(filename):
+    """filename as a single path component of reasonable length"""
+    name = os.path.basename(filename.replace('\\', '/')).strip()
+    if name in ('', '.', '..'):
+        return 'file'
+    stem, ext = os.path.splitext(name)
+    return stem[:200 - len(ext)] + ext
+
+def named_upload(file, workspace, filename):
+    """upload_input for a file to be shown as filename
+    
+    A local Bot API server names an upload after the path it reads and
+    ignores filename=, so there the file is linked into workspace under
+    that name first.
+    """
+    if not LOCAL_BOT_API:
+        return upload_input(file)
+    path = os.path.join(workspace, safe_filename(filename))
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(file.name, path)
+    except OSError:
+        # No hard links on this filesystem
+        shutil.copyfile(file.name, path)
+    return Path(path)
+
+def scratch_file(workspace, memory_limit=0):
+    """Temporary download buffer, spooled in memory up to memory_limit
+    
+    A local Bot API server reads uploads by path, so there it is always a
+    named file on disk.
+    """
+    if LOCAL_BOT_API:
+        return tempfile.NamedTemporaryFile(dir=workspace)
+    if memory_limit:
+        return tempfile.SpooledTemporaryFile(max_size=memory_limit, dir=workspace)
+    return tempfile.TemporaryFile(dir=workspace)
+
+async def send_cached_file(message, cache_key):
+    """Resend a previously uploaded file by its Telegram file_id"""
+    if not cache_key:
+        return False
+    
+    entry = file_cache.get(cache_key)
+    if not entry:
+        return False
+    
+    try:
+        if entry['kind'] == 'audio':
+            await message.reply_audio(audio=entry['file_id'])
+        elif entry['kind'] == 'video':
+            await message.reply_video(
+                video=entry['file_id'],
+                caption=entry['meta'].get('title', 'Video')[:200],
+                supports_streaming=True
+            )
+        elif entry['kind'] == 'video_parts':
+            file_ids = entry['meta']['file_ids']
+            for number, file_id in enumerate(file_ids, start=1):
+                await message.reply_video(
+                    video=file_id,
+                    caption=part_caption(entry['meta'].get('title', 'Video'), number, len(file_ids)),
+                    supports_streaming=True
+                )
+        else:
+            await message.reply_document(document=entry['file_id'])
+    except TelegramError:
+        # Stale or foreign file_id, fall back to a fresh download
+        file_cache.invalidate(cache_key)
+        return False
+    
+    return True
+
+class FileTooLargeError(Exception):
+    """Raised when a download exceeds MAX_FILE_SIZE"""
+    
+    def __init__(self, size, exact=True):
+        super().__init__(f"File is larger than {LIMIT_TEXT}")
+        self.size = size
+        self.exact = exact
 
 def is_premium_user(user_id):
     """Check if user has premium access"""
-    return user_id in PREMIUM_USERS
+    return users.is_premium(user_id)
+
+def tier_quota(user_id):
+    """Default daily quota of the user's tier, None if unlimited"""
+    return (PREMIUM_DAILY_QUOTA if is_premium_user(user_id) else DAILY_QUOTA) or None
+
+def quota_left(user_id):
+    """Bytes the user may still download today, None if unlimited"""
+    return users.quota_left(user_id, tier_quota(user_id))
+
+def link_key(message):
+    """State store key of the link behind a quality menu message"""
+    return f"{message.chat_id}:{message.message_id}"
+
+def job_key(resume_key, message):
+    """Journal and workspace key of one job: what it downloads and the message it answers"""
+    return f"{resume_key}#{link_key(message)}"
+
+async def schedule_download(status_msg, user_id, status_text, job, queue=scheduler):
+    """Run a download job through the fair queue, showing its position while it waits"""
+    async def on_queued(position):
+        progress.update(status_msg, f"{status_text}\n\n🕒 Queued: position {position}")
+
+    async def admitted_job():
+        # Checked as the job leaves the queue, since jobs ahead of it use disk too
+        if not workspaces.admit():
+            raise DiskFullError()
+        # Jobs that ran while this one waited count against the quota too
+        if quota_left(user_id) == 0:
+            raise QuotaExceededError()
+        return await job()
+
+    try:
+        if quota_left(user_id) == 0:
+            raise QuotaExceededError()
+        await queue.run(user_id, is_premium_user(user_id), admitted_job, on_queued=on_queued)
+    except QuotaExceededError:
+        quota = users.daily_quota(user_id, tier_quota(user_id))
+        await progress.edit(status_msg,
+            f"📊 Daily Quota Reached\n\n"
+            f"⚠️ You downloaded your {quota / (1024 * 1024):.0f}MB for today\n"
+            f"💡 Try again tomorrow (UTC)"
+        )
+    except QueueFullError:
+        await progress.edit(status_msg,
+            f"🚦 Too Many Downloads Queued\n\n"
+            f"⏳ You already have {queue.max_queued_per_user} waiting\n"
+            f"💡 Try again when one finishes"
+        )
+    except DiskFullError:
+        await progress.edit(status_msg,
+            "💾 Server Storage Full\n\n"
+            "⏳ Running downloads are using the disk\n"
+            "💡 Try again in a few minutes"
+        )
+    finally:
+        progress.forget(status_msg)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
@@ -85,25 +726,147 @@ async def premium_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Contact @itzmeane to subscribe!"
     )
 
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Queue, pipeline and cache statistics command"""
+    report = pipeline.report()
+    fetch = report['fetch']
+    transcode = report['transcode']
+    cache_stats = file_cache.stats()
+    extraction = extraction_cache.stats()
+    edits = progress.stats()
+    disk = workspaces.stats()
+    user_stats = users.stats()
+    text = (
+        "📊 Bot Statistics\n\n"
+        f"🚦 Media jobs: {scheduler.active} running • {scheduler.queued} waiting\n"
+        f"🔗 File jobs: {file_scheduler.active} running • {file_scheduler.queued} waiting\n"
+        f"🤝 Coalesced: {flights.active} downloads shared\n"
+        f"✏️ Progress edits: {edits['sent']} sent • {edits['merged'] + edits['skipped']} coalesced • "
+        f"{edits['flood_waits']} flood waits\n\n"
+        f"📥 Fetch: {fetch['active']}/{fetch['workers']} busy\n"
+        f"   {fetch['jobs']} done • avg {fetch['avg_time']:.1f}s • max {fetch['max_time']:.1f}s\n\n"
+        f"⚙️ Transcode: {transcode['active']}/{transcode['workers']} busy • {transcode['queued']} queued\n"
+        f"   {transcode['jobs']} done • avg {transcode['avg_time']:.1f}s • wait {transcode['avg_wait']:.1f}s\n\n"
+        f"💾 Cache: {cache_stats['entries']} files • {cache_stats['hit_rate']:.0%} hit rate\n"
+        f"🔍 Metadata: {extraction['entries']} videos • {extraction['hit_rate']:.0%} hit rate • "
+        f"extract avg {extraction['avg_extract_time']:.1f}s\n"
+        f"🗄️ Disk: {disk['usage'] / (1024 * 1024):.0f}MB used • {disk['free'] / (1024 * 1024):.0f}MB free • "
+        f"{disk['evicted']} evicted • {disk['refused']} refused\n"
+        f"👤 Users: {user_stats['cached']} cached • {user_stats['hit_rate']:.0%} hit rate • "
+        f"{user_stats['pending']} counters pending"
+    )
+    if download_shaper.throttled or upload_shaper.throttled:
+        text += (
+            f"\n🐢 Shaped: {download_shaper.throttled} fetches ({download_shaper.waited:.0f}s) • "
+            f"{upload_shaper.throttled} uploads ({upload_shaper.waited:.0f}s)"
+        )
+    if work_queue is not None:
+        jobs = work_queue.stats()
+        text += f"\n👷 Workers: {jobs['running']} running • {jobs['queued']} waiting • {jobs['failed']} failed"
+    await update.message.reply_text(text)
+
+def admin_target(update, context):
+    """User ID argument of an admin command, or None if the caller isn't an admin"""
+    if update.message.from_user.id not in ADMIN_USERS:
+        return None
+    if not context.args or not context.args[0].isdigit():
+        return 0
+    return int(context.args[0])
+
+def describe_user(user_id):
+    """Premium status, quota and usage of a user, for admin replies"""
+    record = users.get(user_id)
+    if not users.is_premium(user_id):
+        status = "free"
+    elif record['premium_expires']:
+        status = f"premium until {time.strftime('%Y-%m-%d', time.gmtime(record['premium_expires']))}"
+    else:
+        status = "premium"
+    quota = users.daily_quota(user_id, tier_quota(user_id))
+    quota = "none" if quota is None else f"{quota / (1024 * 1024):.0f}MB/day"
+    if record['quota_bytes'] is None and quota != "none":
+        quota += " (tier default)"
+    return (
+        f"👤 User {user_id}: {status}\n"
+        f"📊 Quota: {quota} • today {record['day_bytes'] / (1024 * 1024):.1f}MB in {record['day_downloads']} downloads\n"
+        f"📦 Total: {record['downloads']} downloads • {record['bytes'] / (1024 * 1024):.1f}MB"
+    )
+
+async def grant_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /grant <user_id> [days]"""
+    user_id = admin_target(update, context)
+    if user_id is None:
+        return
+    days = context.args[1] if len(context.args) > 1 else None
+    if not user_id or (days is not None and not days.isdigit()):
+        await update.message.reply_text("Usage: /grant <user_id> [days]")
+        return
+    users.grant(user_id, time.time() + int(days) * 86400 if days else None)
+    await update.message.reply_text(f"💎 Premium granted\n\n{describe_user(user_id)}")
+
+async def revoke_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /revoke <user_id>"""
+    user_id = admin_target(update, context)
+    if user_id is None:
+        return
+    if not user_id:
+        await update.message.reply_text("Usage: /revoke <user_id>")
+        return
+    users.revoke(user_id)
+    await update.message.reply_text(f"🔒 Premium revoked\n\n{describe_user(user_id)}")
+
+async def set_quota(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /quota <user_id> <MB per day|off>"""
+    user_id = admin_target(update, context)
+    if user_id is None:
+        return
+    amount = context.args[1] if len(context.args) > 1 else ''
+    if not user_id or not (amount.isdigit() or amount == 'off'):
+        await update.message.reply_text("Usage: /quota <user_id> <MB per day|off>")
+        return
+    users.set_quota(user_id, None if amount == 'off' else int(amount) * 1024 * 1024)
+    await update.message.reply_text(f"📊 Quota updated\n\n{describe_user(user_id)}")
+
+async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /user <user_id>, or the list of premium users"""
+    user_id = admin_target(update, context)
+    if user_id is None:
+        return
+    if not user_id:
+        lines = [
+            f"• {premium_id}" + (f" until {time.strftime('%Y-%m-%d', time.gmtime(expires))}" if expires else "")
+            for premium_id, expires in users.premium_users()
+        ]
+        await update.message.reply_text(
+            "💎 Premium users:\n\n" + ("\n".join(lines) or "none") + "\n\nUsage: /user <user_id>"
+        )
+        return
+    await update.message.reply_text(describe_user(user_id))
+
 async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming links"""
-    url = update.message.text.strip()
     user_id = update.message.from_user.id
-    
-    # Validate URL
-    try:
-        result = urlparse(url)
-        if not all([result.scheme, result.netloc]):
-            await update.message.reply_text("❌ Invalid URL. Please send a valid link.")
-            return
-    except:
+    links = find_links(update.message.text)
+    if not links:
         await update.message.reply_text("❌ Invalid URL. Please send a valid link.")
         return
     
+    # Several links, or a playlist, are downloaded as one batch
+    if len(links) > 1 or links[0].kind == 'playlist':
+        await handle_batch(update.message, links)
+        return
+    
+    # Downloads and cache keys use the normalized URL
+    link = links[0]
+    url = link.url
+    
     # Check if it's a YouTube link
-    if is_youtube_url(url):
-        # Store URL in user context
-        context.user_data['url'] = url
+    if link.kind == 'youtube':
+        status_msg = await update.message.reply_text("🔍 Analyzing video...")
+        
+        # Store URL and predicted output sizes for the menu on this message
+        sizes = await probe_youtube(url) or {}
+        store.set('links', link_key(status_msg), {'url': url, 'sizes': sizes}, ttl=LINK_TTL)
         
         # Create keyboard for format selection
         keyboard = [
@@ -112,66 +875,89 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
+        await status_msg.edit_text(
             "🎥 YouTube link detected!\n\n"
             "Please choose format:",
             reply_markup=reply_markup
         )
     else:
         # Download regular file
-        await update.message.reply_text("⏬ Downloading file...")
-        await download_regular_file(update, url)
+        status_text = "⏬ Downloading file..."
+        status_msg = await update.message.reply_text(status_text)
+        await schedule_download(
+            status_msg, user_id, status_text,
+            lambda: dispatch_download(update.message, download_job('file', update.message, url, None, user_id)),
+            queue=file_scheduler
+        )
 
 async def format_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle format selection callbacks"""
     query = update.callback_query
     await query.answer()
     
-    url = context.user_data.get('url')
-    if not url:
+    link = store.get('links', link_key(query.message))
+    if not link:
         await query.edit_message_text("❌ Error: URL not found. Please send the link again.")
         return
     
+    # Predicted output sizes from the metadata probe
+    sizes = link['sizes']
+    
     if query.data == "format_audio":
-        # Show audio bitrate options
+        # Show audio bitrate options that fit the upload limit
         keyboard = [
-            [InlineKeyboardButton("🎵 128 kbps", callback_data="audio_128")],
-            [InlineKeyboardButton("🎵 192 kbps", callback_data="audio_192")],
-            [InlineKeyboardButton("🎵 320 kbps", callback_data="audio_320")],
-            [InlineKeyboardButton("◀️ Back", callback_data="back_to_format")]
+            [InlineKeyboardButton(
+                f"🎵 {bitrate} kbps{size_label(sizes.get(f'audio_{bitrate}'))}",
+                callback_data=f"audio_{bitrate}"
+            )]
+            for bitrate in AUDIO_BITRATES
+            if fits_limit(sizes.get(f'audio_{bitrate}'))
         ]
+        text = "🎵 Select audio quality:" if keyboard else (
+            "❌ Audio Too Large\n\n"
+            f"⚠️ Every bitrate would be over {LIMIT_TEXT}\n"
+            "💡 Try a shorter video"
+        )
+        keyboard.append([InlineKeyboardButton("◀️ Back", callback_data="back_to_format")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            "🎵 Select audio quality:",
-            reply_markup=reply_markup
-        )
+        await query.edit_message_text(text, reply_markup=reply_markup)
     
     elif query.data == "format_video":
         user_id = query.from_user.id
         
-        # Basic quality options
+        # Basic quality options that fit the upload limit
         keyboard = [
-            [InlineKeyboardButton("📱 360p", callback_data="video_360")],
-            [InlineKeyboardButton("📺 480p", callback_data="video_480")],
-            [InlineKeyboardButton("🖥️ 720p", callback_data="video_720")],
+            [InlineKeyboardButton(
+                f"{icon} {resolution}p{size_label(sizes.get(f'video_{resolution}'))}",
+                callback_data=f"video_{resolution}"
+            )]
+            for icon, resolution in (("📱", "360"), ("📺", "480"), ("🖥️", "720"))
+            if video_fits(sizes.get(f'video_{resolution}'))
         ]
         
         # Add premium options if user is premium
         if is_premium_user(user_id):
-            keyboard.append([InlineKeyboardButton("💎 1080p (Premium)", callback_data="video_1080")])
-            keyboard.append([InlineKeyboardButton("💎 1440p (Premium)", callback_data="video_1440")])
-        else:
+            for resolution in ("1080", "1440"):
+                size = sizes.get(f'video_{resolution}')
+                if video_fits(size):
+                    keyboard.append([InlineKeyboardButton(
+                        f"💎 {resolution}p (Premium){size_label(size)}",
+                        callback_data=f"video_{resolution}"
+                    )])
+        elif video_fits(sizes.get('video_1080')):
             keyboard.append([InlineKeyboardButton("🔒 1080p+ (Premium Only)", callback_data="premium_required")])
         
+        text = "🎬 Select video quality:" if keyboard else (
+            "❌ Video Too Large\n\n"
+            f"⚠️ Every quality would be over {LIMIT_TEXT}\n"
+            "💡 Try audio instead"
+        )
         keyboard.append([InlineKeyboardButton("◀️ Back", callback_data="back_to_format")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            "🎬 Select video quality:",
-            reply_markup=reply_markup
-        )
+        await query.edit_message_text(text, reply_markup=reply_markup)
     
     elif query.data == "back_to_format":
         keyboard = [
@@ -180,8 +966,9 @@ async def format_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
+        detected = f"📦 Batch of {len(link['urls'])} links detected!" if 'urls' in link else "🎥 YouTube link detected!"
         await query.edit_message_text(
-            "🎥 YouTube link detected!\n\n"
+            f"{detected}\n\n"
             "Please choose format:",
             reply_markup=reply_markup
         )
@@ -199,18 +986,38 @@ async def download_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    url = context.user_data.get('url')
-    if not url:
+    link = store.get('links', link_key(query.message))
+    if not link:
         await query.edit_message_text("❌ Error: URL not found. Please send the link again.")
         return
     
     # Parse quality selection
     data = query.data
     
+    if 'urls' in link:
+        kind, quality = data.split("_")
+        user_id = query.from_user.id
+        if kind == 'video' and int(quality) > 720 and not is_premium_user(user_id):
+            await query.message.reply_text(
+                "💎 Premium Required!\n\n"
+                "Subscribe to access this quality.\n"
+                "Use /premium for more information."
+            )
+            return
+        await run_batch(query.message, user_id, link['urls'], kind, quality)
+        return
+    url = link['url']
+    
     if data.startswith("audio_"):
         bitrate = data.split("_")[1]
-        await query.edit_message_text(f"⏬ Downloading audio ({bitrate} kbps)...")
-        await download_youtube_audio(query.message, url, bitrate)
+        user_id = query.from_user.id
+        await start_youtube_download(
+            query.message, user_id, youtube_cache_key(url, 'audio', bitrate),
+            f"⏬ Downloading audio ({bitrate} kbps)...",
+            lambda flight: dispatch_download(
+                query.message, download_job('audio', query.message, url, bitrate, user_id), flight
+            )
+        )
     
     elif data.startswith("video_"):
         resolution = data.split("_")[1]
@@ -226,191 +1033,433 @@ async def download_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        await query.edit_message_text(f"⏬ Downloading video ({resolution}p)...")
-        await download_youtube_video(query.message, url, resolution)
+        await start_youtube_download(
+            query.message, user_id, youtube_cache_key(url, 'video', resolution),
+            f"⏬ Downloading video ({resolution}p)...",
+            lambda flight: dispatch_download(
+                query.message, download_job('video', query.message, url, resolution, user_id), flight
+            )
+        )
+
+def download_job(kind, message, url, quality, user_id):
+    """Serializable description of a download, as stored in the journal and work queue"""
+    return {'kind': kind, 'url': url, 'quality': quality, 'user_id': user_id, 'message': message.to_dict()}
+
+def run_download(message, job, flight=None):
+    """Coroutine that executes a download job in this process"""
+    if job['kind'] == 'audio':
+        return download_youtube_audio(message, job['url'], job['quality'], job['user_id'], flight)
+    if job['kind'] == 'video':
+        return download_youtube_video(message, job['url'], job['quality'], job['user_id'], flight)
+    return download_regular_file(message, job['url'], job['user_id'])
+
+async def dispatch_download(message, job, flight=None):
+    """Run a download here, or on a worker process when a shared work queue is set"""
+    if work_queue is None:
+        return await run_download(message, job, flight)
+    
+    job_id = work_queue.submit(job)
+    try:
+        await work_queue.wait(job_id, on_progress=flight.publish if flight else None)
+    except JobFailedError as e:
+        await message.reply_text(f"❌ Download Error\n\n{e}")
+
+async def start_youtube_download(message, user_id, cache_key, status_text, download):
+    """Serve from cache, join an identical running download, or queue a new one
+    
+    download(flight) creates the download coroutine for the request that does the work.
+    """
+    # Answer instantly if this exact file was uploaded before
+    if await send_cached_file(message, cache_key):
+        return
+    
+    await progress.edit(message, status_text)
+    
+    flight = flights.get(cache_key) if cache_key else None
+    if flight:
+        await follow_download(message, flight, cache_key)
+        return
+    
+    if not cache_key:
+        await schedule_download(message, user_id, status_text, lambda: download(None))
+        return
+    
+    with flights.lead(cache_key) as flight:
+        await schedule_download(message, user_id, status_text, lambda: download(flight))
+
+async def follow_download(status_msg, flight, cache_key):
+    """Mirror an identical running download's progress and reuse its upload"""
+    flight.followers += 1
+    while not flight.done:
+        text = flight.text or "⏳ Waiting for it to start..."
+        progress.update(status_msg, f"🔗 Joined an identical download\n\n{text}")
+        await flight.wait_for_update(timeout=1.5)
+    
+    # The leader stored its upload in the file cache
+    if await send_cached_file(status_msg, cache_key):
+        await progress.edit(status_msg, "✅ Download Complete!")
+    else:
+        await progress.edit(status_msg,
+            "❌ Download Failed\n\n"
+            "💡 Please try again"
+        )
+
+async def track_progress(task, progress_msg, channel, render, flight=None, timeout=None, cancel=None):
+    """Report a job's progress to the progress service until its task finishes
+    
+    Reacts to each event pushed on channel as it arrives. render(event, frame_idx)
+    returns the progress text and its state without the animation frame, so
+    only real progress turns into a message edit. Returns the task's result.
+    After timeout seconds the task is stopped with cancel(), or task.cancel()
+    without one, and asyncio.TimeoutError is raised once it has really ended.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
+    frame_idx = 0
+    last_state = None
+    event = channel.latest
+    while True:
+        text, state = render(event, frame_idx)
+        if state != last_state:
+            if flight:
+                flight.publish(text)
+            progress.update(progress_msg, text, state)
+            last_state = state
+            frame_idx += 1
+        
+        next_event = asyncio.ensure_future(channel.wait())
+        remaining = deadline - loop.time() if deadline else None
+        await asyncio.wait({task, next_event}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            next_event.cancel()
+            return task.result()
+        if not next_event.done():
+            next_event.cancel()
+            (cancel or task.cancel)()
+            # Its partial files go to a retry only once nothing writes them anymore
+            await asyncio.wait({task})
+            if not task.cancelled():
+                task.exception()
+            raise asyncio.TimeoutError()
+        event = next_event.result()
+
+async def wait_for_bandwidth(user_id, size, on_wait):
+    """Reserve size bytes of upload rate, calling on_wait(seconds_left) while waiting for them"""
+    delay = upload_shaper.delay(user_id, is_premium_user(user_id), size) if size else 0
+    if not delay:
+        return
+    loop = asyncio.get_running_loop()
+    resume_at = loop.time() + delay
+    while True:
+        left = resume_at - loop.time()
+        if left <= 0:
+            return
+        on_wait(left)
+        await asyncio.sleep(min(left, UPLOAD_STATUS_INTERVAL))
+
+async def report_upload(progress_msg, text, upload, user_id=None, size=0):
+    """Show the upload phase and its elapsed time until the upload coroutine finishes
+    
+    PTB sends a file in a single request with no byte-level progress, so the
+    status shows when the upload really started and how long it has taken.
+    The size bytes are reserved from the user's upload rate first, with the
+    wait for them shown as its own state.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await wait_for_bandwidth(user_id, size, lambda left: progress.update(
+            progress_msg, f"🚦 Waiting for bandwidth\n\n{text}\n⏱️ Upload starts in {left:.0f}s"
+        ))
+    except BaseException:
+        upload.close()
+        raise
+    await progress.edit(progress_msg, f"📤 Uploading to Telegram\n\n{text}")
+    started = loop.time()
+    task = asyncio.ensure_future(upload)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=UPLOAD_STATUS_INTERVAL)
+        if done:
+            return task.result()
+        elapsed = int(loop.time() - started)
+        progress.update(progress_msg, f"📤 Uploading to Telegram\n\n{text}\n⏱️ Elapsed: {elapsed}s")
+
+def download_cancelled():
+    """yt-dlp's exception for stopping a download from a progress hook"""
+    from yt_dlp.utils import DownloadCancelled
+    return DownloadCancelled("Download timed out")
+
+def download_hooks(progress_hook, user_id):
+    """yt-dlp progress hooks: the job's own, and bandwidth shaping for the user"""
+    hooks = [progress_hook] if progress_hook else []
+    return hooks + [download_shaper.ytdlp_hook(user_id, is_premium_user(user_id))]
+
+def fetch_youtube_audio(url, bitrate, workspace, user_id, progress_hook=None):
+    """Blocking download of a video's source audio stream into workspace"""
+    ydl_opts = {
+        'format': AUDIO_FORMAT_SPEC,
+        'outtmpl': os.path.join(workspace, '%(title)s.%(ext)s'),
+        'quiet': True,
+        'noprogress': True,
+        'no_warnings': True,
+        'cookiefile': COOKIE_FILE,
+        'progress_hooks': download_hooks(progress_hook, user_id),
+        'socket_timeout': 60,
+        'retries': 5,
+        # Resume .part files left by a timeout or restart
+        'continuedl': True,
+        # The conversion or remux rewrites the container anyway
+        'fixup': 'never',
+    }
+    
+    with youtube_dl(ydl_opts) as ydl:
+        # Fetch the AAC stream only if it can pass through at this bitrate
+        spec = audio_format_spec(ydl, extract_youtube_info(ydl, url, download=False), bitrate, PASSTHROUGH_TOLERANCE)
+        if spec != AUDIO_FORMAT_SPEC:
+            ydl.params['format'] = spec
+            ydl.format_selector = ydl.build_format_selector(spec)
+        info = extract_youtube_info(ydl, url, download=True)
+        return ydl.prepare_filename(info), info
 
-async def download_youtube_audio(message, url, bitrate):
+def audio_mode(info, bitrate):
+    """'remux' if the downloaded stream can be sent without re-encoding, else 'transcode'"""
+    return 'remux' if passes_through(info, bitrate, PASSTHROUGH_TOLERANCE) else 'transcode'
+
+def audio_label(mode, info, bitrate):
+    """Format of the audio sent, for status messages"""
+    if mode == 'remux':
+        abr = info.get('abr') or info.get('tbr')
+        return f"M4A ({abr:.0f} kbps, original)" if abr else "M4A (original)"
+    return f"MP3 ({bitrate} kbps)"
+
+def convert_audio(source_file, mode, bitrate):
+    """Blocking FFmpeg step for audio: remux into M4A or convert to MP3"""
+    base = source_file.rsplit('.', 1)[0]
+    audio_file = base + ('.m4a' if mode == 'remux' else '.mp3')
+    if source_file == audio_file:
+        if mode == 'transcode':
+            return audio_file
+        # The downloaded DASH m4a still needs a proper container
+        os.replace(source_file, base + '.source.m4a')
+        source_file = base + '.source.m4a'
+    try:
+        if mode == 'remux':
+            remux_audio(ffmpeg_binary(), source_file, audio_file)
+        else:
+            transcode_audio(ffmpeg_binary(), source_file, audio_file, bitrate)
+    finally:
+        os.remove(source_file)
+    audio_outputs.inc(mode=mode)
+    return audio_file
+
+def fetch_youtube_video(url, resolution, workspace, user_id, progress_hook=None):
+    """Blocking download of the selected video and audio streams into workspace"""
+    ydl_opts = {
+        'format': video_format_spec(resolution),
+        'outtmpl': os.path.join(workspace, '%(title)s.%(ext)s'),
+        'quiet': True,
+        'noprogress': True,
+        'no_warnings': True,
+        'cookiefile': COOKIE_FILE,
+        'progress_hooks': download_hooks(progress_hook, user_id),
+        'socket_timeout': 60,
+        'retries': 5,
+        # Resume .part files left by a timeout or restart
+        'continuedl': True,
+    }
+    
+    with youtube_dl(ydl_opts) as ydl:
+        info = extract_youtube_info(ydl, url, download=False)
+        if OVERSIZE_MODE != 'reject':
+            # Fall back to the best quality predicted to fit the upload limit
+            spec, _ = fit_video_format(ydl, info, resolution, MAX_FILE_SIZE)
+            if spec and spec != info.get('format_id'):
+                ydl.params['format'] = spec
+                ydl.format_selector = ydl.build_format_selector(spec)
+                info = extract_youtube_info(ydl, url, download=False)
+        base, parts = download_streams(ydl, info)
+        return base, parts, info
+
+def merge_into_mp4(base, parts):
+    """Blocking merge of downloaded streams into a single MP4 with FFmpeg"""
+    filename = base + '.mp4'
+    try:
+        merge_video(ffmpeg_binary(), parts, filename)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+    return filename
+
+async def download_youtube_audio(message, url, bitrate, user_id, flight=None):
     """Download YouTube video as audio"""
     progress_msg = None
-    last_progress = ""
+    job = job_metrics('audio')
+    cache_key = youtube_cache_key(url, 'audio', bitrate)
+    resume_key = cache_key or f"youtube:{url}:audio:{bitrate}"
+    journal_key = job_key(resume_key, message)
     
     try:
+        # Record the job so a restart can resume it, picking up where an abandoned one stopped
+        adopted = journal.adopt(journal_key, resume_key)
+        journal.start(
+            journal_key, kind='audio', url=url, quality=bitrate, resume=resume_key,
+            user_id=user_id, message=message.to_dict()
+        )
+        
+        workspace = workspaces.open(journal_key, previous=adopted)
+        
         # Send initial progress message
         progress_msg = await message.reply_text("🔍 Analyzing video...")
         
-        progress_states = {
-            'downloading': [],
-            'processing': False
-        }
+        channel = ProgressChannel()
+        
+        # Set on timeout; a thread can't be cancelled, so its progress hook stops it
+        cancelled = threading.Event()
         
         def progress_hook(d):
-            """Progress callback for yt-dlp"""
+            """Progress callback for yt-dlp, called on the download thread"""
+            if cancelled.is_set():
+                raise download_cancelled()
             if d['status'] == 'downloading':
-                percent = d.get('_percent_str', '0%').strip()
-                speed = d.get('_speed_str', 'N/A').strip()
-                eta = d.get('_eta_str', 'N/A').strip()
-                progress_states['downloading'] = [percent, speed, eta]
-            elif d['status'] == 'finished':
-                progress_states['processing'] = True
-        
-        def download_audio():
-            """Blocking download operation"""
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': bitrate,
-                }],
-                'outtmpl': 'downloads/%(title)s.%(ext)s',
-                'quiet': True,
-                'no_warnings': True,
-                'cookiefile': 'cookies.txt',
-                'progress_hooks': [progress_hook],
-                'socket_timeout': 60,
-                'retries': 5,
-            }
-            
-            # Add FFmpeg location if found
-            if FFMPEG_LOCATION:
-                ydl_opts['ffmpeg_location'] = FFMPEG_LOCATION
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                audio_file = filename.rsplit('.', 1)[0] + '.mp3'
-                return audio_file, info
+                journal.progress(journal_key, d.get('downloaded_bytes', 0))
+                channel.push(
+                    'downloading',
+                    bytes=d.get('downloaded_bytes', 0),
+                    total=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                    speed=d.get('speed'),
+                    eta=d.get('eta'),
+                )
         
-        # Run download in thread pool
-        loop = asyncio.get_event_loop()
-        download_task = loop.run_in_executor(executor, download_audio)
+        async def download_and_convert():
+            with job.phase('download'):
+                source_file, info = await pipeline.fetch(lambda: fetch_youtube_audio(url, bitrate, workspace, user_id, progress_hook))
+            job.moved('download', os.path.getsize(source_file))
+            mode = job.fields['audio'] = audio_mode(info, bitrate)
+            channel.push('processing', mode=mode)
+            with job.phase('postprocess'):
+                audio_file = await pipeline.transcode(lambda: convert_audio(source_file, mode, bitrate))
+            return audio_file, info
         
-        # Enhanced progress animations
+        # Fetch on the I/O pool, then convert on the CPU stage
+        download_task = asyncio.ensure_future(download_and_convert())
+        
+        # Progress animations
         download_frames = ['📥', '📥▪', '📥▪▪', '📥▪▪▪', '📥▪▪▪▪', '📥▪▪▪▪▪']
         processing_frames = ['🎵', '🎵♪', '🎵♪♫', '🎵♪♫♪', '🎵♪♫', '🎵♪']
         spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
-        progress_bars = ['▱▱▱▱▱▱▱▱▱▱', '▰▱▱▱▱▱▱▱▱▱', '▰▰▱▱▱▱▱▱▱▱', '▰▰▰▱▱▱▱▱▱▱', 
-                        '▰▰▰▰▱▱▱▱▱▱', '▰▰▰▰▰▱▱▱▱▱', '▰▰▰▰▰▰▱▱▱▱', '▰▰▰▰▰▰▰▱▱▱',
-                        '▰▰▰▰▰▰▰▰▱▱', '▰▰▰▰▰▰▰▰▰▱', '▰▰▰▰▰▰▰▰▰▰']
-        
-        frame_idx = 0
-        last_update_time = 0
         
-        # Update progress every 1.5 seconds
-        while not download_task.done():
-            await asyncio.sleep(1.5)
-            
-            current_time = loop.time()
-            if current_time - last_update_time >= 1.5:
-                try:
-                    # Build animated progress message
-                    if progress_states['processing']:
-                        spinner_char = spinner[frame_idx % len(spinner)]
-                        music_icon = processing_frames[frame_idx % len(processing_frames)]
-                        new_progress = (
-                            f"{music_icon} Converting to MP3...\n\n"
-                            f"{spinner_char} Processing audio track\n"
-                            f"🎧 Quality: {bitrate} kbps\n"
-                            f"⚙️ Using FFmpeg encoder"
-                        )
-                    elif progress_states['downloading']:
-                        percent, speed, eta = progress_states['downloading']
-                        
-                        # Parse percentage for progress bar
-                        try:
-                            percent_num = float(percent.replace('%', ''))
-                            bar_idx = min(int(percent_num / 10), 10)
-                            progress_bar = progress_bars[bar_idx]
-                        except:
-                            progress_bar = progress_bars[0]
-                        
-                        download_icon = download_frames[frame_idx % len(download_frames)]
-                        new_progress = (
-                            f"{download_icon} Downloading Audio\n\n"
-                            f"📊 {progress_bar} {percent}\n"
-                            f"⚡ Speed: {speed}\n"
-                            f"⏱️ ETA: {eta}\n"
-                            f"🎵 Quality: {bitrate} kbps"
-                        )
-                    else:
-                        spinner_char = spinner[frame_idx % len(spinner)]
-                        new_progress = (
-                            f"{spinner_char} Initializing download...\n\n"
-                            f"🔍 Fetching video information\n"
-                            f"🌐 Connecting to YouTube\n"
-                            f"🎵 Target: {bitrate} kbps MP3"
-                        )
-                    
-                    # Update only if changed
-                    if new_progress != last_progress:
-                        await progress_msg.edit_text(new_progress)
-                        last_progress = new_progress
-                    
-                    frame_idx += 1
-                    last_update_time = current_time
-                except:
-                    pass
+        def render(event, frame_idx):
+            """Progress text for an event, and its state without animation"""
+            if event['phase'] == 'processing':
+                spinner_char = spinner[frame_idx % len(spinner)]
+                icon = processing_frames[frame_idx % len(processing_frames)]
+                if event.get('mode') == 'remux':
+                    text = (
+                        f"{icon} Packing audio...\n\n"
+                        f"{spinner_char} Keeping the original stream\n"
+                        f"🎧 No re-encoding needed for {bitrate} kbps"
+                    )
+                else:
+                    text = (
+                        f"{icon} Converting to MP3...\n\n"
+                        f"{spinner_char} Processing audio track\n"
+                        f"🎧 Quality: {bitrate} kbps\n"
+                        f"⚙️ Using FFmpeg encoder"
+                    )
+                return text, 'processing'
+            if event['phase'] == 'downloading':
+                percent = percent_done(event)
+                download_icon = download_frames[frame_idx % len(download_frames)]
+                text = (
+                    f"{download_icon} Downloading Audio\n\n"
+                    f"📊 {progress_bar(percent)} {'N/A' if percent is None else f'{percent:.1f}%'}\n"
+                    f"⚡ Speed: {format_speed(event.get('speed'))}\n"
+                    f"⏱️ ETA: {format_eta(event.get('eta'))}\n"
+                    f"🎵 Quality: {bitrate} kbps"
+                )
+                return text, ('downloading', None if percent is None else int(percent))
+            spinner_char = spinner[frame_idx % len(spinner)]
+            text = (
+                f"{spinner_char} Initializing download...\n\n"
+                f"🔍 Fetching video information\n"
+                f"🌐 Connecting to YouTube\n"
+                f"🎵 Target: {bitrate} kbps"
+            )
+            return text, 'starting'
         
         # Get result with 15 minute timeout
-        audio_file, info = await asyncio.wait_for(download_task, timeout=900)
+        audio_file, info = await track_progress(
+            download_task, progress_msg, channel, render, flight, timeout=900, cancel=cancelled.set
+        )
+        label = audio_label(job.fields['audio'], info, bitrate)
         
         # Check file size
         file_size = os.path.getsize(audio_file)
         size_mb = file_size / (1024 * 1024)
         
-        if file_size > 50 * 1024 * 1024:
+        if file_size > MAX_FILE_SIZE:
+            job.outcome = 'too_large'
             os.remove(audio_file)
-            await progress_msg.edit_text(
+            journal.finish(journal_key)
+            await progress.edit(progress_msg,
                 f"❌ File Too Large\n\n"
                 f"📦 Size: {size_mb:.1f}MB\n"
-                f"⚠️ Limit: 50MB\n\n"
+                f"⚠️ Limit: {LIMIT_TEXT}\n\n"
                 f"💡 Try a shorter video"
             )
             return
         
-        # Upload progress with animation
-        upload_frames = ['📤', '📤▫', '📤▫▫', '📤▫▫▫', '📤▫▫▫▫', '📤▫▫▫▫▫']
-        for i in range(3):
-            upload_icon = upload_frames[i % len(upload_frames)]
-            await progress_msg.edit_text(
-                f"{upload_icon} Uploading to Telegram\n\n"
+        # Send the audio file
+        with open(audio_file, 'rb') as audio, job.phase('upload'):
+            sent = await report_upload(
+                progress_msg,
                 f"📦 Size: {size_mb:.1f}MB\n"
-                f"🎵 Format: MP3 ({bitrate} kbps)\n"
-                f"⏳ Please wait..."
+                f"🎵 Format: {label}",
+                message.reply_audio(
+                    audio=upload_input(audio),
+                    title=info.get('title', 'Audio')[:100],
+                    performer=info.get('uploader', 'Unknown')[:100],
+                    duration=int(info.get('duration', 0)),
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
+                ),
+                user_id=user_id,
+                size=file_size
             )
-            await asyncio.sleep(0.5)
         
-        # Send the audio file
-        with open(audio_file, 'rb') as audio:
-            await message.reply_audio(
-                audio=audio,
-                title=info.get('title', 'Audio')[:100],
-                performer=info.get('uploader', 'Unknown')[:100],
-                duration=int(info.get('duration', 0)),
-                read_timeout=120,
-                write_timeout=120
-            )
+        job.moved('upload', file_size)
+        job.outcome = 'ok'
+        users.record_download(user_id, job.bytes['download'])
+        
+        if cache_key:
+            file_cache.put(cache_key, sent.audio.file_id, 'audio', title=info.get('title', 'Audio'))
         
         # Clean up
         os.remove(audio_file)
+        journal.finish(journal_key)
         
         # Success message with animation
-        await progress_msg.edit_text(
+        await progress.edit(progress_msg,
             f"✅ Download Complete!\n\n"
             f"🎵 {info.get('title', 'Audio')[:50]}\n"
-            f"📦 {size_mb:.1f}MB • {bitrate} kbps"
+            f"📦 {size_mb:.1f}MB • {label}"
         )
         await asyncio.sleep(3)
         await progress_msg.delete()
         
     except asyncio.TimeoutError:
+        # Keep the partial download so sending the link again resumes it
+        job.outcome = 'timeout'
+        journal.abandon(journal_key)
         if progress_msg:
-            await progress_msg.edit_text(
+            await progress.edit(progress_msg,
                 "⏱️ Timeout Error\n\n"
                 "❌ Download took too long (>15 min)\n"
-                "💡 Try a shorter video"
+                "💡 Send the link again to resume, or try a shorter video"
             )
     except Exception as e:
+        log.exception("Download failed: %s", url)
+        journal.finish(journal_key)
         error_msg = str(e).replace('[0;31m', '').replace('[0m', '')[:300]
         if 'ffmpeg' in error_msg.lower():
             error_msg = (
@@ -419,140 +1468,162 @@ async def download_youtube_audio(message, url, bitrate):
                 "choco install ffmpeg"
             )
         if progress_msg:
-            await progress_msg.edit_text(f"❌ Error\n\n{error_msg}")
+            await progress.edit(progress_msg, f"❌ Error\n\n{error_msg}")
         else:
             await message.reply_text(f"❌ Error\n\n{error_msg}")
+    finally:
+        # Keep the workspace only while the journal still offers a resume
+        workspaces.close(journal_key, keep=journal.get(journal_key) is not None)
+        job.finish()
+
+async def fit_video_to_limit(progress_msg, filename, duration):
+    """Compress or split a merged video that came out over MAX_FILE_SIZE
+
+    Returns the files to send, each within the limit. progress_msg, if
+    given, shows which of the two is happening.
+    """
+    size_mb = os.path.getsize(filename) / (1024 * 1024)
+    base = filename.rsplit('.', 1)[0]
+    
+    video_kbps = target_video_bitrate(MAX_FILE_SIZE, duration, COMPRESS_AUDIO_KBPS)
+    if OVERSIZE_MODE == 'compress' and video_kbps >= MIN_VIDEO_KBPS:
+        if progress_msg:
+            await progress.edit(progress_msg,
+                f"🗜️ Compressing Video...\n\n"
+                f"📦 {size_mb:.1f}MB → under {LIMIT_TEXT}\n"
+                f"🎞️ Target: {video_kbps} kbps\n"
+                f"⚙️ Using FFmpeg encoder"
+            )
+        target = base + '.fitted.mp4'
+        try:
+            await pipeline.transcode(lambda: compress_video(
+                ffmpeg_binary(), filename, target, video_kbps, COMPRESS_AUDIO_KBPS
+            ))
+        finally:
+            os.remove(filename)
+        if os.path.getsize(target) <= MAX_FILE_SIZE:
+            return [target]
+        filename = target
+    
+    if progress_msg:
+        await progress.edit(progress_msg,
+            f"✂️ Splitting Video...\n\n"
+            f"📦 {os.path.getsize(filename) / (1024 * 1024):.1f}MB → parts under {LIMIT_TEXT}"
+        )
+    try:
+        return await pipeline.transcode(lambda: split_video(
+            ffmpeg_binary(), filename, base, MAX_FILE_SIZE, duration
+        ))
+    finally:
+        os.remove(filename)
 
-async def download_youtube_video(message, url, resolution):
+async def download_youtube_video(message, url, resolution, user_id, flight=None):
     """Download YouTube video"""
     progress_msg = None
-    last_progress = ""
+    job = job_metrics('video')
+    cache_key = youtube_cache_key(url, 'video', resolution)
+    resume_key = cache_key or f"youtube:{url}:video:{resolution}"
+    journal_key = job_key(resume_key, message)
     
     try:
+        # Record the job so a restart can resume it, picking up where an abandoned one stopped
+        adopted = journal.adopt(journal_key, resume_key)
+        journal.start(
+            journal_key, kind='video', url=url, quality=resolution, resume=resume_key,
+            user_id=user_id, message=message.to_dict()
+        )
+        
+        workspace = workspaces.open(journal_key, previous=adopted)
+        
         # Send initial progress message
         progress_msg = await message.reply_text("🔍 Analyzing video...")
         
-        progress_states = {
-            'downloading': [],
-            'processing': False
-        }
+        channel = ProgressChannel()
+        
+        # Set on timeout; a thread can't be cancelled, so its progress hook stops it
+        cancelled = threading.Event()
         
         def progress_hook(d):
-            """Progress callback for yt-dlp"""
+            """Progress callback for yt-dlp, called on the download thread"""
+            if cancelled.is_set():
+                raise download_cancelled()
             if d['status'] == 'downloading':
-                percent = d.get('_percent_str', '0%').strip()
-                speed = d.get('_speed_str', 'N/A').strip()
-                eta = d.get('_eta_str', 'N/A').strip()
-                progress_states['downloading'] = [percent, speed, eta]
-            elif d['status'] == 'finished':
-                progress_states['processing'] = True
-        
-        def download_video():
-            """Blocking download operation"""
-            ydl_opts = {
-                'format': f'bestvideo[height<={resolution}]+bestaudio/best[height<={resolution}]',
-                'outtmpl': 'downloads/%(title)s.%(ext)s',
-                'merge_output_format': 'mp4',
-                'quiet': True,
-                'no_warnings': True,
-                'cookiefile': 'cookies.txt',
-                'progress_hooks': [progress_hook],
-                'socket_timeout': 60,
-                'retries': 5,
-            }
-            
-            # Add FFmpeg location if found
-            if FFMPEG_LOCATION:
-                ydl_opts['ffmpeg_location'] = FFMPEG_LOCATION
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                return filename, info
+                journal.progress(journal_key, d.get('downloaded_bytes', 0))
+                channel.push(
+                    'downloading',
+                    bytes=d.get('downloaded_bytes', 0),
+                    total=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                    speed=d.get('speed'),
+                    eta=d.get('eta'),
+                )
+        
+        async def download_and_merge():
+            with job.phase('download'):
+                base, parts, info = await pipeline.fetch(lambda: fetch_youtube_video(url, resolution, workspace, user_id, progress_hook))
+            job.moved('download', sum(os.path.getsize(part) for part in parts))
+            channel.push('processing')
+            with job.phase('postprocess'):
+                filename = await pipeline.transcode(lambda: merge_into_mp4(base, parts))
+            return filename, info
         
-        # Run download in thread pool
-        loop = asyncio.get_event_loop()
-        download_task = loop.run_in_executor(executor, download_video)
+        # Fetch on the I/O pool, then merge on the CPU stage
+        download_task = asyncio.ensure_future(download_and_merge())
         
-        # Enhanced progress animations
+        # Progress animations
         download_frames = ['📥', '📥▪', '📥▪▪', '📥▪▪▪', '📥▪▪▪▪', '📥▪▪▪▪▪']
         processing_frames = ['🎬', '🎬🎞️', '🎬🎞️📹', '🎬🎞️', '🎬']
         spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
-        progress_bars = ['▱▱▱▱▱▱▱▱▱▱', '▰▱▱▱▱▱▱▱▱▱', '▰▰▱▱▱▱▱▱▱▱', '▰▰▰▱▱▱▱▱▱▱', 
-                        '▰▰▰▰▱▱▱▱▱▱', '▰▰▰▰▰▱▱▱▱▱', '▰▰▰▰▰▰▱▱▱▱', '▰▰▰▰▰▰▰▱▱▱',
-                        '▰▰▰▰▰▰▰▰▱▱', '▰▰▰▰▰▰▰▰▰▱', '▰▰▰▰▰▰▰▰▰▰']
         
-        frame_idx = 0
-        last_update_time = 0
-        
-        # Update progress every 1.5 seconds
-        while not download_task.done():
-            await asyncio.sleep(1.5)
-            
-            current_time = loop.time()
-            if current_time - last_update_time >= 1.5:
-                try:
-                    # Build animated progress message
-                    if progress_states['processing']:
-                        spinner_char = spinner[frame_idx % len(spinner)]
-                        video_icon = processing_frames[frame_idx % len(processing_frames)]
-                        new_progress = (
-                            f"{video_icon} Processing Video...\n\n"
-                            f"{spinner_char} Merging video & audio\n"
-                            f"🎥 Quality: {resolution}p\n"
-                            f"⚙️ Using FFmpeg encoder"
-                        )
-                    elif progress_states['downloading']:
-                        percent, speed, eta = progress_states['downloading']
-                        
-                        # Parse percentage for progress bar
-                        try:
-                            percent_num = float(percent.replace('%', ''))
-                            bar_idx = min(int(percent_num / 10), 10)
-                            progress_bar = progress_bars[bar_idx]
-                        except:
-                            progress_bar = progress_bars[0]
-                        
-                        download_icon = download_frames[frame_idx % len(download_frames)]
-                        new_progress = (
-                            f"{download_icon} Downloading Video\n\n"
-                            f"📊 {progress_bar} {percent}\n"
-                            f"⚡ Speed: {speed}\n"
-                            f"⏱️ ETA: {eta}\n"
-                            f"🎥 Quality: {resolution}p"
-                        )
-                    else:
-                        spinner_char = spinner[frame_idx % len(spinner)]
-                        new_progress = (
-                            f"{spinner_char} Initializing download...\n\n"
-                            f"🔍 Fetching video information\n"
-                            f"🌐 Connecting to YouTube\n"
-                            f"🎥 Target: {resolution}p MP4"
-                        )
-                    
-                    # Update only if changed
-                    if new_progress != last_progress:
-                        await progress_msg.edit_text(new_progress)
-                        last_progress = new_progress
-                    
-                    frame_idx += 1
-                    last_update_time = current_time
-                except:
-                    pass
+        def render(event, frame_idx):
+            """Progress text for an event, and its state without animation"""
+            if event['phase'] == 'processing':
+                spinner_char = spinner[frame_idx % len(spinner)]
+                icon = processing_frames[frame_idx % len(processing_frames)]
+                text = (
+                    f"{icon} Processing Video...\n\n"
+                    f"{spinner_char} Merging video & audio\n"
+                    f"🎥 Quality: {resolution}p\n"
+                    f"⚙️ Using FFmpeg encoder"
+                )
+                return text, 'processing'
+            if event['phase'] == 'downloading':
+                percent = percent_done(event)
+                download_icon = download_frames[frame_idx % len(download_frames)]
+                text = (
+                    f"{download_icon} Downloading Video\n\n"
+                    f"📊 {progress_bar(percent)} {'N/A' if percent is None else f'{percent:.1f}%'}\n"
+                    f"⚡ Speed: {format_speed(event.get('speed'))}\n"
+                    f"⏱️ ETA: {format_eta(event.get('eta'))}\n"
+                    f"🎥 Quality: {resolution}p"
+                )
+                return text, ('downloading', None if percent is None else int(percent))
+            spinner_char = spinner[frame_idx % len(spinner)]
+            text = (
+                f"{spinner_char} Initializing download...\n\n"
+                f"🔍 Fetching video information\n"
+                f"🌐 Connecting to YouTube\n"
+                f"🎥 Target: {resolution}p MP4"
+            )
+            return text, 'starting'
         
         # Get result with 15 minute timeout
-        filename, info = await asyncio.wait_for(download_task, timeout=900)
+        filename, info = await track_progress(
+            download_task, progress_msg, channel, render, flight, timeout=900, cancel=cancelled.set
+        )
         
         # Check file size
         file_size = os.path.getsize(filename)
         size_mb = file_size / (1024 * 1024)
+        height = info.get('height') or resolution
         
-        if file_size > 50 * 1024 * 1024:
+        if file_size > MAX_FILE_SIZE and (OVERSIZE_MODE == 'reject' or not info.get('duration')):
+            job.outcome = 'too_large'
             os.remove(filename)
-            await progress_msg.edit_text(
+            journal.finish(journal_key)
+            await progress.edit(progress_msg,
                 f"❌ File Too Large\n\n"
                 f"📦 Size: {size_mb:.1f}MB\n"
-                f"⚠️ Limit: 50MB\n\n"
+                f"⚠️ Limit: {LIMIT_TEXT}\n\n"
                 f"💡 Try lower quality:\n"
                 f"• 360p for longer videos\n"
                 f"• 480p for medium videos\n"
@@ -560,51 +1631,72 @@ async def download_youtube_video(message, url, resolution):
             )
             return
         
-        # Upload progress with animation
-        upload_frames = ['📤', '📤▫', '📤▫▫', '📤▫▫▫', '📤▫▫▫▫', '📤▫▫▫▫▫']
-        for i in range(3):
-            upload_icon = upload_frames[i % len(upload_frames)]
-            await progress_msg.edit_text(
-                f"{upload_icon} Uploading to Telegram\n\n"
-                f"📦 Size: {size_mb:.1f}MB\n"
-                f"🎥 Format: MP4 ({resolution}p)\n"
-                f"⏳ Please wait..."
-            )
-            await asyncio.sleep(0.5)
+        if file_size > MAX_FILE_SIZE:
+            with job.phase('postprocess'):
+                files = await fit_video_to_limit(progress_msg, filename, info['duration'])
+        else:
+            files = [filename]
+        size_mb = sum(os.path.getsize(path) for path in files) / (1024 * 1024)
         
-        # Send the video file
-        with open(filename, 'rb') as video:
-            await message.reply_video(
-                video=video,
-                caption=info.get('title', 'Video')[:200],
-                duration=int(info.get('duration', 0)),
-                width=int(info.get('width', 0)),
-                height=int(info.get('height', 0)),
-                supports_streaming=True,
-                read_timeout=120,
-                write_timeout=120
-            )
+        # Send the video, in numbered parts if it was split
+        file_ids = []
+        for number, path in enumerate(files, start=1):
+            part = f" • Part {number}/{len(files)}" if len(files) > 1 else ""
+            with open(path, 'rb') as video, job.phase('upload'):
+                sent = await report_upload(
+                    progress_msg,
+                    f"📦 Size: {os.path.getsize(path) / (1024 * 1024):.1f}MB{part}\n"
+                    f"🎥 Format: MP4 ({height}p)",
+                    message.reply_video(
+                        video=upload_input(video),
+                        caption=part_caption(info.get('title', 'Video'), number, len(files)),
+                        duration=int(info.get('duration', 0)) if len(files) == 1 else None,
+                        width=int(info.get('width', 0)),
+                        height=int(info.get('height', 0)),
+                        supports_streaming=True,
+                        read_timeout=UPLOAD_TIMEOUT,
+                        write_timeout=UPLOAD_TIMEOUT
+                    ),
+                    user_id=user_id,
+                    size=os.path.getsize(path)
+                )
+            file_ids.append(sent.video.file_id)
+            job.moved('upload', os.path.getsize(path))
+            os.remove(path)
+        job.outcome = 'ok'
+        users.record_download(user_id, job.bytes['download'])
         
-        # Clean up
-        os.remove(filename)
+        if cache_key and len(file_ids) == 1:
+            file_cache.put(cache_key, file_ids[0], 'video', title=info.get('title', 'Video'))
+        elif cache_key:
+            file_cache.put(cache_key, file_ids[0], 'video_parts', title=info.get('title', 'Video'), file_ids=file_ids)
+        
+        journal.finish(journal_key)
         
         # Success message
-        await progress_msg.edit_text(
+        fitted = f" (fitted from {resolution}p)" if str(height) != str(resolution) else ""
+        parts = f" • {len(files)} parts" if len(files) > 1 else ""
+        await progress.edit(progress_msg,
             f"✅ Download Complete!\n\n"
             f"🎥 {info.get('title', 'Video')[:50]}\n"
-            f"📦 {size_mb:.1f}MB • {resolution}p"
+            f"📦 {size_mb:.1f}MB • {height}p{fitted}{parts}"
         )
         await asyncio.sleep(3)
         await progress_msg.delete()
         
     except asyncio.TimeoutError:
+        # Keep the partial download so sending the link again resumes it
+        job.outcome = 'timeout'
+        journal.abandon(journal_key)
         if progress_msg:
-            await progress_msg.edit_text(
+            await progress.edit(progress_msg,
                 "⏱️ Timeout Error\n\n"
                 "❌ Download took too long (>15 min)\n"
-                "💡 Try lower quality or shorter video"
+                "💡 Send the link again to resume, or try lower quality"
             )
     except Exception as e:
+        log.exception("Download failed: %s", url)
+        journal.finish(journal_key)
         error_msg = str(e).replace('[0;31m', '').replace('[0m', '')[:300]
         if 'ffmpeg' in error_msg.lower():
             error_msg = (
@@ -613,129 +1705,233 @@ async def download_youtube_video(message, url, resolution):
                 "choco install ffmpeg"
             )
         if progress_msg:
-            await progress_msg.edit_text(f"❌ Error\n\n{error_msg}")
+            await progress.edit(progress_msg, f"❌ Error\n\n{error_msg}")
         else:
             await message.reply_text(f"❌ Error\n\n{error_msg}")
         if progress_msg:
-            await progress_msg.edit_text(f"❌ Error: {error_msg}")
+            await progress.edit(progress_msg, f"❌ Error: {error_msg}")
         else:
             await message.reply_text(f"❌ Error: {error_msg}")
+    finally:
+        # Keep the workspace only while the journal still offers a resume
+        workspaces.close(journal_key, keep=journal.get(journal_key) is not None)
+        job.finish()
 
-async def download_regular_file(update: Update, url):
+async def download_regular_file(message, url, user_id):
     """Download regular files from links"""
     progress_msg = None
-    last_progress = ""
+    job = job_metrics('file')
+    resume_key = f"file:{url}"
+    journal_key = job_key(resume_key, message)
+    premium = is_premium_user(user_id)
     
     try:
-        progress_msg = await update.message.reply_text("🔍 Analyzing file...")
+        progress_msg = await message.reply_text("🔍 Analyzing file...")
+        
+        headers = await http.head(url)
+        cache_key = file_cache_key(url, headers)
+        
+        # Answer instantly if the same file version was uploaded before
+        if await send_cached_file(message, cache_key):
+            job.outcome = 'cached'
+            await progress_msg.delete()
+            return
+        
+        # Reject oversized files before fetching a single byte of the body
+        if int(headers.get('content-length', 0)) > MAX_FILE_SIZE:
+            raise FileTooLargeError(int(headers['content-length']))
+        
+        # Record the job so a restart can resume it, picking up where an abandoned one stopped
+        adopted = journal.adopt(journal_key, resume_key)
+        journal.start(journal_key, kind='file', url=url, resume=resume_key, user_id=user_id, message=message.to_dict())
+        workspace = workspaces.open(journal_key, previous=adopted)
         
-        def download_file():
-            response = requests.get(url, stream=True, timeout=60)
-            response.raise_for_status()
+        channel = ProgressChannel()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        
+        def report(downloaded, total, offset=0):
+            """Push a download progress event, with speed over this session's bytes"""
+            elapsed = loop.time() - started
+            speed = (downloaded - offset) / elapsed if elapsed > 0 else None
+            eta = (total - downloaded) / speed if total and speed else None
+            channel.push('downloading', bytes=downloaded, total=total or None, speed=speed, eta=eta)
+        
+        async def resumable_file(validator, total_size):
+            """Stream into a journaled partial file, resuming an earlier attempt"""
+            part_path = journal.part_path(journal_key)
+            entry = journal.get(journal_key)
+            downloaded = 0
+            if entry.get('validator') == validator and os.path.exists(part_path):
+                downloaded = os.path.getsize(part_path)
+            journal.start(journal_key, path=part_path, validator=validator, bytes_done=downloaded)
             
-            # Get filename
-            filename = url.split('/')[-1] or 'downloaded_file'
-            if 'Content-Disposition' in response.headers:
-                content_disp = response.headers['Content-Disposition']
-                if 'filename=' in content_disp:
-                    filename = content_disp.split('filename=')[1].strip('"')
+            if downloaded < total_size:
+                offset = downloaded
+                resume_headers = {'If-Range': validator} if downloaded else None
+                async with http.stream(url, start=downloaded or None, headers=resume_headers) as response:
+                    if response.status_code != 206:
+                        # Server ignored the range or the file changed
+                        downloaded = offset = 0
+                    with open(part_path, 'ab' if downloaded else 'wb') as f:
+                        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                            downloaded += len(chunk)
+                            if downloaded > MAX_FILE_SIZE:
+                                raise FileTooLargeError(downloaded, exact=False)
+                            await download_shaper.athrottle(user_id, premium, len(chunk))
+                            f.write(chunk)
+                            journal.progress(journal_key, downloaded)
+                            report(downloaded, total_size, offset)
             
-            filepath = f"downloads/{filename}"
-            os.makedirs('downloads', exist_ok=True)
+            return open(part_path, 'rb'), get_filename(url, headers), downloaded, headers
+        
+        async def relay_file():
+            """Stream the response body into a spooled buffer for upload"""
+            # Large files from servers with ranges and validators can be resumed
+            validator = headers.get('ETag') or headers.get('Last-Modified')
+            total_size = int(headers.get('content-length', 0))
+            if validator and headers.get('Accept-Ranges', '').lower() == 'bytes' and total_size > SPOOL_MEMORY_LIMIT:
+                return await resumable_file(validator, total_size)
             
-            # Get file size if available
-            total_size = int(response.headers.get('content-length', 0))
+            async with http.stream(url) as response:
+                filename = get_filename(url, response.headers)
+                
+                # Get file size if available
+                total_size = int(response.headers.get('content-length', 0))
+                if total_size > MAX_FILE_SIZE:
+                    raise FileTooLargeError(total_size)
+                
+                # Small files stay in memory, larger ones roll over to disk
+                buffer = scratch_file(workspace, SPOOL_MEMORY_LIMIT)
+                downloaded = 0
+                try:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        downloaded += len(chunk)
+                        # Servers may omit or understate content-length
+                        if downloaded > MAX_FILE_SIZE:
+                            raise FileTooLargeError(downloaded, exact=False)
+                        await download_shaper.athrottle(user_id, premium, len(chunk))
+                        buffer.write(chunk)
+                        report(downloaded, total_size)
+                except BaseException:
+                    buffer.close()
+                    raise
+                
+                buffer.seek(0)
+                return buffer, filename, downloaded, response.headers
+        
+        async def segmented_file():
+            """Fetch byte ranges in parallel into a preallocated temp file"""
+            total_size = int(headers['content-length'])
+            buffer = scratch_file(workspace)
+            received = 0
             
-            # Download file with progress
-            downloaded = 0
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded += len(chunk)
+            def on_chunk(size):
+                nonlocal received
+                received += size
+                report(received, total_size)
             
-            return filepath, filename, total_size
+            try:
+                await http.download_ranges(
+                    url, buffer, total_size,
+                    segments=DOWNLOAD_SEGMENTS,
+                    chunk_size=DOWNLOAD_CHUNK_SIZE,
+                    validator=headers.get('ETag') or headers.get('Last-Modified'),
+                    on_progress=on_chunk,
+                    throttle=lambda size: download_shaper.athrottle(user_id, premium, size)
+                )
+            except BaseException:
+                buffer.close()
+                raise
+            
+            buffer.seek(0)
+            return buffer, get_filename(url, headers), total_size, headers
+        
+        async def download_file():
+            """Download with the configured mode, timed as the job's download phase"""
+            with job.phase('download'):
+                return await fetch_file()
+        
+        async def fetch_file():
+            """Download with the configured mode, falling back to a single stream"""
+            if (
+                DOWNLOAD_MODE == 'segmented'
+                and headers.get('Accept-Ranges', '').lower() == 'bytes'
+                and int(headers.get('content-length', 0)) >= SEGMENTED_MIN_SIZE
+            ):
+                try:
+                    return await segmented_file()
+                except RangeNotSupportedError:
+                    pass
+            return await relay_file()
         
         # Start download with animated progress
-        loop = asyncio.get_event_loop()
-        download_task = loop.run_in_executor(executor, download_file)
+        download_task = asyncio.ensure_future(download_file())
         
         # Progress animations
         download_frames = ['📥', '📥▪', '📥▪▪', '📥▪▪▪', '📥▪▪▪▪', '📥▪▪▪▪▪']
         spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
-        frame_idx = 0
-        last_update_time = 0
         
-        # Update progress every 1.5 seconds
-        while not download_task.done():
-            await asyncio.sleep(1.5)
-            
-            current_time = loop.time()
-            if current_time - last_update_time >= 1.5:
-                try:
-                    spinner_char = spinner[frame_idx % len(spinner)]
-                    download_icon = download_frames[frame_idx % len(download_frames)]
-                    new_progress = (
+        def render(event, frame_idx):
+            """Progress text for an event, and its state without animation"""
+            spinner_char = spinner[frame_idx % len(spinner)]
+            if event['phase'] == 'downloading':
+                percent = percent_done(event)
+                download_icon = download_frames[frame_idx % len(download_frames)]
+                if percent is None:
+                    # Unknown total: show the bytes received so far
+                    text = (
                         f"{download_icon} Downloading File\n\n"
-                        f"{spinner_char} Fetching from server\n"
-                        f"🌐 Connecting...\n"
-                        f"⏳ Please wait..."
+                        f"{spinner_char} {event['bytes'] / (1024 * 1024):.1f}MB received\n"
+                        f"⚡ Speed: {format_speed(event.get('speed'))}"
                     )
-                    
-                    if new_progress != last_progress:
-                        await progress_msg.edit_text(new_progress)
-                        last_progress = new_progress
-                    
-                    frame_idx += 1
-                    last_update_time = current_time
-                except:
-                    pass
+                    return text, ('downloading', event['bytes'] // (1024 * 1024))
+                text = (
+                    f"{download_icon} Downloading File\n\n"
+                    f"📊 {progress_bar(percent)} {percent:.1f}%\n"
+                    f"⚡ Speed: {format_speed(event.get('speed'))}\n"
+                    f"⏱️ ETA: {format_eta(event.get('eta'))}"
+                )
+                return text, ('downloading', int(percent))
+            text = (
+                f"📥 Downloading File\n\n"
+                f"{spinner_char} Fetching from server\n"
+                f"🌐 Connecting...\n"
+                f"⏳ Please wait..."
+            )
+            return text, 'starting'
         
         # Get result with 5 minute timeout
-        filepath, filename, total_size = await asyncio.wait_for(
-            download_task,
-            timeout=300
-        )
-        
-        # Check file size
-        file_size = os.path.getsize(filepath)
+        buffer, filename, file_size, headers = await track_progress(download_task, progress_msg, channel, render, timeout=300)
+        cache_key = cache_key or file_cache_key(url, headers)
         size_mb = file_size / (1024 * 1024)
+        job.moved('download', file_size)
         
-        if file_size > 50 * 1024 * 1024:
-            os.remove(filepath)
-            await progress_msg.edit_text(
-                f"❌ File Too Large\n\n"
-                f"📦 Size: {size_mb:.1f}MB\n"
-                f"⚠️ Limit: 50MB\n\n"
-                f"💡 Telegram has a 50MB file size limit"
-            )
-            return
-        
-        # Upload animation
-        upload_frames = ['📤', '📤▫', '📤▫▫', '📤▫▫▫', '📤▫▫▫▫', '📤▫▫▫▫▫']
-        for i in range(3):
-            upload_icon = upload_frames[i % len(upload_frames)]
-            await progress_msg.edit_text(
-                f"{upload_icon} Uploading to Telegram\n\n"
+        with buffer, job.phase('upload'):
+            # Send file straight from the download buffer
+            sent = await report_upload(
+                progress_msg,
                 f"📦 Size: {size_mb:.1f}MB\n"
-                f"📄 File: {filename[:30]}\n"
-                f"⏳ Please wait..."
-            )
-            await asyncio.sleep(0.5)
-        
-        # Send file
-        with open(filepath, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
-                filename=filename,
-                read_timeout=120,
-                write_timeout=120
+                f"📄 File: {filename[:30]}",
+                message.reply_document(
+                    document=named_upload(buffer, workspace, filename),
+                    filename=filename,
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
+                ),
+                user_id=user_id,
+                size=file_size
             )
         
-        # Clean up
-        os.remove(filepath)
+        job.moved('upload', file_size)
+        job.outcome = 'ok'
+        users.record_download(user_id, job.bytes['download'])
+        if cache_key:
+            file_cache.put(cache_key, sent.document.file_id, 'document', filename=filename)
+        journal.finish(journal_key)
         
         # Success message
-        await progress_msg.edit_text(
+        await progress.edit(progress_msg,
             f"✅ Download Complete!\n\n"
             f"📄 {filename[:40]}\n"
             f"📦 {size_mb:.1f}MB"
@@ -744,50 +1940,611 @@ async def download_regular_file(update: Update, url):
         await progress_msg.delete()
         
     except asyncio.TimeoutError:
+        # Keep the partial download so sending the link again resumes it
+        job.outcome = 'timeout'
+        journal.abandon(journal_key)
         if progress_msg:
-            await progress_msg.edit_text(
+            await progress.edit(progress_msg,
                 "⏱️ Timeout Error\n\n"
                 "❌ Download took too long (>5 min)\n"
-                "💡 File may be too large or slow"
+                "💡 Send the link again to resume"
+            )
+    except httpx.TransportError as e:
+        job.outcome = 'connection_lost'
+        journal.abandon(journal_key)
+        if progress_msg:
+            await progress.edit(progress_msg,
+                f"🌐 Connection Lost\n\n"
+                f"❌ {str(e)[:200] or type(e).__name__}\n"
+                f"💡 Send the link again to resume"
             )
+    except FileTooLargeError as e:
+        job.outcome = 'too_large'
+        journal.finish(journal_key)
+        await progress.edit(progress_msg,
+            f"❌ File Too Large\n\n"
+            f"📦 Size: {'' if e.exact else 'over '}{e.size / (1024 * 1024):.1f}MB\n"
+            f"⚠️ Limit: {LIMIT_TEXT}\n\n"
+            f"💡 Telegram has a {LIMIT_TEXT} file size limit"
+        )
     except Exception as e:
+        log.exception("Download failed: %s", url)
+        journal.finish(journal_key)
         error_msg = str(e)[:300]
         if progress_msg:
-            await progress_msg.edit_text(
+            await progress.edit(progress_msg,
                 f"❌ Download Error\n\n"
                 f"{error_msg}"
             )
         else:
-            await update.message.reply_text(
+            await message.reply_text(
                 f"❌ Download Error\n\n"
                 f"{error_msg}"
             )
+    finally:
+        # Keep the workspace only while the journal still offers a resume
+        workspaces.close(journal_key, keep=journal.get(journal_key) is not None)
+        job.finish()
 
-def main():
-    """Start the bot"""
-    # Create downloads directory
-    os.makedirs('downloads', exist_ok=True)
+async def handle_batch(message, links):
+    """Expand playlists in a multi-link message and offer one format menu for all of it"""
+    status_msg = await message.reply_text("🔍 Collecting batch items...")
+    
+    items = []
+    loop = asyncio.get_running_loop()
+    for link in links:
+        if link.kind != 'playlist':
+            items.append(link.url)
+            continue
+        try:
+            entries = await loop.run_in_executor(probe_executor, expand_playlist, link.url)
+        except Exception:
+            log.warning("Playlist lookup failed for %s", link.url, exc_info=True)
+            continue
+        items += [entry.url for entry in map(classify, entries) if entry]
+    # Normalized URLs make differently written links to one video the same item
+    items = list(dict.fromkeys(items))[:BATCH_MAX_ITEMS]
+    
+    if not items:
+        await status_msg.edit_text("❌ No downloadable links found in this message.")
+        return
+    
+    # Plain files have no format to choose
+    if not any(is_youtube_url(url) for url in items):
+        await run_batch(status_msg, message.from_user.id, items, 'file', None)
+        return
+    
+    store.set('links', link_key(status_msg), {'urls': items, 'sizes': {}}, ttl=LINK_TTL)
+    keyboard = [
+        [InlineKeyboardButton("🎵 Audio", callback_data="format_audio")],
+        [InlineKeyboardButton("🎬 Video", callback_data="format_video")]
+    ]
+    await status_msg.edit_text(
+        f"📦 Batch of {len(items)} links detected!\n\n"
+        "Please choose format:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def fetch_direct_file(url, workspace, job, user_id):
+    """Download a direct link of a batch into workspace, or find it in the file cache"""
+    with job.phase('download'):
+        async with http.stream(url) as response:
+            filename = get_filename(url, response.headers)
+            cache_key = file_cache_key(url, response.headers)
+            entry = file_cache.get(cache_key) if cache_key else None
+            if entry and entry['kind'] == 'document':
+                return {'kind': 'document', 'file_id': entry['file_id'], 'filename': filename}
+            
+            if int(response.headers.get('content-length', 0)) > MAX_FILE_SIZE:
+                raise FileTooLargeError(int(response.headers['content-length']))
+            
+            # Named as shown, since a local Bot API server ignores filename=
+            path = os.path.join(workspace, safe_filename(filename))
+            downloaded = 0
+            with open(path, 'wb') as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    downloaded += len(chunk)
+                    if downloaded > MAX_FILE_SIZE:
+                        raise FileTooLargeError(downloaded, exact=False)
+                    await download_shaper.athrottle(user_id, is_premium_user(user_id), len(chunk))
+                    f.write(chunk)
+    job.moved('download', downloaded)
+    return {'kind': 'document', 'path': path, 'filename': filename, 'cache_key': cache_key}
+
+async def fetch_batch_item(url, kind, quality, workspace, job, user_id):
+    """Download and convert one item of a batch; returns the media to send for it"""
+    os.makedirs(workspace, exist_ok=True)
+    if kind == 'file':
+        return [await fetch_direct_file(url, workspace, job, user_id)]
+    
+    cache_key = youtube_cache_key(url, kind, quality)
+    entry = file_cache.get(cache_key) if cache_key else None
+    if entry:
+        job.outcome = 'cached'
+        title = entry['meta'].get('title', 'Video')
+        file_ids = entry['meta'].get('file_ids') or [entry['file_id']]
+        if kind == 'audio':
+            return [{'kind': 'audio', 'file_id': file_ids[0]}]
+        return [
+            {'kind': 'video', 'file_id': file_id, 'caption': part_caption(title, number, len(file_ids))}
+            for number, file_id in enumerate(file_ids, start=1)
+        ]
+    
+    if kind == 'audio':
+        with job.phase('download'):
+            source_file, info = await pipeline.fetch(lambda: fetch_youtube_audio(url, quality, workspace, user_id))
+        job.moved('download', os.path.getsize(source_file))
+        mode = job.fields['audio'] = audio_mode(info, quality)
+        with job.phase('postprocess'):
+            audio_file = await pipeline.transcode(lambda: convert_audio(source_file, mode, quality))
+        if os.path.getsize(audio_file) > MAX_FILE_SIZE:
+            raise FileTooLargeError(os.path.getsize(audio_file))
+        return [{
+            'kind': 'audio',
+            'path': audio_file,
+            'cache_key': cache_key,
+            'title': info.get('title', 'Audio')[:100],
+            'performer': info.get('uploader', 'Unknown')[:100],
+            'duration': int(info.get('duration', 0)),
+        }]
+    
+    with job.phase('download'):
+        base, parts, info = await pipeline.fetch(lambda: fetch_youtube_video(url, quality, workspace, user_id))
+    job.moved('download', sum(os.path.getsize(part) for part in parts))
+    with job.phase('postprocess'):
+        filename = await pipeline.transcode(lambda: merge_into_mp4(base, parts))
+        files = [filename]
+        if os.path.getsize(filename) > MAX_FILE_SIZE:
+            if OVERSIZE_MODE == 'reject' or not info.get('duration'):
+                raise FileTooLargeError(os.path.getsize(filename))
+            files = await fit_video_to_limit(None, filename, info['duration'])
+    
+    title = info.get('title', 'Video')
+    return [{
+        'kind': 'video',
+        'path': path,
+        # Split videos are cached by the single-download path only
+        'cache_key': cache_key if len(files) == 1 else None,
+        'title': title,
+        'caption': part_caption(title, number, len(files)),
+        'duration': int(info.get('duration', 0)) if len(files) == 1 else None,
+        'width': int(info.get('width') or 0),
+        'height': int(info.get('height') or 0),
+    } for number, path in enumerate(files, start=1)]
+
+INPUT_MEDIA = {'audio': InputMediaAudio, 'video': InputMediaVideo, 'document': InputMediaDocument}
+
+def media_fields(item):
+    """Send options of a batch item, shared by single sends and media groups"""
+    if item['kind'] == 'audio':
+        return {key: item.get(key) for key in ('title', 'performer', 'duration')}
+    if item['kind'] == 'video':
+        fields = {key: item.get(key) for key in ('caption', 'duration', 'width', 'height')}
+        return dict(fields, supports_streaming=True)
+    return {'filename': item.get('filename')}
+
+async def send_media(message, items):
+    """Send batch items of one kind, as a media group when there are several
+
+    Returns the sent messages in the order of items.
+    """
+    with ExitStack() as files:
+        media = [item.get('file_id') or upload_input(files.enter_context(open(item['path'], 'rb'))) for item in items]
+        if len(items) == 1:
+            kind = items[0]['kind']
+            send = getattr(message, f"reply_{kind}")
+            return [await send(
+                **{kind: media[0]}, **media_fields(items[0]),
+                read_timeout=UPLOAD_TIMEOUT, write_timeout=UPLOAD_TIMEOUT
+            )]
+        return await message.reply_media_group(
+            [INPUT_MEDIA[item['kind']](file, **media_fields(item)) for item, file in zip(items, media)],
+            read_timeout=UPLOAD_TIMEOUT, write_timeout=UPLOAD_TIMEOUT
+        )
+
+def batch_error(error):
+    """Short reason a batch item failed, for the summary"""
+    if isinstance(error, FileTooLargeError):
+        return f"over {LIMIT_TEXT}"
+    if isinstance(error, asyncio.TimeoutError):
+        return "took too long (>15 min)"
+    if isinstance(error, DiskFullError):
+        return "server storage full"
+    if isinstance(error, QueueFullError):
+        return "too many downloads queued"
+    if isinstance(error, QuotaExceededError):
+        return "daily quota reached"
+    return str(error).replace('\x1b[0;31m', '').replace('\x1b[0m', '')[:80] or type(error).__name__
+
+async def run_batch(status_msg, user_id, urls, kind, quality):
+    """Download a batch of links and upload each item as soon as it is ready
+    
+    Up to BATCH_CONCURRENCY items download at once through the fair queue,
+    never more than the user's tier allows.
+    Items that finish while an upload is running go out together in the
+    next media group, and status_msg shows the progress of the whole batch.
+    """
+    key = f"batch:{link_key(status_msg)}"
+    workspace = workspaces.open(key)
+    premium = is_premium_user(user_id)
+    budget = asyncio.Semaphore(BATCH_CONCURRENCY)
+    ready = asyncio.Queue()
+    states = ['waiting'] * len(urls)
+    jobs = {}
+    errors = []
+    
+    def render(done=False):
+        """Batch progress text, and its state without the title"""
+        counts = {state: states.count(state) for state in ('waiting', 'downloading', 'ready', 'throttled', 'sent', 'failed')}
+        finished = counts['sent'] + counts['failed']
+        state = (
+            f"📊 {progress_bar(finished * 100 / len(urls))} {finished}/{len(urls)}\n"
+            f"⏬ Downloading: {counts['downloading']} • 📤 Uploading: {counts['ready']}\n"
+            + (f"🚦 Waiting for bandwidth: {counts['throttled']}\n" if counts['throttled'] else "")
+            + f"🕒 Waiting: {counts['waiting']}\n"
+            f"✅ Sent: {counts['sent']} • ❌ Failed: {counts['failed']}"
+        )
+        title = "✅ Batch Complete!" if done else "📦 Batch Download"
+        return f"{title}\n\n{state}", state
     
+    def finish(number, outcome, error=None):
+        states[number] = 'sent' if error is None else 'failed'
+        if error is not None:
+            errors.append((number, batch_error(error)))
+        job = jobs[number]
+        if job.outcome != 'cached' or error is not None:
+            job.outcome = outcome
+        if job.outcome == 'ok':
+            users.record_download(user_id, job.bytes['download'])
+        job.finish()
+        progress.update(status_msg, *render())
+    
+    async def fetch(number, url):
+        item_kind = kind if is_youtube_url(url) else 'file'
+        jobs[number] = job_metrics(item_kind)
+        
+        async def download():
+            if quota_left(user_id) == 0:
+                raise QuotaExceededError()
+            if not workspaces.admit():
+                raise DiskFullError("Server storage is full")
+            states[number] = 'downloading'
+            progress.update(status_msg, *render())
+            return await asyncio.wait_for(
+                fetch_batch_item(url, item_kind, quality, os.path.join(workspace, str(number)), jobs[number], user_id),
+                timeout=900
+            )
+        
+        async with budget:
+            try:
+                queue = file_scheduler if item_kind == 'file' else scheduler
+                media = await queue.run(user_id, premium, download, limit=BATCH_CONCURRENCY)
+            except Exception as e:
+                if not isinstance(e, (FileTooLargeError, DiskFullError, QueueFullError, QuotaExceededError, asyncio.TimeoutError)):
+                    log.warning("Batch item failed: %s", url, exc_info=True)
+                outcome = {FileTooLargeError: 'too_large', asyncio.TimeoutError: 'timeout'}.get(type(e), 'error')
+                finish(number, outcome, e)
+                return
+            states[number] = 'ready'
+            await ready.put((number, media))
+    
+    def mark(numbers, state):
+        """Move ready items to waiting for upload bandwidth, or back"""
+        if any(states[number] != state for number in numbers):
+            for number in numbers:
+                states[number] = state
+            progress.update(status_msg, *render())
+    
+    async def upload():
+        """Send whatever is ready, grouped by kind, until the batch is done"""
+        while True:
+            entries = [await ready.get()]
+            while not ready.empty():
+                entries.append(ready.get_nowait())
+            
+            groups = {}
+            for number, media in sorted(entry for entry in entries if entry is not None):
+                for item in media:
+                    groups.setdefault(item['kind'], []).append((number, item))
+            
+            failed = {}
+            for group in groups.values():
+                for start in range(0, len(group), MEDIA_GROUP_SIZE):
+                    chunk = group[start:start + MEDIA_GROUP_SIZE]
+                    numbers = {number for number, _ in chunk}
+                    try:
+                        with ExitStack() as phases:
+                            for number in numbers:
+                                phases.enter_context(jobs[number].phase('upload'))
+                            size = sum(os.path.getsize(item['path']) for _, item in chunk if 'path' in item)
+                            await wait_for_bandwidth(user_id, size, lambda left: mark(numbers, 'throttled'))
+                            mark(numbers, 'ready')
+                            sent = await send_media(status_msg, [item for _, item in chunk])
+                    except Exception as e:
+                        log.exception("Batch upload failed")
+                        failed.update(dict.fromkeys(numbers, e))
+                        continue
+                    for (number, item), message in zip(chunk, sent):
+                        if 'path' not in item:
+                            continue
+                        jobs[number].moved('upload', os.path.getsize(item['path']))
+                        if item.get('cache_key'):
+                            file_id = getattr(message, item['kind']).file_id
+                            file_cache.put(item['cache_key'], file_id, item['kind'], **(
+                                {'filename': item['filename']} if item['kind'] == 'document'
+                                else {'title': item['title']}
+                            ))
+                        os.remove(item['path'])
+            
+            for number, _ in (entry for entry in entries if entry is not None):
+                finish(number, 'ok' if number not in failed else 'error', failed.get(number))
+            if None in entries:
+                return
+    
+    uploader = asyncio.ensure_future(upload())
+    try:
+        progress.update(status_msg, *render())
+        await asyncio.gather(*(fetch(number, url) for number, url in enumerate(urls)))
+        await ready.put(None)
+        await uploader
+        
+        text, _ = render(done=True)
+        if errors:
+            text += "\n\n" + "\n".join(f"❌ {number + 1}. {reason}" for number, reason in sorted(errors)[:10])
+        await progress.edit(status_msg, text)
+    finally:
+        uploader.cancel()
+        workspaces.close(key)
+
+async def resume_download(bot, key, entry):
+    """Requeue a journaled download and deliver it to the original chat"""
+    message = Message.de_json(entry['message'], bot)
+    user_id = entry.get('user_id')
+    status_text = "♻️ Resuming your download after a restart..."
+    try:
+        status_msg = await message.reply_text(status_text)
+    except TelegramError:
+        # Chat is gone or the bot was blocked
+        journal.finish(key)
+        return
+    
+    job = lambda: run_download(message, entry)
+    
+    queue = file_scheduler if entry['kind'] == 'file' else scheduler
+    await schedule_download(status_msg, user_id, status_text, job, queue=queue)
+
+def sweep_downloads():
+    """Expire stale abandoned downloads, then evict files no job refers to"""
+    keep = set()
+    for key, entry in journal.entries().items():
+        if (
+            entry.get('abandoned')
+            and time.time() - entry.get('updated', 0) > ABANDONED_TTL
+            and not workspaces.is_active(key)
+        ):
+            journal.finish(key)
+            continue
+        keep.add(workspaces.path(key))
+        if entry.get('path'):
+            keep.add(entry['path'])
+    return workspaces.sweep(keep, extra_dirs=[journal.partial_dir])
+
+async def run_janitor():
+    """Sweep the downloads directory every JANITOR_INTERVAL seconds"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(probe_executor, sweep_downloads)
+        except OSError as e:
+            log.warning("Janitor sweep failed: %s", e)
+        await asyncio.sleep(JANITOR_INTERVAL)
+
+async def run_user_flusher():
+    """Write usage counters every USER_FLUSH_INTERVAL seconds"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(USER_FLUSH_INTERVAL)
+        try:
+            await loop.run_in_executor(probe_executor, users.flush)
+        except sqlite3.Error as e:
+            log.warning("Writing user usage failed: %s", e)
+
+def log_warm_up(future):
+    """Report a failed warm-up, which would otherwise go unnoticed until the first download"""
+    if not future.cancelled() and future.exception() is not None:
+        log.error("Warm-up failed", exc_info=future.exception())
+
+async def on_startup(app: Application):
+    """Warm the extractors, start the janitor and metrics server, and resume interrupted downloads"""
+    # Updates are served while this runs; a link arriving first just waits for the import
+    warming = asyncio.get_running_loop().run_in_executor(probe_executor, warm_up)
+    warming.add_done_callback(log_warm_up)
+    for coroutine in (run_janitor(), run_user_flusher()):
+        task = asyncio.create_task(coroutine)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    if METRICS_PORT:
+        status_server = StatusServer(health=health_report, metrics=metrics_report, port=METRICS_PORT)
+        await status_server.start()
+        app.bot_data['status_server'] = status_server
+    if work_queue is not None:
+        # Jobs of a stopped worker are claimed again once their lease runs out
+        return
+    
+    for key, entry in journal.pending().items():
+        task = asyncio.create_task(resume_download(app.bot, key, entry))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+async def on_shutdown(app: Application):
+    """Release shared resources when the bot stops"""
+    for task in list(background_tasks):
+        task.cancel()
+    status_server = app.bot_data.pop('status_server', None)
+    if status_server is not None:
+        await status_server.stop()
+    await http.close()
+    await progress.close()
+    ydl_pool.close()
+    users.close()
+
+def build_application(base_url=None):
+    """Create the application with every handler registered"""
     # Create application with proxy support if needed
     builder = Application.builder().token(BOT_TOKEN)
+    if LOCAL_BOT_API:
+        # Uploads are sent as file:// paths the server reads itself
+        builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot").local_mode(True)
+    if base_url:
+        builder.base_url(base_url)
     
-    # Increase timeouts
-    builder.read_timeout(30).write_timeout(30).connect_timeout(30)
+    # Increase timeouts; the transport records Bot API latency and 429s
+    builder.request(InstrumentedRequest(
+        api_seconds, api_responses,
+        connection_pool_size=BOT_API_CONNECTIONS,
+        read_timeout=30, write_timeout=30, connect_timeout=30
+    ))
+    
+    # Handle updates concurrently so queued downloads don't block new messages
+    builder.concurrent_updates(True)
+    builder.post_init(on_startup)
+    builder.post_shutdown(on_shutdown)
     
     app = builder.build()
     
     # Add handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("premium", premium_info))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("grant", grant_premium))
+    app.add_handler(CommandHandler("revoke", revoke_premium))
+    app.add_handler(CommandHandler("quota", set_quota))
+    app.add_handler(CommandHandler("user", user_info))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_link))
     app.add_handler(CallbackQueryHandler(format_callback, pattern="^format_"))
     app.add_handler(CallbackQueryHandler(format_callback, pattern="^back_to_format$"))
     app.add_handler(CallbackQueryHandler(format_callback, pattern="^premium_required$"))
     app.add_handler(CallbackQueryHandler(download_callback, pattern="^(audio_|video_)"))
+    return app
+
+def health_report():
+    """Liveness and load figures for the /healthz endpoint"""
+    return {
+        'status': 'ok',
+        'media_jobs': scheduler.active,
+        'media_queued': scheduler.queued,
+        'file_jobs': file_scheduler.active,
+        'file_queued': file_scheduler.queued,
+    }
+
+def stop_signal():
+    """Event set on SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: Ctrl+C still raises KeyboardInterrupt
+            pass
+    return stop
+
+async def serve_webhook(app):
+    """Receive updates on Telegram's webhook until SIGINT/SIGTERM"""
+    server = WebhookServer(
+        app, WEBHOOK_PATH, WEBHOOK_SECRET, health=health_report, metrics=metrics_report, port=PORT
+    )
+    stop = stop_signal()
+    
+    async with app:
+        # run_polling/run_webhook call these hooks, a custom server has to
+        await on_startup(app)
+        await app.start()
+        await server.start()
+        try:
+            await app.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            log.info("Bot started (webhook on port %s)...", server.port)
+            await stop.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+            await on_shutdown(app)
+
+async def run_worker(app):
+    """Execute downloads from the shared work queue until SIGINT/SIGTERM"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    slots = asyncio.Semaphore(WORKER_JOBS)
+    stop = stop_signal()
+    running = set()
+    
+    async def execute(job_id, job):
+        async def keep_lease():
+            while True:
+                await asyncio.sleep(JOB_LEASE / 3)
+                work_queue.renew(job_id, worker_id, JOB_LEASE)
+        
+        lease = asyncio.create_task(keep_lease())
+        try:
+            message = Message.de_json(job['message'], app.bot)
+            await run_download(message, job, JobProgress(work_queue, job_id))
+        except Exception as e:
+            log.exception("Job %s failed", job_id)
+            work_queue.finish(job_id, error=str(e)[:300])
+        else:
+            work_queue.finish(job_id, result={'worker': worker_id})
+        finally:
+            lease.cancel()
+            slots.release()
+    
+    async with app:
+        await on_startup(app)
+        log.info("Worker %s started...", worker_id)
+        try:
+            while not stop.is_set():
+                await slots.acquire()
+                # Leave jobs to other workers while this host's disk budget is used up
+                claimed = work_queue.claim(worker_id, JOB_LEASE) if workspaces.has_room() else None
+                if claimed is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=work_queue.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                task = asyncio.create_task(execute(*claimed))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            # Unfinished jobs go back to the queue when their lease expires
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            await on_shutdown(app)
+
+def main():
+    """Start the bot"""
+    # Create downloads directory
+    os.makedirs('downloads', exist_ok=True)
+    
+    app = build_application()
     
     # Start bot
-    print("Bot started...")
-    app.run_polling()
+    if sys.argv[1:] == ['worker']:
+        if work_queue is None:
+            raise ValueError("WORK_QUEUE must point at a shared queue to run a worker!")
+        asyncio.run(run_worker(app))
+    elif BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL (or RENDER_EXTERNAL_URL) is required in webhook mode!")
+        asyncio.run(serve_webhook(app))
+    else:
+        log.info("Bot started...")
+        app.run_polling()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
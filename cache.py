@@ -0,0 +1,82 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class FileIdCache:
+    """Persistent LRU/TTL cache mapping download keys to Telegram file_ids"""
+
+    def __init__(self, path, max_entries=5000, ttl=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            "key TEXT PRIMARY KEY, file_id TEXT NOT NULL, kind TEXT NOT NULL, "
+            "meta TEXT, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids (last_used)")
+        self._db.commit()
+
+    def get(self, key):
+        """Return the cached entry for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id, kind, meta, created FROM file_ids WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            file_id, kind, meta, created = row
+            if now - created > self.ttl:
+                self._db.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE file_ids SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return {'file_id': file_id, 'kind': kind, 'meta': json.loads(meta or '{}')}
+
+    def put(self, key, file_id, kind, **meta):
+        """Store a file_id and evict the least recently used entries over the limit"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_ids (key, file_id, kind, meta, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, file_id, kind, json.dumps(meta), now, now)
+            )
+            self._db.execute("DELETE FROM file_ids WHERE created < ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM file_ids WHERE key IN ("
+                "SELECT key FROM file_ids ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    def invalidate(self, key):
+        """Drop a single entry, e.g. when Telegram rejects a stale file_id"""
+        with self._lock:
+            self._db.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+            self._db.commit()
+
+    def stats(self):
+        """Return entry count and hit/miss counters"""
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM file_ids").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import httpx
+
+
+class RangeNotSupportedError(Exception):
+    """Raised when a server answers a ranged request with the whole body"""
+
+
+def _write_at(fd, data, offset, lock):
+    """Positional write, emulated with a lock where os.pwrite is missing (Windows)"""
+    if hasattr(os, 'pwrite'):
+        os.pwrite(fd, data, offset)
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def split_ranges(size, segments):
+    """Split size bytes into at most segments inclusive (start, end) ranges"""
+    segments = max(1, min(segments, size))
+    step = -(-size // segments)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+class HttpClient:
+    """Shared async HTTP client with a bounded, keep-alive connection pool
+
+    One httpx.AsyncClient is reused for every direct-link download so
+    repeat requests to a host skip the TCP and TLS handshake, and a
+    per-host semaphore keeps any single server from taking the whole pool.
+    """
+
+    def __init__(self, max_connections=100, max_per_host=6, max_keepalive=20, timeout=60):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self._client = None
+        self._hosts = {}
+
+    @property
+    def client(self):
+        """The underlying httpx client, created on first use inside the event loop"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=30,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=15),
+                follow_redirects=True,
+            )
+        return self._client
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc.lower()
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.max_per_host)
+        return self._hosts[host]
+
+    async def head(self, url, timeout=15):
+        """Return response headers for url, or an empty dict if HEAD fails"""
+        try:
+            async with self._host_slot(url):
+                response = await self.client.head(url, timeout=timeout)
+        except httpx.HTTPError:
+            return {}
+        return response.headers if response.is_success else {}
+
+    @asynccontextmanager
+    async def stream(self, url, start=None, end=None, headers=None):
+        """Stream a GET response, optionally limited to the byte range start-end
+
+        Raises httpx.HTTPStatusError for error responses. A ranged request
+        answered with 200 means the server ignored the Range header, and
+        callers should check response.status_code == 206.
+        """
+        headers = dict(headers or {})
+        if start is not None:
+            headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+
+        async with self._host_slot(url):
+            async with self.client.stream('GET', url, headers=headers) as response:
+                response.raise_for_status()
+                yield response
+
+    async def download_ranges(
+        self, url, file, size, segments=4, chunk_size=65536, validator=None, on_progress=None, throttle=None
+    ):
+        """Fetch size bytes of url as parallel byte ranges into file
+
+        The file is preallocated and every segment writes at its own offset.
+        Passing the ETag/Last-Modified as validator makes the server send
+        the whole body (and this raise RangeNotSupportedError) if the file
+        changed between segments. on_progress(n) is called after every n
+        bytes written, and throttle(n) awaited before writing them.
+        """
+        file.truncate(size)
+        fd = file.fileno()
+        lock = threading.Lock()
+        headers = {'If-Range': validator} if validator else None
+
+        async def fetch(start, end):
+            async with self.stream(url, start, end, headers=headers) as response:
+                if response.status_code != 206:
+                    raise RangeNotSupportedError(url)
+                offset = start
+                async for chunk in response.aiter_bytes(chunk_size):
+                    if offset + len(chunk) > end + 1:
+                        raise ValueError(f"Server sent more than the requested range {start}-{end}")
+                    if throttle:
+                        await throttle(len(chunk))
+                    _write_at(fd, chunk, offset, lock)
+                    offset += len(chunk)
+                    if on_progress:
+                        on_progress(len(chunk))
+                if offset != end + 1:
+                    raise ValueError(f"Range {start}-{end} ended early at byte {offset}")
+
+        tasks = [asyncio.create_task(fetch(start, end)) for start, end in split_ranges(size, segments)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
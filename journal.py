@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DownloadJournal:
+    """On-disk record of in-flight downloads so they survive timeouts and restarts
+
+    Each entry holds the source URL, bytes done, HTTP validators, the
+    serialized Telegram message to reply to and, for direct links, the path
+    of the partial file. Keys are unique per job; the resume field names
+    what is being downloaded, so a new job for the same thing can adopt the
+    partial data of an abandoned one.
+
+    Entries live in one SQLite file that every process on a host shares, so
+    worker processes see each other's jobs instead of overwriting them.
+    Progress updates are written at most every flush_interval seconds per job.
+    """
+
+    def __init__(self, path, flush_interval=2.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.partial_dir = os.path.join(os.path.dirname(path) or '.', 'partial')
+        self._lock = threading.Lock()
+        self._last_flush = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Transactions are explicit, so a read-modify-write holds the file's write lock
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "key TEXT PRIMARY KEY, resume TEXT, abandoned INTEGER NOT NULL DEFAULT 0, entry TEXT NOT NULL)"
+        )
+
+    def part_path(self, key):
+        """Stable location of the partial file for a journal key"""
+        os.makedirs(self.partial_dir, exist_ok=True)
+        return os.path.join(self.partial_dir, hashlib.sha1(key.encode()).hexdigest()[:20] + '.part')
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def start(self, key, **fields):
+        """Record a job as in flight, keeping progress from an earlier attempt"""
+        with self._transaction():
+            entry = self._get(key) or {'bytes_done': 0}
+            entry.update(fields, abandoned=False, updated=time.time())
+            self._put(key, entry)
+
+    def adopt(self, key, resume):
+        """Move an abandoned job with the same resume key over to key
+
+        Returns the key the entry had, so its other files can follow it, or
+        None when key is already journaled or nothing matches.
+        """
+        with self._transaction():
+            if self._get(key) is not None:
+                return None
+            row = self._db.execute(
+                "SELECT key, entry FROM jobs WHERE resume = ? AND abandoned = 1 LIMIT 1", (resume,)
+            ).fetchone()
+            if row is None:
+                return None
+            old_key, entry = row[0], json.loads(row[1])
+            self._db.execute("DELETE FROM jobs WHERE key = ?", (old_key,))
+            entry.update(abandoned=False, updated=time.time())
+            path = entry.get('path')
+            if path and os.path.exists(path):
+                entry['path'] = self.part_path(key)
+                os.replace(path, entry['path'])
+                # Young again, so no sweep evicts it before the new job writes to it
+                os.utime(entry['path'])
+            self._put(key, entry)
+            return old_key
+
+    def progress(self, key, bytes_done, **fields):
+        """Update bytes done, writing to disk only every flush_interval"""
+        with self._lock:
+            if time.monotonic() - self._last_flush.get(key, 0) < self.flush_interval:
+                return
+            self._last_flush[key] = time.monotonic()
+        with self._transaction():
+            entry = self._get(key)
+            if entry is None:
+                return
+            entry.update(fields, bytes_done=bytes_done, updated=time.time())
+            self._put(key, entry)
+
+    def abandon(self, key):
+        """Keep the partial data for a retry, but don't resume it on restart"""
+        with self._transaction():
+            entry = self._get(key)
+            if entry is not None:
+                entry['abandoned'] = True
+                self._put(key, entry)
+            self._last_flush.pop(key, None)
+
+    def finish(self, key):
+        """Forget a job and delete its partial file"""
+        with self._transaction():
+            entry = self._get(key)
+            if entry is None:
+                return
+            self._db.execute("DELETE FROM jobs WHERE key = ?", (key,))
+            self._last_flush.pop(key, None)
+        path = entry.get('path')
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def entries(self):
+        """Every journaled job, abandoned ones included"""
+        with self._lock:
+            rows = self._db.execute("SELECT key, entry FROM jobs").fetchall()
+        return {key: json.loads(entry) for key, entry in rows}
+
+    def pending(self):
+        """Jobs that were in flight when the bot last stopped"""
+        with self._lock:
+            rows = self._db.execute("SELECT key, entry FROM jobs WHERE abandoned = 0").fetchall()
+        return {key: json.loads(entry) for key, entry in rows}
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _get(self, key):
+        row = self._db.execute("SELECT entry FROM jobs WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, key, entry):
+        self._db.execute(
+            "INSERT OR REPLACE INTO jobs (key, resume, abandoned, entry) VALUES (?, ?, ?, ?)",
+            (key, entry.get('resume'), int(bool(entry.get('abandoned'))), json.dumps(entry))
+        )
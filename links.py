@@ -0,0 +1,120 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# kind is 'youtube' (a video), 'playlist' (a YouTube playlist) or 'direct';
+# id is the video or playlist id, or the normalized URL of a direct link
+Link = namedtuple('Link', 'kind id url')
+
+# Every host serving YouTube pages, and the short-link hosts whose path is the id
+YOUTUBE_HOSTS = frozenset({
+    'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'gaming.youtube.com',
+    'youtube-nocookie.com', 'www.youtube-nocookie.com', 'youtu.be', 'www.youtu.be',
+})
+SHORT_HOSTS = frozenset({'youtu.be', 'www.youtu.be'})
+# /shorts/<id>, /embed/<id>, /live/<id>, /v/<id>, /e/<id>
+ID_PATHS = frozenset({'shorts', 'embed', 'live', 'v', 'e'})
+# Ids may be followed by punctuation the link was pasted with, but not by more id characters
+VIDEO_ID = re.compile(r'[A-Za-z0-9_-]{11}(?![A-Za-z0-9_-])')
+PLAYLIST_ID = re.compile(r'[A-Za-z0-9_-]{10,64}(?![A-Za-z0-9_-])')
+
+# Query parameters that only identify who shared a link
+TRACKING_PARAMS = frozenset({
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', 'ref_src',
+})
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+# Links in a message; the scheme in any case, as keyboards capitalize it
+LINK_PATTERN = re.compile(r'https?://\S+', re.IGNORECASE)
+# Punctuation a link in a sentence is followed by, never taken as part of it
+TRAILING_PUNCTUATION = '.,;:!?)]>\'"'
+
+# scheme, userinfo, host, port, path and query of an absolute or scheme-less URL
+URL_PARTS = re.compile(r"""
+    (?:([A-Za-z][A-Za-z0-9+.-]*)://)?
+    (?:([^@/?#]*)@)?
+    (\[[^\]/?#]*\]|[^:/?#]*)
+    (?::(\d*))?
+    ([^?#]*)
+    (?:\?([^#]*))?
+""", re.VERBOSE)
+# v= and list= in a query; ids are never percent-encoded, so no decoding is needed
+YOUTUBE_PARAM = re.compile(r'(?:^|&)(v|list)=([^&]*)')
+
+
+@lru_cache(maxsize=4096)
+def classify(url):
+    """Link(kind, id, normalized URL) for a supported link, None for anything else
+
+    YouTube links of every host and path variant map to the same watch or
+    playlist URL, so the id can key caches. Direct links must be http(s);
+    they keep their path and query as sent, minus tracking parameters and
+    the fragment.
+    """
+    scheme, userinfo, host, port, path, query = URL_PARTS.match(url.strip()).groups()
+    if path and path[0] != '/':
+        # A port that isn't a number
+        return None
+    host = host.lower().rstrip('.')
+    if host in YOUTUBE_HOSTS:
+        return _youtube(host, path, query or '')
+    scheme = (scheme or '').lower()
+    if scheme not in DEFAULT_PORTS or not host or port and int(port) > 65535:
+        return None
+    return _direct(scheme, userinfo, host, port, path, query or '')
+
+
+def _youtube(host, path, query):
+    params = {}
+    for name, value in YOUTUBE_PARAM.findall(query):
+        params.setdefault(name, value)
+    segments = path.strip('/').split('/')
+    if host in SHORT_HOSTS:
+        candidate = segments[0]
+    elif len(segments) >= 2 and segments[0] in ID_PATHS:
+        candidate = segments[1]
+    else:
+        candidate = params.get('v', '')
+    match = VIDEO_ID.match(candidate)
+    if match:
+        video_id = match.group()
+        return Link('youtube', video_id, f'https://www.youtube.com/watch?v={video_id}')
+
+    match = PLAYLIST_ID.match(params.get('list', ''))
+    if match:
+        playlist = match.group()
+        return Link('playlist', playlist, f'https://www.youtube.com/playlist?list={playlist}')
+
+    # Channels and other pages: left for yt-dlp to make sense of, without an id
+    return Link('youtube', None, f"https://www.youtube.com{path}{'?' + query if query else ''}")
+
+
+def _tracking(param):
+    name = param.split('=', 1)[0].lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def _direct(scheme, userinfo, host, port, path, query):
+    netloc = host
+    if port and int(port) != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{int(port)}'
+    if userinfo is not None:
+        netloc = f'{userinfo}@{netloc}'
+    # Parameters are kept byte for byte; signed URLs break if they are re-encoded
+    query = '&'.join(param for param in query.split('&') if param and not _tracking(param))
+    url = f"{scheme}://{netloc}{path or '/'}{'?' + query if query else ''}"
+    return Link('direct', url, url)
+
+
+def find_links(text):
+    """The supported links in a message, classified, in the order they appear"""
+    links = (classify(match.rstrip(TRAILING_PUNCTUATION)) for match in LINK_PATTERN.findall(text))
+    return [link for link in links if link]
+
+
+def youtube_video_id(url):
+    """The video id of a YouTube link, None for anything else"""
+    link = classify(url)
+    return link.id if link and link.kind == 'youtube' else None
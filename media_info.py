@@ -0,0 +1,304 @@
+import queue
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+AUDIO_BITRATES = ('128', '192', '320')
+VIDEO_RESOLUTIONS = ('360', '480', '720', '1080', '1440')
+
+AUDIO_FORMAT_SPEC = 'bestaudio/best'
+# Prefer YouTube's AAC stream, which Telegram plays as is once remuxed into .m4a
+AUDIO_PASSTHROUGH_SPEC = 'bestaudio[acodec^=mp4a]/bestaudio/best'
+
+# Signed stream URLs carry their expiry as ?expire=<ts> or /expire/<ts>/
+EXPIRE_PATTERN = re.compile(r'[?&/]expire[=/](\d+)')
+
+
+def video_format_spec(resolution):
+    """yt-dlp format selection for a video download at most resolution pixels tall"""
+    return f'bestvideo[height<={resolution}]+bestaudio/best[height<={resolution}]'
+
+
+def passes_through(fmt, bitrate, tolerance):
+    """Whether a downloaded audio format can be sent without re-encoding
+
+    Only AAC qualifies, since Telegram's audio player takes MP3 and M4A. A
+    stream within tolerance of the requested bitrate is kept as is, so each
+    menu option still sends a distinct file: a 128 kbps stream answers a
+    128 kbps request, while 192 and 320 kbps are encoded as asked.
+    """
+    abr = fmt.get('abr') or fmt.get('tbr')
+    return (
+        tolerance is not None
+        and (fmt.get('acodec') or '').startswith('mp4a')
+        and bool(abr) and int(bitrate) * (1 - tolerance) <= abr <= int(bitrate) * (1 + tolerance)
+    )
+
+
+def audio_format_spec(ydl, info, bitrate, tolerance):
+    """yt-dlp format selection for an audio download at bitrate, from processed info
+
+    The AAC stream is only fetched when it will be sent as is; audio that
+    gets encoded anyway starts from the best stream, usually Opus.
+    """
+    if tolerance is None:
+        return AUDIO_FORMAT_SPEC
+    source, _ = _select(ydl, _selector_context(info.get('formats') or []), AUDIO_PASSTHROUGH_SPEC, 0)
+    if source and passes_through(source, bitrate, tolerance):
+        return AUDIO_PASSTHROUGH_SPEC
+    return AUDIO_FORMAT_SPEC
+
+
+def copy_info(info):
+    """Copy an unprocessed info dict deeply enough for yt-dlp to process it again"""
+    info = dict(info)
+    for key in ('formats', 'thumbnails'):
+        if info.get(key):
+            info[key] = [dict(item) for item in info[key]]
+    return info
+
+
+def format_size(fmt, duration):
+    """Exact or approximate byte size of a single yt-dlp format"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return size
+
+
+def _selector_context(formats):
+    """The context yt-dlp's format selectors expect, built from processed formats"""
+    return {
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': (
+            all(f.get('vcodec') == 'none' for f in formats)
+            or all(f.get('acodec') == 'none' for f in formats)
+        ),
+    }
+
+
+def _select(ydl, ctx, spec, duration):
+    """The format a spec selects, and its predicted size (None if unknown)"""
+    selected = list(ydl.build_format_selector(spec)(dict(ctx)))
+    if not selected:
+        return None, None
+    parts = selected[0].get('requested_formats') or [selected[0]]
+    part_sizes = [format_size(part, duration) for part in parts]
+    return selected[0], sum(part_sizes) if all(part_sizes) else None
+
+
+def predict_sizes(ydl, info, passthrough_tolerance=None):
+    """Predict the output size in bytes of every audio and video option
+
+    Video sizes come from running yt-dlp's own format selector on the
+    processed info, so the prediction matches what the download would pick.
+    With a passthrough tolerance, audio options that would send the source
+    stream as is take its size. Options whose size can't be estimated map
+    to None.
+    """
+    duration = info.get('duration') or 0
+    ctx = _selector_context(info.get('formats') or [])
+    source = None
+    if passthrough_tolerance is not None:
+        source, source_size = _select(ydl, ctx, AUDIO_PASSTHROUGH_SPEC, duration)
+    sizes = {}
+    for bitrate in AUDIO_BITRATES:
+        if source and passes_through(source, bitrate, passthrough_tolerance):
+            sizes[f'audio_{bitrate}'] = source_size
+        else:
+            # Constant-bitrate MP3 output
+            sizes[f'audio_{bitrate}'] = int(bitrate) * 1000 / 8 * duration if duration else None
+
+    for resolution in VIDEO_RESOLUTIONS:
+        _, sizes[f'video_{resolution}'] = _select(ydl, ctx, video_format_spec(resolution), duration)
+    return sizes
+
+
+def fit_video_format(ydl, info, resolution, limit):
+    """Format spec of the best video at most resolution tall predicted to fit in limit bytes
+
+    Every available height from resolution down is tried in turn. Returns
+    (spec, height) of the selected format ids, the lowest quality if nothing
+    is predicted to fit, or (None, None) if sizes can't be predicted.
+    """
+    duration = info.get('duration') or 0
+    formats = info.get('formats') or []
+    ctx = _selector_context(formats)
+    heights = sorted({f['height'] for f in formats if f.get('height') and f['height'] <= int(resolution)}, reverse=True)
+
+    choice = None, None
+    for height in heights:
+        selected, size = _select(ydl, ctx, video_format_spec(height), duration)
+        if selected is None:
+            continue
+        if size is None:
+            return None, None
+        choice = selected['format_id'], selected.get('height') or height
+        if size <= limit:
+            break
+    return choice
+
+
+class _KeyLock:
+    """Weak-referenceable lock, one per key being extracted"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+def stream_expiry(info):
+    """Earliest Unix expiry among the info's stream URLs, or None"""
+    expiries = [
+        int(match.group(1))
+        for fmt in info.get('formats') or []
+        for match in [EXPIRE_PATTERN.search(fmt.get('url') or '')]
+        if match
+    ]
+    return min(expiries) if expiries else None
+
+
+class ExtractionCache:
+    """Process-wide, size-bounded cache of raw yt-dlp info dicts by video id
+
+    Entries live until shortly before their signed stream URLs expire
+    (capped at max_ttl), so cached info can always be downloaded from.
+    Concurrent misses for the same id share a single extraction.
+    """
+
+    def __init__(self, max_ttl=3600, max_entries=500, expiry_margin=300):
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.expiry_margin = expiry_margin
+        self.hits = 0
+        self.misses = 0
+        self.extract_time = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = weakref.WeakValueDictionary()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() > entry[0]:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, info):
+        """Cache a single-video info dict; playlists and expired links are skipped"""
+        if info.get('_type', 'video') != 'video':
+            return
+        ttl = self.max_ttl
+        expiry = stream_expiry(info)
+        if expiry is not None:
+            ttl = min(ttl, expiry - time.time() - self.expiry_margin)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_extract(self, key, extract):
+        """Return cached info for key, running extract() once on a miss"""
+        info = self.get(key)
+        if info is not None:
+            return info
+
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = _KeyLock()
+
+        with key_lock.lock:
+            # Another thread may have extracted it while we waited
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() <= entry[0]:
+                    self.misses -= 1
+                    self.hits += 1
+                    return entry[1]
+
+            started = time.monotonic()
+            info = extract()
+            self.extract_time += time.monotonic() - started
+            self.put(key, info)
+            return info
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'avg_extract_time': self.extract_time / self.misses if self.misses else 0.0,
+        }
+
+
+class YoutubeDLPool:
+    """Reusable YoutubeDL instances for metadata extraction
+
+    Reusing an instance keeps its extractors, and the player JS and
+    signature functions they have already loaded, warm between requests.
+    """
+
+    def __init__(self, factory, size):
+        self.size = size
+        self._factory = factory
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        try:
+            ydl = self._factory()
+            ydl.get_info_extractor('Youtube')
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+        return ydl
+
+    @contextmanager
+    def borrow(self):
+        """Check out an idle instance, creating one while under the size limit"""
+        try:
+            ydl = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            ydl = self._create() if create else self._idle.get()
+        try:
+            yield ydl
+        finally:
+            self._idle.put(ydl)
+
+    def warm(self):
+        """Create every instance up front so the first requests don't pay for it"""
+        while True:
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            self._idle.put(self._create())
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,253 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+# Seconds; spans single Bot API calls up to long downloads and transcodes
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+log = logging.getLogger('bot')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    """Sample value without the precision loss of %g"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    """A named family of samples, one per combination of label values
+
+    Values are either recorded as they happen, or taken at scrape time from
+    read(), which returns {tuple of label values: value}.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=(), read=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.read = read
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        if self.read is not None:
+            values = {tuple(str(part) for part in key): value for key, value in self.read().items()}
+            with self._lock:
+                self._values = values
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in items]
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            # Last slot is the +Inf bucket, i.e. the number of observations
+            counts[-1] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            bounds = [f'{bound:g}' for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (bound,))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=(), read=None):
+        return self._add(Counter(name, help_text, labels, read))
+
+    def gauge(self, name, help_text, labels=(), read=None):
+        return self._add(Gauge(name, help_text, labels, read))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+class JobMetrics:
+    """Phase timings and byte counts of one download job
+
+    finish() records them in the registry's job metrics and logs one line
+    per job with every field, for the structured log.
+    """
+
+    def __init__(self, kind, phase_seconds, job_seconds, jobs, transferred):
+        self.kind = kind
+        self.outcome = 'error'
+        self.phases = {}
+        self.bytes = {'download': 0, 'upload': 0}
+        # Extra per-job facts for the log line, such as how audio was made
+        self.fields = {}
+        self._phase_seconds = phase_seconds
+        self._job_seconds = job_seconds
+        self._jobs = jobs
+        self._transferred = transferred
+        self._started = time.monotonic()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the job; repeated phases add up"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            self._phase_seconds.observe(elapsed, kind=self.kind, phase=name)
+
+    def moved(self, direction, size):
+        """Count bytes downloaded or uploaded"""
+        self.bytes[direction] += size
+        self._transferred.inc(size, kind=self.kind, direction=direction)
+
+    def finish(self):
+        elapsed = time.monotonic() - self._started
+        self._jobs.inc(kind=self.kind, outcome=self.outcome)
+        self._job_seconds.observe(elapsed, kind=self.kind, outcome=self.outcome)
+        log.info("job finished", extra={'fields': {
+            'kind': self.kind,
+            'outcome': self.outcome,
+            'seconds': round(elapsed, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'bytes': self.bytes,
+            **self.fields,
+        }})
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that times every call and counts flood-control answers"""
+
+    def __init__(self, latency, responses, **kwargs):
+        super().__init__(**kwargs)
+        self._latency = latency
+        self._responses = responses
+
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.monotonic()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            self._responses.inc(method=endpoint, code='error')
+            raise
+        finally:
+            self._latency.observe(time.monotonic() - started, method=endpoint)
+        self._responses.inc(method=endpoint, code=code)
+        return code, payload
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log line, with a record's extra 'fields' merged in"""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain log lines, with a record's extra 'fields' appended as key=value"""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={json.dumps(value, default=str)}' for key, value in fields.items())
+        return text
+
+
+def configure_logging(json_format, level='INFO'):
+    """Send logs to stderr, as JSON lines or plain text"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_format else TextFormatter('%(asctime)s %(levelname)s %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # httpx logs every request at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
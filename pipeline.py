@@ -0,0 +1,204 @@
+import asyncio
+import glob
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StageStats:
+    """Running counters and timings for one pipeline stage"""
+
+    def __init__(self):
+        self.count = 0
+        self.active = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_wait = 0.0
+
+    def record(self, elapsed, waited=0.0):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.total_wait += waited
+
+    def snapshot(self):
+        return {
+            'jobs': self.count,
+            'active': self.active,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time,
+            'avg_wait': self.total_wait / self.count if self.count else 0.0,
+        }
+
+
+class MediaPipeline:
+    """Two-stage download pipeline
+
+    Network fetches run on an I/O thread pool. FFmpeg conversions and merges
+    are queued to a separate stage sized to the CPU count, so a long
+    transcode never holds a slot that could be downloading.
+    """
+
+    def __init__(self, io_workers, cpu_workers):
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='fetch')
+        # Each thread only waits on an FFmpeg child process
+        self.cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix='ffmpeg')
+        self.fetch_stats = StageStats()
+        self.transcode_stats = StageStats()
+        self._queue = None
+        self._workers = []
+
+    async def fetch(self, fn):
+        """Run a blocking network fetch on the I/O pool"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        self.fetch_stats.active += 1
+        try:
+            return await loop.run_in_executor(self.io_pool, fn)
+        finally:
+            self.fetch_stats.active -= 1
+            self.fetch_stats.record(time.monotonic() - started)
+
+    async def transcode(self, fn):
+        """Queue a blocking FFmpeg step for the CPU stage and wait for its result"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [
+                asyncio.create_task(self._transcode_worker())
+                for _ in range(self.cpu_workers)
+            ]
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, future, time.monotonic()))
+        return await future
+
+    async def _transcode_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, future, queued_at = await self._queue.get()
+            if future.cancelled():
+                self._queue.task_done()
+                continue
+
+            started = time.monotonic()
+            self.transcode_stats.active += 1
+            try:
+                result = await loop.run_in_executor(self.cpu_pool, fn)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.transcode_stats.active -= 1
+                self.transcode_stats.record(time.monotonic() - started, started - queued_at)
+                self._queue.task_done()
+
+    def report(self):
+        """Queue depth, pool sizes and per-stage timings"""
+        return {
+            'fetch': dict(self.fetch_stats.snapshot(), workers=self.io_workers),
+            'transcode': dict(
+                self.transcode_stats.snapshot(),
+                workers=self.cpu_workers,
+                queued=self._queue.qsize() if self._queue else 0,
+            ),
+        }
+
+
+def download_streams(ydl, info):
+    """Download each requested yt-dlp format to its own file without merging"""
+    base = ydl.prepare_filename(info).rsplit('.', 1)[0]
+    parts = []
+    for fmt in info.get('requested_formats') or [info]:
+        part_info = dict(info)
+        part_info.pop('requested_formats', None)
+        part_info.update(fmt)
+        path = f"{base}.f{fmt['format_id']}.{fmt['ext']}"
+        success, _ = ydl.dl(path, part_info)
+        if not success:
+            raise RuntimeError(f"Download of format {fmt['format_id']} failed")
+        parts.append(path)
+    return base, parts
+
+
+def run_ffmpeg(ffmpeg, args):
+    """Run FFmpeg and raise with the tail of its log on failure"""
+    result = subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', *args],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Encoder exited with code {result.returncode}: {result.stderr.strip()[-200:]}")
+
+
+def transcode_audio(ffmpeg, source, target, bitrate):
+    """Convert any audio/video file to MP3 at the given bitrate"""
+    run_ffmpeg(ffmpeg, ['-i', source, '-vn', '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', target])
+
+
+def remux_audio(ffmpeg, source, target):
+    """Copy the audio stream into a new container without re-encoding it"""
+    run_ffmpeg(ffmpeg, ['-i', source, '-vn', '-codec:a', 'copy', '-movflags', '+faststart', target])
+
+
+def merge_video(ffmpeg, parts, target):
+    """Remux separate video/audio streams (or a single stream) into MP4"""
+    if len(parts) == 1 and parts[0].endswith('.mp4'):
+        os.replace(parts[0], target)
+        return
+
+    args = []
+    for part in parts:
+        args += ['-i', part]
+    if len(parts) > 1:
+        args += ['-map', '0:v:0', '-map', '1:a:0']
+    args += ['-c', 'copy', '-movflags', '+faststart', target]
+    run_ffmpeg(ffmpeg, args)
+
+
+def target_video_bitrate(max_size, duration, audio_kbps, headroom=0.95):
+    """Video bitrate in kbps that keeps a duration-second MP4 under max_size bytes
+
+    headroom leaves room for container overhead and encoder overshoot.
+    """
+    return int(max_size * 8 * headroom / duration / 1000 - audio_kbps)
+
+
+def compress_video(ffmpeg, source, target, video_kbps, audio_kbps=128):
+    """Re-encode to H.264/AAC at a target bitrate in a single pass"""
+    run_ffmpeg(ffmpeg, [
+        '-i', source,
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps}k', '-bufsize', f'{video_kbps * 2}k',
+        '-c:a', 'aac', '-b:a', f'{audio_kbps}k',
+        '-movflags', '+faststart', target
+    ])
+
+
+def split_video(ffmpeg, source, base, max_size, duration, attempts=3):
+    """Cut an MP4 at keyframes into numbered parts of at most max_size bytes
+
+    Parts are stream copies, so a cut lands on the first keyframe after each
+    segment boundary; if a part still comes out too big the split is redone
+    with shorter segments.
+    """
+    segment_time = duration * max_size * 0.9 / os.path.getsize(source)
+    for _ in range(attempts):
+        run_ffmpeg(ffmpeg, [
+            '-i', source, '-map', '0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', f'{segment_time:.2f}', '-reset_timestamps', '1',
+            '-segment_format_options', 'movflags=+faststart',
+            f'{base}.part%03d.mp4'
+        ])
+        parts = sorted(glob.glob(f'{glob.escape(base)}.part[0-9][0-9][0-9].mp4'))
+        largest = max(os.path.getsize(part) for part in parts)
+        if largest <= max_size:
+            return parts
+        for part in parts:
+            os.remove(part)
+        segment_time *= max_size * 0.9 / largest
+    raise RuntimeError("Could not split the video into parts under the upload limit")
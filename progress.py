@@ -0,0 +1,254 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+
+def _seconds(retry_after):
+    """RetryAfter.retry_after as seconds, whichever type PTB hands back"""
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class ProgressChannel:
+    """Thread-safe channel of progress events from a job into the event loop
+
+    push() may be called from any thread, e.g. a yt-dlp progress hook. Each
+    event is a dict with a phase and any of bytes, total, speed and eta.
+    Events in the same phase are throttled to one per min_interval, and
+    readers only ever see the latest one.
+    """
+
+    def __init__(self, min_interval=0.5):
+        self.min_interval = min_interval
+        self.latest = {'phase': 'starting'}
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._last_phase = 'starting'
+        self._last_push = 0.0
+
+    def push(self, phase, **fields):
+        now = time.monotonic()
+        if phase == self._last_phase and now - self._last_push < self.min_interval:
+            return
+        self._last_phase = phase
+        self._last_push = now
+        self._loop.call_soon_threadsafe(self._deliver, dict(fields, phase=phase))
+
+    def _deliver(self, event):
+        self.latest = event
+        self._changed.set()
+
+    async def wait(self):
+        """Wait for a new event and return it"""
+        await self._changed.wait()
+        self._changed.clear()
+        return self.latest
+
+
+class ProgressService:
+    """Central, rate-limited sender of progress-message edits
+
+    Jobs call update() as often as they like. Only the latest text per
+    message is kept, updates whose state matches what the user already sees
+    are dropped, and a single flusher sends the rest within a global
+    edits-per-second budget and a minimum interval per chat. A RetryAfter
+    from Telegram pauses every edit for the requested time and widens the
+    offending chat's interval until its edits succeed again.
+    """
+
+    def __init__(self, global_rate=25, chat_interval=1.0, max_backoff=16):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.merged = 0
+        self.skipped = 0
+        self.flood_waits = 0
+        # (chat_id, message_id) -> (message, text, state), oldest first
+        self._pending = OrderedDict()
+        self._shown = {}
+        self._inflight = {}
+        self._chat_ready = {}
+        self._chat_backoff = {}
+        self._paused_until = 0.0
+        self._tokens = float(global_rate)
+        self._refilled = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @staticmethod
+    def _key(message):
+        return message.chat_id, message.message_id
+
+    def update(self, message, text, state=None):
+        """Queue text for message, replacing any edit not sent yet
+
+        state is what counts as a meaningful change (the text by default);
+        an update whose state is already on screen is skipped.
+        """
+        key = self._key(message)
+        state = text if state is None else state
+        if key in self._pending:
+            self.merged += 1
+            del self._pending[key]
+        if self._shown.get(key) == state:
+            self.skipped += 1
+            return
+        self._pending[key] = (message, text, state)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    async def edit(self, message, text, **kwargs):
+        """Edit message right away, superseding its queued updates
+
+        For phase changes and final results. Still waits out a flood pause
+        and the global budget, and stops tracking the message afterwards.
+        """
+        key = self._key(message)
+        self._pending.pop(key, None)
+        inflight = self._inflight.get(key)
+        if inflight:
+            await asyncio.wait({inflight})
+            self._pending.pop(key, None)
+        self._shown.pop(key, None)
+
+        for attempt in range(3):
+            await self._acquire()
+            try:
+                return await message.edit_text(text, **kwargs)
+            except RetryAfter as e:
+                self._flood_wait(key[0], e)
+                if attempt == 2:
+                    raise
+
+    def forget(self, message):
+        """Stop tracking a message that gets no further updates"""
+        key = self._key(message)
+        self._pending.pop(key, None)
+        self._shown.pop(key, None)
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'merged': self.merged,
+            'skipped': self.skipped,
+            'flood_waits': self.flood_waits,
+            'pending': len(self._pending),
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._inflight.values(), return_exceptions=True)
+            self._task = None
+
+    def _take_token(self, now):
+        self._tokens = min(self.global_rate, self._tokens + (now - self._refilled) * self.global_rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _acquire(self):
+        """Wait for the flood pause to end and a global budget token"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+            elif self._take_token(now):
+                return
+            else:
+                await asyncio.sleep((1 - self._tokens) / self.global_rate)
+
+    def _flood_wait(self, chat_id, error):
+        self.flood_waits += 1
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + _seconds(error.retry_after))
+        self._chat_backoff[chat_id] = min(self._chat_backoff.get(chat_id, 1) * 2, self.max_backoff)
+
+    def _next_ready(self, now):
+        """Oldest pending message whose chat may be edited now, and when the next one may"""
+        next_time = None
+        for key in self._pending:
+            if key in self._inflight:
+                continue
+            ready = self._chat_ready.get(key[0], 0.0)
+            if ready <= now:
+                return key, now
+            next_time = ready if next_time is None else min(next_time, ready)
+        return None, next_time
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            wake_at = None
+            if now < self._paused_until:
+                wake_at = self._paused_until
+            elif self._pending:
+                key, ready = self._next_ready(now)
+                if key is None:
+                    wake_at = ready
+                elif not self._take_token(now):
+                    wake_at = now + (1 - self._tokens) / self.global_rate
+                else:
+                    chat_id = key[0]
+                    self._chat_ready[chat_id] = now + self.chat_interval * self._chat_backoff.get(chat_id, 1)
+                    message, text, state = self._pending.pop(key)
+                    task = loop.create_task(self._send(key, message, text, state))
+                    self._inflight[key] = task
+                    task.add_done_callback(lambda _, key=key: self._sent_done(key))
+                    continue
+
+            if wake_at is None:
+                # Idle: drop per-chat deadlines that have already passed
+                self._chat_ready = {chat: ready for chat, ready in self._chat_ready.items() if ready > now}
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(wake_at - now, 0))
+                except asyncio.TimeoutError:
+                    pass
+
+    def _sent_done(self, key):
+        self._inflight.pop(key, None)
+        # A newer update may have been held back while this one was in flight
+        if key in self._pending:
+            self._wakeup.set()
+
+    async def _send(self, key, message, text, state):
+        chat_id = key[0]
+        try:
+            await message.edit_text(text)
+        except RetryAfter as e:
+            self._flood_wait(chat_id, e)
+            # Retry after the pause unless a newer update replaced it
+            if key not in self._pending:
+                self._pending[key] = (message, text, state)
+            self._wakeup.set()
+            return
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                self._shown.pop(key, None)
+                return
+        except TelegramError:
+            # Message deleted or chat gone
+            self._shown.pop(key, None)
+            return
+
+        self.sent += 1
+        self._shown[key] = state
+        backoff = self._chat_backoff.get(chat_id)
+        if backoff:
+            if backoff <= 2:
+                del self._chat_backoff[chat_id]
+            else:
+                self._chat_backoff[chat_id] = backoff / 2
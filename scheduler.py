@@ -0,0 +1,136 @@
+import asyncio
+from collections import OrderedDict, deque
+
+
+class QueueFullError(Exception):
+    """Raised when a user already has too many jobs waiting"""
+
+
+class _Job:
+    __slots__ = ('user_id', 'premium', 'admitted', 'on_queued', 'limit', 'position')
+
+    def __init__(self, user_id, premium, admitted, on_queued, limit=None):
+        self.user_id = user_id
+        self.premium = premium
+        self.admitted = admitted
+        self.on_queued = on_queued
+        self.limit = limit
+        self.position = None
+
+
+class JobScheduler:
+    """Fair per-user job queue with a priority lane for premium users
+
+    Jobs are admitted round-robin across users so one user with many links
+    cannot starve everyone else. The premium lane is always served first,
+    and each user has a cap on how many of their jobs run at once.
+    """
+
+    def __init__(self, workers=3, per_user_limit=1, premium_per_user_limit=2, max_queued_per_user=5):
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.premium_per_user_limit = premium_per_user_limit
+        self.max_queued_per_user = max_queued_per_user
+        # premium -> {user_id: deque of waiting jobs}, in round-robin order
+        self._lanes = {True: OrderedDict(), False: OrderedDict()}
+        self._running = {}
+        self.active = 0
+
+    @property
+    def queued(self):
+        """Number of jobs waiting for a worker"""
+        return sum(len(jobs) for lane in self._lanes.values() for jobs in lane.values())
+
+    async def run(self, user_id, premium, job, on_queued=None, limit=None):
+        """Wait for a free slot, then run the job coroutine factory
+
+        on_queued(position) is awaited whenever the job's 1-based queue
+        position changes while it is waiting. limit lowers the user's
+        concurrency cap for this job, as for the items of a batch.
+        """
+        waiting = self._lanes[premium].get(user_id)
+        if waiting and len(waiting) >= self.max_queued_per_user:
+            raise QueueFullError(f"{len(waiting)} jobs already queued")
+
+        entry = _Job(user_id, premium, asyncio.get_running_loop().create_future(), on_queued, limit)
+        self._lanes[premium].setdefault(user_id, deque()).append(entry)
+        self._dispatch()
+
+        try:
+            await entry.admitted
+        except asyncio.CancelledError:
+            self._discard(entry)
+            raise
+
+        try:
+            return await job()
+        finally:
+            self._release(user_id)
+
+    def _limit(self, premium):
+        return self.premium_per_user_limit if premium else self.per_user_limit
+
+    def _next_job(self):
+        """Pop the next admissible job, premium lane first, round-robin by user"""
+        for premium in (True, False):
+            lane = self._lanes[premium]
+            for user_id, jobs in list(lane.items()):
+                limit = self._limit(premium)
+                if jobs[0].limit:
+                    limit = min(jobs[0].limit, limit)
+                if self._running.get(user_id, 0) >= limit:
+                    continue
+                lane.pop(user_id)
+                entry = jobs.popleft()
+                if jobs:
+                    # Re-append so the user goes to the back of the rotation
+                    lane[user_id] = jobs
+                return entry
+        return None
+
+    def _dispatch(self):
+        while self.active < self.workers:
+            entry = self._next_job()
+            if entry is None:
+                break
+            self.active += 1
+            self._running[entry.user_id] = self._running.get(entry.user_id, 0) + 1
+            entry.admitted.set_result(None)
+        self._notify_positions()
+
+    def _release(self, user_id):
+        self.active -= 1
+        self._running[user_id] -= 1
+        if not self._running[user_id]:
+            del self._running[user_id]
+        self._dispatch()
+
+    def _discard(self, entry):
+        lane = self._lanes[entry.premium]
+        jobs = lane.get(entry.user_id)
+        if jobs and entry in jobs:
+            jobs.remove(entry)
+            if not jobs:
+                del lane[entry.user_id]
+        if entry.admitted.done() and not entry.admitted.cancelled():
+            # Admitted in the same tick it was cancelled
+            self._release(entry.user_id)
+        self._notify_positions()
+
+    def _order(self):
+        """Waiting jobs in the order they would be admitted"""
+        order = []
+        for premium in (True, False):
+            queues = [list(jobs) for jobs in self._lanes[premium].values()]
+            depth = 0
+            while queues:
+                order.extend(jobs[depth] for jobs in queues)
+                depth += 1
+                queues = [jobs for jobs in queues if len(jobs) > depth]
+        return order
+
+    def _notify_positions(self):
+        for position, entry in enumerate(self._order(), start=1):
+            if entry.position != position and entry.on_queued:
+                entry.position = position
+                asyncio.get_running_loop().create_task(entry.on_queued(position))
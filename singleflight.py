@@ -0,0 +1,58 @@
+import asyncio
+from contextlib import contextmanager
+
+
+class Flight:
+    """One in-progress download that identical later requests subscribe to"""
+
+    def __init__(self, key):
+        self.key = key
+        self.text = None
+        self.followers = 0
+        self._done = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def publish(self, text):
+        """Share the leader's latest progress text with every follower"""
+        if text != self.text:
+            self.text = text
+            self._changed.set()
+
+    async def wait_for_update(self, timeout):
+        """Wait until the progress text changes, the flight lands, or timeout passes"""
+        waiters = [asyncio.ensure_future(self._changed.wait()), asyncio.ensure_future(self._done.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        self._changed.clear()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent downloads so only the first one does the work"""
+
+    def __init__(self):
+        self._flights = {}
+
+    def get(self, key):
+        """The in-progress flight for key, if any"""
+        return self._flights.get(key)
+
+    @property
+    def active(self):
+        return len(self._flights)
+
+    @contextmanager
+    def lead(self, key):
+        """Register the caller as the one doing the work for key"""
+        flight = self._flights[key] = Flight(key)
+        try:
+            yield flight
+        finally:
+            del self._flights[key]
+            flight._done.set()
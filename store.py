@@ -0,0 +1,99 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class MemoryStore:
+    """Process-local state store, for a single bot process"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._data.get((namespace, str(key)))
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and time.time() > expires:
+                del self._data[(namespace, str(key))]
+                return default
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        """Store a JSON-serializable value, optionally expiring after ttl seconds"""
+        with self._lock:
+            self._data[(namespace, str(key))] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, str(key)), None)
+
+    def keys(self, namespace):
+        now = time.time()
+        with self._lock:
+            return [
+                key for (ns, key), (_, expires) in self._data.items()
+                if ns == namespace and (expires is None or expires >= now)
+            ]
+
+
+class SQLiteStore:
+    """State store shared through one SQLite file by every process on a host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets readers in other processes proceed during a write
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._db.commit()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires FROM state WHERE namespace = ? AND key = ?", (namespace, str(key))
+            ).fetchone()
+        if row is None or (row[1] is not None and time.time() > row[1]):
+            return default
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        """Store a JSON-serializable value, optionally expiring after ttl seconds"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                (namespace, str(key), json.dumps(value), now + ttl if ttl else None)
+            )
+            self._db.execute("DELETE FROM state WHERE expires < ?", (now,))
+            self._db.commit()
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._db.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+            self._db.commit()
+
+    def keys(self, namespace):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key FROM state WHERE namespace = ? AND (expires IS NULL OR expires >= ?)",
+                (namespace, time.time())
+            ).fetchall()
+        return [key for (key,) in rows]
+
+
+def open_store(url):
+    """Create the store for a STATE_STORE setting: "memory" or "sqlite:///path/to/file.db" """
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported state store: {url}")
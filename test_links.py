@@ -0,0 +1,86 @@
+import pytest
+
+from links import classify, find_links, youtube_video_id
+
+VIDEO = 'dQw4w9WgXcQ'
+WATCH = f'https://www.youtube.com/watch?v={VIDEO}'
+PLAYLIST = 'PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf'
+
+
+@pytest.mark.parametrize('url', [
+    WATCH,
+    f'https://youtube.com/watch?feature=share&v={VIDEO}',
+    f'youtube.com/watch?v={VIDEO}',
+    f'https://youtu.be/{VIDEO}',
+    f'https://youtu.be/{VIDEO}?si=AbCdEfGhIjKlMnOp',
+    f'https://www.youtube.com/shorts/{VIDEO}',
+    f'https://youtube.com/shorts/{VIDEO}?feature=share',
+    f'https://www.youtube.com/embed/{VIDEO}?autoplay=1',
+    f'https://www.youtube-nocookie.com/embed/{VIDEO}',
+    f'https://www.youtube.com/live/{VIDEO}',
+    f'https://m.youtube.com/watch?v={VIDEO}&t=42s',
+    f'https://music.youtube.com/watch?v={VIDEO}&list=RDAMVM{VIDEO}',
+    f'https://WWW.YouTube.com/watch?v={VIDEO}',
+    f'https://www.youtube.com/watch?v={VIDEO}&list={PLAYLIST}&index=3',
+])
+def test_video_links_share_one_watch_url(url):
+    assert classify(url) == ('youtube', VIDEO, WATCH)
+
+
+@pytest.mark.parametrize('url', [
+    f'https://www.youtube.com/playlist?list={PLAYLIST}',
+    f'https://youtube.com/playlist?list={PLAYLIST}&si=AbCdEfGhIjKlMnOp',
+    f'https://music.youtube.com/playlist?list={PLAYLIST}',
+])
+def test_playlist_links(url):
+    assert classify(url) == ('playlist', PLAYLIST, f'https://www.youtube.com/playlist?list={PLAYLIST}')
+
+
+def test_channel_has_no_id():
+    link = classify('https://www.youtube.com/@SomeChannel')
+    assert link == ('youtube', None, 'https://www.youtube.com/@SomeChannel')
+    assert youtube_video_id(link.url) is None
+
+
+def test_too_short_video_id_is_not_a_video():
+    assert classify('https://youtu.be/short').id is None
+
+
+@pytest.mark.parametrize('url, normalized', [
+    ('https://cdn.example.com/files/a.zip', 'https://cdn.example.com/files/a.zip'),
+    ('https://Example.COM/a.zip#section', 'https://example.com/a.zip'),
+    ('https://example.com:443/a.zip', 'https://example.com/a.zip'),
+    ('http://example.com:8080/a.zip', 'http://example.com:8080/a.zip'),
+    ('https://example.com', 'https://example.com/'),
+    (
+        'https://files.example.org/a.zip?utm_source=telegram&id=7&fbclid=xyz&UTM_Campaign=x',
+        'https://files.example.org/a.zip?id=7',
+    ),
+    (
+        'https://s3.amazonaws.com/b/a.zip?X-Amz-Signature=ab%2Fcd&X-Amz-Expires=3600',
+        'https://s3.amazonaws.com/b/a.zip?X-Amz-Signature=ab%2Fcd&X-Amz-Expires=3600',
+    ),
+    ('https://notyoutube.com/watch?v=dQw4w9WgXcQ', 'https://notyoutube.com/watch?v=dQw4w9WgXcQ'),
+])
+def test_direct_links(url, normalized):
+    assert classify(url) == ('direct', normalized, normalized)
+
+
+@pytest.mark.parametrize('url', [
+    'ftp://example.com/a.zip',
+    'example.com/a.zip',
+    'https://example.com:99999/a.zip',
+    'https://example.com:port/a.zip',
+])
+def test_unsupported_links(url):
+    assert classify(url) is None
+
+
+def test_find_links_in_a_sentence():
+    text = (
+        f'Get HTTPS://Example.com/a.zip, then watch (https://youtu.be/{VIDEO}). '
+        'Also "https://example.org/b.pdf"! And ftp://example.com/c.zip'
+    )
+    assert [link.id for link in find_links(text)] == [
+        'https://example.com/a.zip', VIDEO, 'https://example.org/b.pdf',
+    ]
@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+COLUMNS = (
+    'user_id', 'premium', 'premium_expires', 'quota_bytes',
+    'downloads', 'bytes', 'day', 'day_downloads', 'day_bytes',
+)
+DEFAULTS = {
+    'premium': 0, 'premium_expires': None, 'quota_bytes': None,
+    'downloads': 0, 'bytes': 0, 'day': None, 'day_downloads': 0, 'day_bytes': 0,
+}
+
+SELECT_USER = f"SELECT {', '.join(COLUMNS)} FROM users WHERE user_id = ?"
+SET_PREMIUM = (
+    "INSERT INTO users (user_id, premium, premium_expires) VALUES (?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET premium = excluded.premium, premium_expires = excluded.premium_expires"
+)
+SET_QUOTA = (
+    "INSERT INTO users (user_id, quota_bytes) VALUES (?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET quota_bytes = excluded.quota_bytes"
+)
+# Day counters restart when a write lands on a new (UTC) day
+ADD_USAGE = (
+    "INSERT INTO users (user_id, downloads, bytes, day, day_downloads, day_bytes) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "downloads = downloads + excluded.downloads, "
+    "bytes = bytes + excluded.bytes, "
+    "day_downloads = CASE WHEN day = excluded.day THEN day_downloads ELSE 0 END + excluded.day_downloads, "
+    "day_bytes = CASE WHEN day = excluded.day THEN day_bytes ELSE 0 END + excluded.day_bytes, "
+    "day = excluded.day"
+)
+SELECT_PREMIUM = "SELECT user_id, premium_expires FROM users WHERE premium = 1 ORDER BY user_id"
+
+
+class QuotaExceededError(Exception):
+    """Raised when a user has used up today's download quota"""
+
+
+def today():
+    return time.strftime('%Y-%m-%d', time.gmtime())
+
+
+def _add_usage(record, day, downloads, size):
+    record['downloads'] += downloads
+    record['bytes'] += size
+    if record['day'] != day:
+        record.update(day=day, day_downloads=0, day_bytes=0)
+    record['day_downloads'] += downloads
+    record['day_bytes'] += size
+
+
+class UserStore:
+    """Premium status, usage counters and quotas per user, in one SQLite file
+
+    Reads go through an in-process cache that keeps each user for cache_ttl
+    seconds, so the premium check on every button press is a dict lookup;
+    changes made by another process show up once its entry expires. Usage
+    is added up in memory and written by flush() in a single transaction.
+    """
+
+    def __init__(self, path, cache_ttl=30, max_cached=10000):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self._cache = OrderedDict()
+        # user_id -> {day: [downloads, bytes]} not written yet
+        self._pending = {}
+        self._lock = threading.Lock()
+        # The statements above are prepared once and reused from the connection's cache
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, cached_statements=32)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # With WAL a crash can lose the last commits but never corrupts the file
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, "
+            "premium INTEGER NOT NULL DEFAULT 0, premium_expires REAL, quota_bytes INTEGER, "
+            "downloads INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0, "
+            "day TEXT, day_downloads INTEGER NOT NULL DEFAULT 0, day_bytes INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS users_premium ON users (premium) WHERE premium = 1")
+        self._db.commit()
+
+    def get(self, user_id):
+        """A copy of the user's record, including usage not flushed yet"""
+        with self._lock:
+            record = dict(self._record(int(user_id)))
+        if record['day'] != today():
+            record.update(day_downloads=0, day_bytes=0)
+        return record
+
+    def _record(self, user_id):
+        """The user's cached record, loaded if missing or expired; call with the lock held"""
+        now = time.monotonic()
+        entry = self._cache.get(user_id)
+        if entry is not None and now - entry[1] < self.cache_ttl:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        record = self._load(user_id)
+        self._cache[user_id] = (record, now)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return record
+
+    def _load(self, user_id):
+        row = self._db.execute(SELECT_USER, (user_id,)).fetchone()
+        record = dict(zip(COLUMNS, row)) if row else dict(DEFAULTS, user_id=user_id)
+        for day, (downloads, size) in sorted(self._pending.get(user_id, {}).items()):
+            _add_usage(record, day, downloads, size)
+        return record
+
+    def is_premium(self, user_id):
+        # On every button press, so no copy of the record
+        with self._lock:
+            record = self._record(int(user_id))
+            premium, expires = record['premium'], record['premium_expires']
+        return bool(premium) and (expires is None or expires > time.time())
+
+    def daily_quota(self, user_id, default=None):
+        """Bytes the user may download per day: their own quota, else default (None is unlimited)"""
+        quota = self.get(user_id)['quota_bytes']
+        return default if quota is None else quota
+
+    def quota_left(self, user_id, default=None):
+        """Bytes the user may still download today, or None without a quota"""
+        record = self.get(user_id)
+        quota = default if record['quota_bytes'] is None else record['quota_bytes']
+        if quota is None:
+            return None
+        return max(quota - record['day_bytes'], 0)
+
+    def grant(self, user_id, expires=None):
+        """Make a user premium, until the expires timestamp if given"""
+        self._write(SET_PREMIUM, (int(user_id), 1, expires), int(user_id))
+
+    def revoke(self, user_id):
+        self._write(SET_PREMIUM, (int(user_id), 0, None), int(user_id))
+
+    def set_quota(self, user_id, quota_bytes):
+        """Limit the bytes a user downloads per day; None removes the limit"""
+        self._write(SET_QUOTA, (int(user_id), quota_bytes), int(user_id))
+
+    def _write(self, statement, params, user_id):
+        # Admin changes are rare and written right away
+        with self._lock:
+            self._db.execute(statement, params)
+            self._db.commit()
+            self._cache.pop(user_id, None)
+
+    def record_download(self, user_id, size):
+        """Count a finished download; written by the next flush()"""
+        user_id = int(user_id)
+        day = today()
+        with self._lock:
+            counts = self._pending.setdefault(user_id, {}).setdefault(day, [0, 0])
+            counts[0] += 1
+            counts[1] += size
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                _add_usage(entry[0], day, 1, size)
+
+    def flush(self):
+        """Write the pending usage counters in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            rows = [
+                (user_id, downloads, size, day, downloads, size)
+                for user_id, days in self._pending.items()
+                for day, (downloads, size) in sorted(days.items())
+            ]
+            with self._db:
+                self._db.executemany(ADD_USAGE, rows)
+            self._pending.clear()
+            self.flushes += 1
+            return len(rows)
+
+    def premium_users(self):
+        """(user_id, expires) of every premium user, expired ones included"""
+        with self._lock:
+            return self._db.execute(SELECT_PREMIUM).fetchall()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'cached': len(self._cache),
+                'pending': sum(len(days) for days in self._pending.values()),
+                'flushes': self.flushes,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
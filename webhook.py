@@ -0,0 +1,137 @@
+import asyncio
+import hmac
+import json
+
+from telegram import Update
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+
+class StatusServer:
+    """Minimal asyncio HTTP/1.1 server for health checks and metrics scrapes
+
+    GET /healthz answers with health() as JSON and GET /metrics with the
+    text metrics() returns. Connections are kept alive between requests.
+    """
+
+    def __init__(self, health=None, metrics=None, host='0.0.0.0', port=8080,
+                 max_body=1024 * 1024, idle_timeout=75):
+        self.health = health
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    return
+                if not request_line:
+                    return
+                method, target, version = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > self.max_body:
+                    await self._respond(writer, 413, close=True)
+                    return
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._dispatch(method, target.split('?', 1)[0], headers, body)
+                close = (
+                    headers.get('connection', '').lower() == 'close'
+                    or version.strip() == 'HTTP/1.0'
+                )
+                await self._respond(writer, status, payload, close=close)
+                if close:
+                    return
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, headers, body):
+        if path == '/healthz':
+            if method != 'GET':
+                return 405, None
+            return 200, self.health() if self.health else {'status': 'ok'}
+        if path == '/metrics' and self.metrics:
+            if method != 'GET':
+                return 405, None
+            return 200, self.metrics()
+        return 404, None
+
+    async def _respond(self, writer, status, payload=None, close=False):
+        # Metrics are text in the Prometheus exposition format, the rest JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload).encode() if payload is not None else b'', 'application/json'
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+class WebhookServer(StatusServer):
+    """StatusServer that also feeds Telegram webhook updates to an Application
+
+    A POST to path carrying the right X-Telegram-Bot-Api-Secret-Token is
+    parsed into an Update and put on the application's update queue, then
+    answered at once so handlers run concurrently with further deliveries.
+    Connections are kept alive so Telegram can reuse them between updates.
+    """
+
+    def __init__(self, app, path, secret_token, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.path = path
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+
+    async def _dispatch(self, method, path, headers, body):
+        if path != self.path:
+            return await super()._dispatch(method, path, headers, body)
+        if method != 'POST':
+            return 405, None
+
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.rejected += 1
+            return 403, None
+
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, None
+        self.received += 1
+        await self.app.update_queue.put(update)
+        return 200, None
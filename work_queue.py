@@ -0,0 +1,158 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+
+class JobFailedError(Exception):
+    """Raised by wait() when a worker reported a job as failed"""
+
+
+class SQLiteWorkQueue:
+    """Download jobs handed from a front process to worker processes through SQLite
+
+    The front submits a job and waits for its result; workers claim jobs
+    under a lease they keep renewing while the job runs. A job whose worker
+    died is claimed again once its lease runs out. Workers can also attach
+    a progress text to a running job for the front to relay.
+    """
+
+    def __init__(self, path, poll_interval=0.5, keep_finished=3600):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.keep_finished = keep_finished
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'queued', worker TEXT, lease_until REAL, "
+            "progress TEXT, result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    def submit(self, payload):
+        """Queue a JSON-serializable job and return its id"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (payload, created, updated) VALUES (?, ?, ?)",
+                (json.dumps(payload), now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker, lease=60):
+        """Take the oldest queued job, or one whose worker's lease ran out
+
+        Returns (job_id, payload), or None if there is nothing to do.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, payload FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, updated = ? "
+                        "WHERE id = ?",
+                        (worker, now + lease, now, row[0])
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return (row[0], json.loads(row[1])) if row else None
+
+    def renew(self, job_id, worker, lease=60):
+        """Extend the lease on a running job; False if another worker took it over"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_until = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + lease, now, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def report(self, job_id, progress):
+        """Attach the latest progress text to a running job"""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+
+    def finish(self, job_id, result=None, error=None):
+        """Record a job's result, or its error, and forget old finished jobs"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated = ? "
+                "WHERE id = ?",
+                ('failed' if error else 'done', json.dumps(result), error, now, job_id)
+            )
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                (now - self.keep_finished,)
+            )
+
+    def status(self, job_id):
+        """(status, progress, result, error) of a job, or None if it is unknown"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, progress, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, progress, result, error = row
+        return status, progress, json.loads(result) if result else None, error
+
+    async def wait(self, job_id, on_progress=None):
+        """Wait for a job to finish and return its result
+
+        on_progress(text) is called whenever the worker reports new progress.
+        """
+        last_progress = None
+        while True:
+            status, progress, result, error = self.status(job_id)
+            if progress != last_progress and on_progress:
+                on_progress(progress)
+            last_progress = progress
+            if status == 'done':
+                return result
+            if status == 'failed':
+                raise JobFailedError(error)
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict(rows)
+        return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+
+
+class JobProgress:
+    """Relays a worker's progress text to the front, in place of a coalescing flight"""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def publish(self, text):
+        self.queue.report(self.job_id, text)
+
+
+def open_work_queue(url):
+    """Create the queue for a WORK_QUEUE setting
+
+    "local" (None) runs jobs in the bot process itself; "sqlite:///path/to/jobs.db"
+    hands them to worker processes on the same host.
+    """
+    if url == 'local':
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteWorkQueue(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported work queue: {url}")
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+
+class DiskFullError(Exception):
+    """Raised when a job would start while the disk budget is used up"""
+
+
+class Workspaces:
+    """Per-job scratch directories under one root, kept within a disk budget
+
+    Each job writes into its own directory named after its journal key, so
+    same-titled downloads never collide, and a retry can take over the
+    directory of the attempt it resumes. sweep() measures what the root holds and
+    evicts directories and partial files that no running or journaled job
+    refers to once they are older than orphan_age seconds.
+
+    Several processes may share one root. Each sweep first refreshes the
+    modification time of the directories this process is using, so as long
+    as every process sweeps well within orphan_age, none evicts another's.
+    """
+
+    def __init__(self, root, quota=0, min_free=0, orphan_age=3600):
+        self.root = root
+        self.jobs_dir = os.path.join(root, 'jobs')
+        self.quota = quota
+        self.min_free = min_free
+        self.orphan_age = orphan_age
+        self.usage = 0
+        self.evicted = 0
+        self.refused = 0
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        """Stable directory for a journal key"""
+        return os.path.join(self.jobs_dir, hashlib.sha1(key.encode()).hexdigest()[:20])
+
+    def open(self, key, previous=None):
+        """Create the job's directory, taking over previous's directory if it is idle"""
+        path = self.path(key)
+        with self._lock:
+            self._active.add(path)
+            if previous is not None and self.path(previous) not in self._active:
+                try:
+                    os.rename(self.path(previous), path)
+                except OSError:
+                    # Nothing left to take over, or the job already has a directory
+                    pass
+        os.makedirs(path, exist_ok=True)
+        # A directory taken over keeps its age, which would make it look orphaned
+        os.utime(path)
+        return path
+
+    def close(self, key, keep=False):
+        """Release the job's directory, deleting it unless its partial files are still wanted"""
+        path = self.path(key)
+        with self._lock:
+            self._active.discard(path)
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def is_active(self, key):
+        with self._lock:
+            return self.path(key) in self._active
+
+    def free_space(self):
+        os.makedirs(self.root, exist_ok=True)
+        return shutil.disk_usage(self.root).free
+
+    def has_room(self):
+        """Whether the disk budget has room for another job"""
+        return self.free_space() >= self.min_free and not (self.quota and self.usage >= self.quota)
+
+    def admit(self):
+        """Like has_room, counting the jobs turned away"""
+        if not self.has_room():
+            self.refused += 1
+            return False
+        return True
+
+    def sweep(self, keep=(), extra_dirs=()):
+        """Evict unreferenced entries older than orphan_age and recount usage
+
+        keep holds paths that journaled jobs still refer to; extra_dirs are
+        other directories of per-job files (such as journal partials) to clean.
+        """
+        with self._lock:
+            active = list(self._active)
+        for path in active:
+            try:
+                os.utime(path)
+            except OSError:
+                # Closed meanwhile
+                pass
+        now = time.time()
+        keep = set(keep)
+        for directory in (self.jobs_dir, *extra_dirs):
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.path in keep:
+                    continue
+                try:
+                    if now - entry.stat(follow_symlinks=False).st_mtime < self.orphan_age:
+                        continue
+                    # Held across the removal so a job can't reopen the directory meanwhile
+                    with self._lock:
+                        if entry.path in self._active:
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.remove(entry.path)
+                    self.evicted += 1
+                except OSError:
+                    # Removed concurrently, or still held open on Windows
+                    pass
+        self.usage = _tree_size(self.root)
+        return self.usage
+
+    def stats(self):
+        with self._lock:
+            active = len(self._active)
+        return {
+            'active': active,
+            'usage': self.usage,
+            'free': self.free_space(),
+            'evicted': self.evicted,
+            'refused': self.refused,
+        }
+
+
+def _tree_size(path):
+    """Total size in bytes of the files under path"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+    return total